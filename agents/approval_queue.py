@@ -0,0 +1,183 @@
+# agents/approval_queue.py
+"""
+Operator approval of retries (Case C) without blocking the monitoring loop.
+
+In "queue" mode a failed run waiting for approval is stored in the `pending_approval`
+table and MonitoringAgent moves on to other runs. Operators answer through the local
+HTTP endpoint (only started when APPROVAL_HTTP_TOKEN is set; send it as X-Approval-Token):
+    GET  /approvals                     open approvals (JSON)
+    POST /approvals/<run_id>/approve
+    POST /approvals/<run_id>/reject
+or from the command line, against the same pipeline_monitor.db:
+    python -m agents.approval_queue list
+    python -m agents.approval_queue approve <run_id> [--by NAME]
+    python -m agents.approval_queue reject <run_id> [--by NAME]
+Answered approvals are picked up by the next poll cycle.
+"""
+
+import argparse
+import datetime
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import APPROVAL_MODE, APPROVAL_TIMEOUT_SECONDS, APPROVAL_TIMEOUT_ACTION, \
+    APPROVAL_HTTP_HOST, APPROVAL_HTTP_PORT, APPROVAL_HTTP_TOKEN
+
+DECISIONS = {"approve": "approved", "reject": "rejected"}
+
+
+class ApprovalQueue:
+    def __init__(self, db_manager, mode=APPROVAL_MODE, timeout_seconds=APPROVAL_TIMEOUT_SECONDS,
+                 timeout_action=APPROVAL_TIMEOUT_ACTION, on_decision=None):
+        if mode not in ("queue", "prompt", "auto"):
+            raise ValueError(f"Unknown approval mode: {mode}")
+        if timeout_action not in DECISIONS:
+            raise ValueError(f"Unknown approval timeout action: {timeout_action}")
+        self.db = db_manager
+        self.mode = mode
+        self.timeout_seconds = timeout_seconds
+        self.timeout_decision = DECISIONS[timeout_action]
+        # Called after an operator answers through decide(), e.g. to wake the poll loop
+        self.on_decision = on_decision
+        self._prompt_lock = threading.Lock()
+
+    def check(self, run, factory_name=None):
+        """
+        'approved' or 'rejected' if the retry of `run` has been answered, None while it
+        waits for an operator (the request is queued on the first call).
+        """
+        p_name, run_id = run['pipelineName'], run['runId']
+        if self.mode == "auto":
+            return "approved"
+        if self.mode == "prompt":
+            with self._prompt_lock:  # one terminal prompt at a time across workers
+                confirm = input(f"Run {run_id} of {p_name} failed. Retry? (y/n): ").strip().lower()
+            return "approved" if confirm == 'y' else "rejected"
+
+        approval = self.db.get_approval(p_name, run_id)
+        if approval is None:
+            self.db.request_approval(p_name, run_id, factory_name, run.get('message', ''))
+            print(f"[ApprovalQueue] Run {run_id} of {p_name} failed and awaits approval "
+                  f"(python -m agents.approval_queue approve|reject {run_id}).")
+            return None
+        if approval['decision'] is None:
+            return None
+        self.db.delete_approval(p_name, run_id)
+        print(f"[ApprovalQueue] Retry of {p_name} ({run_id}) {approval['decision']} by {approval['decided_by']}.")
+        return approval['decision']
+
+    def expire(self):
+        """Apply the timeout policy to approvals nobody answered in time."""
+        if self.mode != "queue":
+            return 0
+        expired = self.db.expire_approvals(self.timeout_seconds, self.timeout_decision)
+        if expired:
+            print(f"[ApprovalQueue] {expired} approval(s) timed out -> {self.timeout_decision}.")
+        return expired
+
+    def answered(self, factory_name=None):
+        return self.db.list_approvals(decided=True, factory_name=factory_name)
+
+    def waiting_pipelines(self, factory_name=None):
+        return {row['pipeline_name'] for row in self.db.list_approvals(factory_name=factory_name)}
+
+    def decide(self, run_id, action, decided_by):
+        """Answer the open approval of `run_id` with 'approve' or 'reject'. False if none is open."""
+        if action not in DECISIONS:
+            raise ValueError(f"Unknown approval action: {action}")
+        decided = self.db.decide_approval(run_id, DECISIONS[action], decided_by)
+        if decided and self.on_decision:
+            self.on_decision()
+        return decided
+
+
+def _handler_class(queue, token):
+    class ApprovalHandler(BaseHTTPRequestHandler):
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _authorized(self):
+            if self.headers.get("X-Approval-Token") != token:
+                self._reply(401, {"error": "missing or invalid X-Approval-Token"})
+                return False
+            return True
+
+        def do_GET(self):
+            if not self._authorized():
+                return
+            if self.path.rstrip("/") != "/approvals":
+                return self._reply(404, {"error": "not found"})
+            self._reply(200, queue.db.list_approvals())
+
+        def do_POST(self):
+            if not self._authorized():
+                return
+            parts = self.path.strip("/").split("/")
+            if len(parts) != 3 or parts[0] != "approvals" or parts[2] not in DECISIONS:
+                return self._reply(404, {"error": "not found"})
+            run_id, action = parts[1], parts[2]
+            decided_by = f"http:{self.client_address[0]}"
+            if not queue.decide(run_id, action, decided_by):
+                return self._reply(409, {"error": f"no open approval for run {run_id}"})
+            self._reply(200, {"run_id": run_id, "decision": DECISIONS[action]})
+
+        def log_message(self, format, *args):
+            print(f"[ApprovalServer] {self.address_string()} {format % args}")
+
+    return ApprovalHandler
+
+
+def start_approval_server(queue, host=APPROVAL_HTTP_HOST, port=APPROVAL_HTTP_PORT, token=APPROVAL_HTTP_TOKEN):
+    """
+    Serve the approval endpoint from a daemon thread. Returns the server, or None if disabled.
+    Anyone reaching it could approve reruns, so it only starts with a token.
+    """
+    if queue.mode != "queue" or not port:
+        return None
+    if not token:
+        print("[ApprovalServer] APPROVAL_HTTP_TOKEN not set; endpoint disabled, use the CLI to answer approvals.")
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _handler_class(queue, token))
+    except OSError as e:
+        print(f"[ApprovalServer] Could not listen on {host}:{port} ({e}); use the CLI to answer approvals.")
+        return None
+    threading.Thread(target=server.serve_forever, name="approval-server", daemon=True).start()
+    print(f"[ApprovalServer] Listening on http://{host}:{port}/approvals")
+    return server
+
+
+def main():
+    from db_manager import DBManager
+
+    parser = argparse.ArgumentParser(description="List and answer pending retry approvals")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="show open approvals")
+    for action in DECISIONS:
+        p = sub.add_parser(action, help=f"{action} the retry of a failed run")
+        p.add_argument("run_id")
+        p.add_argument("--by", default="cli")
+    args = parser.parse_args()
+
+    queue = ApprovalQueue(DBManager(), mode="queue")
+    if args.command == "list":
+        rows = queue.db.list_approvals()
+        if not rows:
+            print("No open approvals.")
+        for row in rows:
+            requested = datetime.datetime.fromtimestamp(row['requested_at']).strftime('%Y-%m-%d %H:%M:%S')
+            print(f"{row['original_run_id']}  {row['pipeline_name']}  (since {requested})\n    {row['error_message']}")
+        return
+    if queue.decide(args.run_id, args.command, args.by):
+        print(f"Run {args.run_id}: {DECISIONS[args.command]}.")
+    else:
+        print(f"No open approval for run {args.run_id}.")
+
+
+if __name__ == "__main__":
+    main()
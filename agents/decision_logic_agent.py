@@ -1,18 +1,76 @@
 # agents/decision_logic_agent.py
 
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+from config import MAX_CONCURRENT_RUNS
+from agents.retry_state import RetryStateMachine
 from rag.rag_solution_retriever import RAGSolutionRetriever
+from services.arm_requests import ArmResult
+from services.failure_rules import FailureRuleClassifier
+
+def failure_details(run):
+    """
+    (activity, error_message, failure_type) for a failed run. Uses the root-cause activity
+    attached by MonitoringAgent ('failedActivity') when known, else the run's own message.
+    """
+    activity = run.get('failedActivity')
+    if not activity:
+        return None, run.get('message', ''), None
+    error_message = (f"ErrorCode={activity['errorCode']}, FailureType={activity['failureType']}, "
+                     f"Activity={activity['activityName']} ({activity['activityType']}): {activity['message']}")
+    return activity['activityName'], error_message, activity['failureType']
 
 class DecisionLogicAgent:
-    def __init__(self, openai_client, trigger_rerun_agent, notifier, db_manager):
+    def __init__(self, openai_client, trigger_rerun_agent, notifier, db_manager, rag_retriever=None,
+                 failure_rules=None, retry_state=None):
         self.openai_client = openai_client
         self.trigger_rerun_agent = trigger_rerun_agent
         self.notifier = notifier
         self.db = db_manager
-        self.rag = RAGSolutionRetriever()
-
-    def evaluate_failure(self, pipeline_name, activity, error_message, run_id, escalation_needed=False):
-        run_info = self.db.get_run_info(pipeline_name, run_id)
+        # Retry state of the factory's failed runs, shared with its MonitoringAgent
+        self.retries = retry_state or RetryStateMachine(db_manager, trigger_rerun_agent.adf_client.factory_name)
+        # A retriever can be shared between the agents of several factories
+        self.rag = rag_retriever or RAGSolutionRetriever(db_manager=db_manager)
+        # Known failure causes are decided locally; only unmatched failures go to GPT
+        self.rules = failure_rules or FailureRuleClassifier()
+        # KB lookups run here, alongside the rerun of the failed pipeline
+        self._rag_executor = ThreadPoolExecutor(max_workers=max(1, MAX_CONCURRENT_RUNS), thread_name_prefix="rag")
+        # run_id -> AI decision classified ahead of time by prefetch_decisions
+        self._prefetched = {}
+
+    def prefetch_decisions(self, failed_runs):
+        """
+        Classify failures that are about to be evaluated in one batched GPT request, so
+        that the evaluate_failure calls that follow don't each make their own round trip.
+        Failures matched by a local rule are decided here and left out of the request.
+        Only pass runs evaluated right after (not runs that still wait for approval).
+        """
+        self._prefetched.clear()  # drop leftovers from runs that were never evaluated
+        runs = []
+        for run in failed_runs:
+            info = self.retries.get(run['pipelineName'], run['runId'])
+            if info and (info.get("notified") == 1 or info.get("retry_count", 0) < 1):
+                continue
+            activity, error_message, failure_type = failure_details(run)
+            # Counted here only if decided here; otherwise evaluate_failure classifies (and counts) it
+            rule_result = self.rules.classify(error_message, failure_type, record=False)
+            if rule_result:
+                self.rules.record(rule_result)
+                self._prefetched[run['runId']] = rule_result
+                continue
+            runs.append((run, activity, error_message))
+        if len(runs) >= 2:
+            decisions = self.openai_client.ask_gpt_batch([
+                {"pipeline_name": r['pipelineName'], "activity": activity, "error_message": error_message}
+                for r, activity, error_message in runs
+            ])
+            for (run, _, _), decision in zip(runs, decisions):
+                self.rules.record(None)
+                self._prefetched[run['runId']] = decision
+
+    def evaluate_failure(self, pipeline_name, activity, error_message, run_id, escalation_needed=False,
+                         failure_type=None):
+        run_info = self.retries.get(pipeline_name, run_id)
 
         # Check if notification already sent for this failure
         if run_info and run_info.get("notified") == 1:
@@ -21,24 +79,36 @@ class DecisionLogicAgent:
 
         print(f"[DecisionLogicAgent] Evaluating failure for pipeline '{pipeline_name}', run ID: {run_id}")
 
-        ai_result = self.openai_client.ask_gpt(pipeline_name, activity, error_message)
+        ai_result = self._prefetched.pop(run_id, None) or self.rules.classify(error_message, failure_type)
+        if ai_result and ai_result.get("rule"):
+            stats = self.rules.stats()
+            print(f"[DecisionLogicAgent] Local rule '{ai_result['rule']}' decided in {ai_result['elapsed_us']:.0f} us "
+                  f"- GPT skipped ({stats['matched']} of {stats['matched'] + stats['sent_to_gpt']} failures decided by rules).")
+        ai_result = ai_result or self.openai_client.ask_gpt(pipeline_name, activity, error_message)
         failure_rationale = ai_result.get('rationale', '').strip()
 
         print(f"[DecisionLogicAgent] AI Action: {ai_result['action']}")
         print(f"[DecisionLogicAgent] AI Rationale: {failure_rationale}")
 
-        rag_solution = self.rag.get_solution(failure_rationale) if failure_rationale else "No documented solution found."
-        if rag_solution:
-            print(f"[DecisionLogicAgent] Retrieved solution from KB:\n{rag_solution}")
+        # Look up the KB solution in the background; the rerun doesn't wait for it
+        rag_future = self._rag_executor.submit(self.rag.get_solution, failure_rationale, error_message) \
+            if failure_rationale else None
 
         rerun_outcome = None
-        if ai_result['action'] in ("full", "partial"):
-            rerun_outcome = self.trigger_rerun_agent.rerun(run_id)
+        if ai_result['action'] in ("full", "partial") and 'not recoverable' not in failure_rationale.lower() \
+                and not escalation_needed:
+            rerun_outcome = self._rerun_once(pipeline_name, run_id, run_info,
+                                             recovery=ai_result['action'] == "partial")
+
+        rag_solution = rag_future.result() if rag_future else "No documented solution found."
+        if rag_solution:
+            print(f"[DecisionLogicAgent] Retrieved solution from KB:\n{rag_solution}")
 
         # Compose single notification message
         notification_message = (
             f"Pipeline: {pipeline_name}\n"
             f"Run ID: {run_id}\n"
+            f"Failed Activity: {activity or 'unknown'}\n"
             f"AI Decision: {ai_result['action']}\n"
             f"Rationale:\n{failure_rationale}\n\n"
             f"--- Suggested Solution from Knowledge Base ---\n{rag_solution}\n"
@@ -54,16 +124,57 @@ class DecisionLogicAgent:
         self.notifier.notify_custom(pipeline_name, run_id, notification_message)
 
         # Mark as notified
-        self.db.update_retry(
-            pipeline_name,
-            run_id,
-            notified=1,
-            last_notification_time=datetime.datetime.utcnow().isoformat()
-        )
+        self.retries.mark_notified(pipeline_name, run_id, datetime.datetime.utcnow().isoformat())
+
+        return dict(ai_result, rerun_outcome=rerun_outcome)
+
+    def _rerun_once(self, pipeline_name, run_id, run_info, recovery=False):
+        """
+        Rerun the failed pipeline at most once per decision. The idempotency key (run ID +
+        retries left) is recorded durably before the ADF call, so a repeated
+        evaluation of the same failure never starts a second rerun. If ARM is unavailable, or
+        the request's outcome is unknown (indeterminate), the rerun is deferred (status
+        'deferred') and a later cycle issues it unless ADF shows it was started after all.
+        """
+        rerun_key = f"{run_id}:{run_info['retry_count'] if run_info else 0}"
+        if not self.retries.claim_rerun(pipeline_name, run_id, rerun_key):
+            info = self.retries.get(pipeline_name, run_id)
+            print(f"[DecisionLogicAgent] Rerun {rerun_key} for {pipeline_name} already issued - not rerunning again.")
+            if info and info['status'] == "running" and info['last_attempt_run_id']:
+                return ArmResult(ArmResult.OK, {"runId": info['last_attempt_run_id']})
+            return None
 
-        return ai_result
+        # After a failed retry, rerun (and resume) that retry: it is the run group's latest run
+        reference_run_id = (run_info or {}).get('last_attempt_run_id') or run_id
+        outcome = self.trigger_rerun_agent.rerun(reference_run_id, pipeline_name=pipeline_name, recovery=recovery)
+        if outcome.ok and 'runId' in outcome.value:
+            self.retries.rerun_started(pipeline_name, run_id, outcome.value['runId'],
+                                       action="partial" if recovery else "full")
+        elif outcome.unavailable or outcome.indeterminate:
+            self.retries.defer(pipeline_name, run_id, "partial" if recovery else "full")
+            print(f"[DecisionLogicAgent] ARM {outcome.status}; rerun of {pipeline_name} ({run_id}) deferred.")
+        return outcome
+
+    def rerun_deferred(self, pipeline_name, run_id, action):
+        """
+        Issue a rerun deferred by _rerun_once, with the action decided back then. The earlier
+        request may have been executed although its reply was lost, so a rerun ADF already
+        started is adopted instead of starting another.
+        """
+        run_info = self.retries.get(pipeline_name, run_id)
+        found = self.trigger_rerun_agent.adf_client.find_rerun(
+            (run_info or {}).get('last_attempt_run_id') or run_id)
+        if not found.ok:
+            return found  # can't tell yet (stays deferred), or the original run can't be read
+        if found.value:
+            print(f"[DecisionLogicAgent] Deferred rerun of {pipeline_name} ({run_id}) was already started "
+                  f"as {found.value['runId']} - not rerunning again.")
+            self.retries.rerun_started(pipeline_name, run_id, found.value['runId'], action=action)
+            return ArmResult(ArmResult.OK, {"runId": found.value['runId']})
+        return self._rerun_once(pipeline_name, run_id, run_info, recovery=action == "partial")
 
     def notify_max_retries_exceeded(self, pipeline_run, run_id):
         pipeline_name = pipeline_run['pipelineName']
-        error_message = pipeline_run.get('message', 'No error message provided.')
-        self.evaluate_failure(pipeline_name, None, error_message, run_id, escalation_needed=True)
+        activity, error_message, failure_type = failure_details(pipeline_run)
+        self.evaluate_failure(pipeline_name, activity, error_message or 'No error message provided.', run_id,
+                              escalation_needed=True, failure_type=failure_type)
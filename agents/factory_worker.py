@@ -0,0 +1,120 @@
+# agents/factory_worker.py
+
+import math
+import os
+import socket
+import time
+from config import ADF_FACTORIES, FACTORY_LEASE_TTL_SECONDS, METRICS_HTTP_PORT, INGEST_HTTP_PORT, \
+    INGEST_CHECK_SECONDS
+from db_manager import DBManager
+from agents.approval_queue import ApprovalQueue
+from agents.decision_logic_agent import DecisionLogicAgent
+from agents.monitoring_agent import MonitoringAgent
+from agents.notifier import Notifier
+from agents.retry_state import RetryStateMachine
+from agents.trigger_rerun_agent import TriggerRerunAgent
+from rag.rag_solution_retriever import RAGSolutionRetriever
+from services.adf_client import AzureDataFactoryClient
+from services.arm_requests import ArmRequestEngine
+from services.azure_credentials import AzureTokenCredential, create_pooled_session
+from services.openai_client import OpenAIClient
+from services.decision_cache import DecisionCache
+from services.failure_rules import FailureRuleClassifier
+from services.metrics import start_metrics_server
+from services.run_history import RunHistory
+
+
+class FactoryWorker:
+    """
+    Monitors a share of ADF_FACTORIES in one process. Factories are claimed through
+    leases in the shared `monitor_lease` table, so any number of worker processes,
+    on one node or many, split the factories between them and never poll (or rerun
+    runs of) the same factory at once. A factory whose owner dies is picked up by
+    another worker once its lease expires.
+    """
+
+    def __init__(self, worker_index=0, worker_count=1, factories=None):
+        self.factories = factories or ADF_FACTORIES
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        # Start scanning at a different offset per worker so first claims spread out
+        offset = worker_index % len(self.factories)
+        self.scan_order = self.factories[offset:] + self.factories[:offset]
+        self.max_factories = math.ceil(len(self.factories) / max(1, worker_count))
+
+        self.db = DBManager()
+        self.notifier = Notifier(self.db)
+        self.openai_client = OpenAIClient(DecisionCache(self.db))
+        self.session = create_pooled_session()
+        self.credential = AzureTokenCredential(session=self.session)
+        # One set of ARM rate limits and circuit breakers for all factories of this worker
+        self.engine = ArmRequestEngine(self.session, self.credential)
+        self.rag = RAGSolutionRetriever(db_manager=self.db)
+        self.failure_rules = FailureRuleClassifier()
+        self.approvals = ApprovalQueue(self.db)
+        # One run-history buffer (and maintenance schedule) for all factories of this worker
+        self.history = RunHistory(self.db)
+        self.agents = {}  # factory_name -> [MonitoringAgent, next_due_time]
+
+    def _build_agent(self, factory):
+        adf_client = AzureDataFactoryClient(factory, credential=self.credential, session=self.session,
+                                            engine=self.engine)
+        trigger_agent = TriggerRerunAgent(adf_client)
+        decision_agent = DecisionLogicAgent(self.openai_client, trigger_agent, self.notifier, self.db,
+                                            rag_retriever=self.rag, failure_rules=self.failure_rules,
+                                            retry_state=RetryStateMachine(self.db, factory["factory_name"],
+                                                                          history=self.history))
+        return MonitoringAgent(adf_client, decision_agent, self.db, lease_owner=self.owner,
+                               approval_queue=self.approvals)
+
+    def run(self):
+        print(f"[FactoryWorker] {self.owner} starting (up to {self.max_factories} of "
+              f"{len(self.factories)} factories).")
+        while True:
+            self._claim_and_poll()
+            # Wake for the next due factory, but often enough to renew our leases
+            now = time.time()
+            next_due = min([due for _, due in self.agents.values()], default=now + FACTORY_LEASE_TTL_SECONDS)
+            if INGEST_HTTP_PORT:
+                next_due = min(next_due, now + INGEST_CHECK_SECONDS)  # pick up pushed failures quickly
+            time.sleep(max(1, min(next_due - now, FACTORY_LEASE_TTL_SECONDS / 3)))
+
+    def _claim_and_poll(self):
+        for factory in self.scan_order:
+            name = factory["factory_name"]
+            owned = name in self.agents
+            if not owned and len(self.agents) >= self.max_factories:
+                continue
+
+            if not self.db.acquire_lease(f"factory:{name}", self.owner, FACTORY_LEASE_TTL_SECONDS):
+                if owned:
+                    print(f"[FactoryWorker] Lost lease on factory {name}.")
+                    agent = self.agents.pop(name)[0]
+                    try:
+                        agent.retries.flush()  # hand over our journaled retry state
+                    except Exception as e:
+                        print(f"[FactoryWorker] ERROR saving retry state of factory {name}: {e}")
+                continue
+            if not owned:
+                print(f"[FactoryWorker] {self.owner} now monitoring factory {name}.")
+                self.agents[name] = [self._build_agent(factory), 0]
+
+            agent, due = self.agents[name]
+            if time.time() >= due:
+                try:
+                    had_activity = agent.run_cycle()
+                    self.agents[name][1] = time.time() + agent.next_interval(had_activity)
+                except Exception as e:
+                    print(f"[FactoryWorker] ERROR polling factory {name}: {e}")
+                    self.agents[name][1] = time.time() + agent.scheduler.base_interval
+            elif agent.ingest_enabled:
+                try:
+                    agent.process_pushed_failures()
+                except Exception as e:
+                    print(f"[FactoryWorker] ERROR processing pushed failures of factory {name}: {e}")
+
+
+def run_worker(worker_index, worker_count):
+    """Process entry point for multi-factory mode."""
+    # Metrics are per process: each worker serves its own endpoint
+    start_metrics_server(port=METRICS_HTTP_PORT + worker_index if METRICS_HTTP_PORT else 0)
+    FactoryWorker(worker_index, worker_count).run()
@@ -0,0 +1,246 @@
+# agents/failure_ingest.py
+"""
+Push-based failure ingestion, alongside polling.
+
+A small local HTTP receiver accepts pipeline-run-failed notifications:
+    POST /events    Event Grid events (Event Grid or CloudEvents 1.0 schema, single or
+                    batched) whose data carries the run (runId, pipelineName, ...), or an
+                    Azure Monitor alert in the common alert schema (log alerts on
+                    ADFPipelineRun carry the failed runs in their search results)
+Event Grid's subscription validation handshake (SubscriptionValidationEvent, and the
+CloudEvents OPTIONS request) is answered here. Valid failures of monitored pipelines are
+deduplicated and queued in the `failure_inbox` table; MonitoringAgent takes them from
+there and handles them like polled failures. Alerts that name a factory but no runs
+(e.g. metric alerts on PipelineFailedRuns) start a reconciliation poll instead.
+
+To try it offline, replay payloads with `python -m benchmarks.replay_events`.
+"""
+
+import hmac
+import json
+import re
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from config import ADF_FACTORIES, INGEST_HTTP_HOST, INGEST_HTTP_PORT, INGEST_HTTP_TOKEN
+from services.metrics import metrics
+
+VALIDATION_EVENT_TYPE = "Microsoft.EventGrid.SubscriptionValidationEvent"
+ALERT_SCHEMA_ID = "azureMonitorCommonAlertSchema"
+MAX_BODY_BYTES = 1024 * 1024  # Event Grid batches are at most 1 MB
+
+_FACTORY_PATH = re.compile(r"/factories/([^/]+)", re.IGNORECASE)
+_RUN_PATH = re.compile(r"/pipelineruns/([^/]+)", re.IGNORECASE)
+
+# Event / log-row field (lower case) -> run field as returned by queryPipelineRuns
+RUN_FIELDS = {
+    "runid": "runId",
+    "pipelinename": "pipelineName",
+    "status": "status",
+    "message": "message",
+    "errormessage": "message",
+    "failuremessage": "message",
+    "runstart": "runStart",
+    "start": "runStart",
+    "runend": "runEnd",
+    "end": "runEnd",
+    "lastupdated": "lastUpdated",
+    "timegenerated": "lastUpdated",
+}
+
+
+class FailureIngestor:
+    def __init__(self, db_manager, factories=None, on_failure=None, on_alert=None):
+        self.db = db_manager
+        self.factories = {(f["factory_name"] or "").lower(): f for f in (factories or ADF_FACTORIES)}
+        # Called with the factory name once failures of it are queued / an alert without
+        # runs arrived, e.g. to wake that factory's monitoring loop
+        self.on_failure = on_failure
+        self.on_alert = on_alert
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def ingest(self, payload):
+        """
+        Validate, dedupe and queue the failures in one request body. Returns a summary
+        {"accepted", "duplicates", "ignored"}, or {"validationResponse": code} for
+        Event Grid's subscription validation.
+        """
+        runs, alerted, ignored = [], set(), 0
+        for event in payload if isinstance(payload, list) else [payload]:
+            if not isinstance(event, dict):
+                ignored += 1
+                continue
+            event_type = event.get("eventType") or event.get("type") or ""
+            data = event.get("data") if isinstance(event.get("data"), dict) else event
+            if event_type == VALIDATION_EVENT_TYPE:
+                return {"validationResponse": data.get("validationCode")}
+            if event.get("schemaId") == ALERT_SCHEMA_ID:
+                alert_runs, factories = self._parse_alert(data)
+                runs += alert_runs
+                alerted |= factories
+                continue
+            run = self._parse_run(data, event.get("subject") or event.get("source") or "", event_type)
+            if run:
+                runs.append(run)
+            else:
+                ignored += 1
+
+        valid = []
+        for run in runs:
+            if self._resolve_factory(run):
+                valid.append(run)
+            else:
+                ignored += 1
+        queued = self.db.enqueue_pushed_failures(valid) if valid else []
+        result = {"accepted": len(queued), "duplicates": len(valid) - len(queued), "ignored": ignored}
+        with self._lock:
+            self.stats.update(result)
+        for name, value in result.items():
+            metrics.count(f"ingest.{name}", value)
+
+        if queued:
+            print(f"[FailureIngest] Queued {len(queued)} pushed failure(s): "
+                  + ", ".join(f"{r['pipelineName']} ({r['runId']})" for r in queued))
+        for factory_name in sorted({r['factoryName'] for r in queued}):
+            if self.on_failure:
+                self.on_failure(factory_name)
+        for factory_name in sorted(alerted - {r['factoryName'] for r in queued}):
+            print(f"[FailureIngest] Alert for factory {factory_name} without run details; polling now.")
+            if self.on_alert:
+                self.on_alert(factory_name)
+        return result
+
+    def _parse_run(self, data, subject="", event_type=""):
+        """Run dict from one event's data / one log row, or None if it isn't a failed run."""
+        run = {}
+        for key, value in data.items():
+            field = RUN_FIELDS.get(str(key).lower())
+            if field and value not in (None, "") and field not in run:
+                run[field] = value
+            elif str(key).lower() in ("factoryname", "resource", "_resourceid", "resourceid") and value:
+                match = _FACTORY_PATH.search(str(value))
+                run.setdefault("factoryName", match.group(1) if match else str(value))
+        if "runId" not in run:
+            match = _RUN_PATH.search(subject)
+            if match:
+                run["runId"] = match.group(1)
+        if "factoryName" not in run:
+            match = _FACTORY_PATH.search(subject)
+            if match:
+                run["factoryName"] = match.group(1)
+
+        status = str(run.get("status") or "")
+        failed = status.lower() == "failed" or (not status and "fail" in event_type.lower())
+        if not failed or not run.get("runId") or not run.get("pipelineName"):
+            return None
+        run["status"] = "Failed"
+        run.setdefault("message", "")
+        return run
+
+    def _parse_alert(self, data):
+        """(failed runs, factories alerted without run details) from a common-schema alert."""
+        essentials = data.get("essentials") or {}
+        if essentials.get("monitorCondition") == "Resolved":
+            return [], set()
+        factories = set()
+        for target in essentials.get("alertTargetIDs") or []:
+            match = _FACTORY_PATH.search(target)
+            if match:
+                factories.add(match.group(1))
+
+        runs = []
+        search_results = (data.get("alertContext") or {}).get("SearchResults") or {}
+        for table in search_results.get("tables") or []:
+            columns = [c.get("name") for c in table.get("columns", [])]
+            for row in table.get("rows", []):
+                run = self._parse_run(dict(zip(columns, row)))
+                if run:
+                    if "factoryName" not in run and len(factories) == 1:
+                        run["factoryName"] = next(iter(factories))
+                    runs.append(run)
+        known = {name for name in factories if name.lower() in self.factories}
+        return runs, {self.factories[name.lower()]["factory_name"] for name in known}
+
+    def _resolve_factory(self, run):
+        """Fill in the configured factory name; False unless the run is one we monitor."""
+        name = run.get("factoryName")
+        if name is None and len(self.factories) == 1:
+            factory = next(iter(self.factories.values()))
+        else:
+            factory = self.factories.get((name or "").lower())
+        if factory is None or run["pipelineName"] not in factory["pipelines"]:
+            return False
+        run["factoryName"] = factory["factory_name"]
+        return True
+
+
+def _handler_class(ingestor, token):
+    class IngestHandler(BaseHTTPRequestHandler):
+        def _reply(self, status, payload, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _authorized(self):
+            if not token:
+                return True
+            supplied = self.headers.get("X-Ingest-Token") or \
+                (parse_qs(urlparse(self.path).query).get("token") or [""])[0]
+            if hmac.compare_digest(supplied.encode("utf-8"), token.encode("utf-8")):
+                return True
+            self._reply(401, {"error": "missing or invalid ingest token"})
+            return False
+
+        def do_OPTIONS(self):
+            # CloudEvents 1.0 webhook validation (Event Grid with the CloudEvents schema)
+            if not self._authorized():
+                return
+            origin = self.headers.get("WebHook-Request-Origin")
+            if not origin:
+                return self._reply(400, {"error": "missing WebHook-Request-Origin"})
+            self._reply(200, {}, headers={"WebHook-Allowed-Origin": origin, "WebHook-Allowed-Rate": "*"})
+
+        def do_POST(self):
+            if not self._authorized():
+                return
+            if urlparse(self.path).path.rstrip("/") not in ("", "/events"):
+                return self._reply(404, {"error": "not found"})
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > MAX_BODY_BYTES:
+                return self._reply(413, {"error": "payload too large"})
+            try:
+                payload = json.loads(self.rfile.read(length) or b"null")
+            except ValueError:
+                return self._reply(400, {"error": "body is not valid JSON"})
+            try:
+                result = ingestor.ingest(payload)
+            except Exception as e:
+                print(f"[FailureIngest] ERROR ingesting payload: {e}")
+                return self._reply(500, {"error": "ingestion failed"})  # Event Grid retries 5xx
+            self._reply(200, result)
+
+        def log_message(self, format, *args):
+            print(f"[FailureIngest] {self.address_string()} {format % args}")
+
+    return IngestHandler
+
+
+def start_ingest_server(ingestor, host=INGEST_HTTP_HOST, port=INGEST_HTTP_PORT, token=INGEST_HTTP_TOKEN):
+    """Serve the ingestion endpoint from a daemon thread. Returns the server, or None if disabled."""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _handler_class(ingestor, token))
+    except OSError as e:
+        print(f"[FailureIngest] Could not listen on {host}:{port} ({e}); relying on polling only.")
+        return None
+    threading.Thread(target=server.serve_forever, name="ingest-server", daemon=True).start()
+    print(f"[FailureIngest] Listening on http://{host}:{port}/events")
+    return server
@@ -1,116 +1,471 @@
 import time
 import datetime
-from config import PIPELINES_TO_MONITOR
-from db_manager import DBManager
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import POLL_INITIAL_LOOKBACK_HOURS, POLL_OVERLAP_SECONDS, SEEN_RUNS_MAX_ENTRIES, \
+    SEEN_RUNS_TTL_SECONDS, MAX_CONCURRENT_RUNS, RUN_LEASE_TTL_SECONDS, INGEST_HTTP_PORT, \
+    INGEST_RECONCILE_INTERVAL_SECONDS, INGEST_DEDUPE_TTL_SECONDS, INGEST_CLAIM_SECONDS
+from agents.approval_queue import ApprovalQueue
+from agents.decision_logic_agent import failure_details
+from agents.poll_scheduler import PollScheduler
+from services.metrics import metrics
+from services.run_history import parse_adf_time
+
+
+class SeenRunIds:
+    """
+    Run IDs already handled by this monitor, so runs re-read in the watermark overlap
+    are skipped without touching the DB. Entries expire after `ttl_seconds` and the
+    oldest are evicted once `max_entries` is reached.
+    """
+
+    def __init__(self, max_entries=SEEN_RUNS_MAX_ENTRIES, ttl_seconds=SEEN_RUNS_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+
+    def __contains__(self, run_id):
+        added_at = self._entries.get(run_id)
+        if added_at is None:
+            return False
+        if time.monotonic() - added_at > self.ttl_seconds:
+            del self._entries[run_id]
+            return False
+        return True
+
+    def add(self, run_id):
+        self._entries[run_id] = time.monotonic()
+        self._entries.move_to_end(run_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
 
 class MonitoringAgent:
-    def __init__(self, adf_client, decision_agent):
+    def __init__(self, adf_client, decision_agent, db_manager, lease_owner=None, approval_queue=None):
         self.adf_client = adf_client
         self.decision_agent = decision_agent
-        self.db = DBManager()
+        self.db = db_manager
+        # In-memory retry state of this factory's failed runs (agents/retry_state.py)
+        self.retries = decision_agent.retries
+        self.factory_name = adf_client.factory_name
+        # Set in multi-factory mode: runs are only processed while we hold their lease
+        self.lease_owner = lease_owner
+        self.seen_runs = SeenRunIds()
+        # With push ingestion, failures arrive within seconds and polling only reconciles
+        self.ingest_enabled = bool(INGEST_HTTP_PORT)
+        self.scheduler = PollScheduler(base_interval=INGEST_RECONCILE_INTERVAL_SECONDS) \
+            if self.ingest_enabled else PollScheduler()
+        # Retry approvals (Case C) are queued instead of blocking the loop on a prompt
+        self.approvals = approval_queue or ApprovalQueue(db_manager)
+        self._wakeup = threading.Event()
+        self._cycle_requested = False
+
+        # Independent runs are processed in parallel; work on the same
+        # (pipeline_name, original_run_id) row is serialized by a per-row lock
+        self.max_concurrent_runs = max(1, MAX_CONCURRENT_RUNS)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrent_runs,
+                                           thread_name_prefix="run-worker") \
+            if self.max_concurrent_runs > 1 else None
+        self._row_locks = weakref.WeakValueDictionary()
+        self._row_locks_guard = threading.Lock()
 
     def poll(self):
         print("[MonitoringAgent] Starting monitoring loop.")
+        try:
+            self._poll_forever()
+        finally:
+            self.retries.flush()
 
+    def _poll_forever(self):
         while True:
-            # --- 1. Get failed/successful runs for monitored pipelines ---
-            failed_runs = [r for r in self.adf_client.get_failed_pipelines()
-                           if r['pipelineName'] in PIPELINES_TO_MONITOR]
-            succeeded_runs = [r for r in self.adf_client.get_successful_pipelines()
-                              if r['pipelineName'] in PIPELINES_TO_MONITOR]
-
-            # --- 2. Reset retry records for successful runs ---
-            for run in succeeded_runs:
-                self.db.delete_run(run['pipelineName'], run['runId'])
-                print(f"[MonitoringAgent] SUCCESS: {run['pipelineName']} run {run['runId']} -> Retry reset.")
+            had_activity = self.run_cycle()
 
-            # --- 3. Process failed runs ---
-            for run in failed_runs:
-                p_name, orig_run_id = run['pipelineName'], run['runId']
-
-                # Insert or ignore if already exists
-                self.db.insert_run(p_name, orig_run_id, retry_count=2)
-                info = self.db.get_run_info(p_name, orig_run_id)
-                retries_left, last_attempt_id, status = (
-                    info['retry_count'],
-                    info['last_attempt_run_id'],
-                    info['status']
-                )
-
-                # --- Case A: Last retry still running ---
-                if status == "running" and last_attempt_id:
-                    attempt_status = self.adf_client.get_pipeline_run_status(last_attempt_id)['status']
-                    print(f"[MonitoringAgent] Last retry run {last_attempt_id} is {attempt_status}")
-                    if attempt_status.lower() == "inprogress":
-                        continue  # Wait until finished
-                    elif attempt_status.lower() == "succeeded":
-                        self.db.delete_run(p_name, orig_run_id)
-                        print(f"[MonitoringAgent] Retry succeeded for {p_name} ({orig_run_id}). Reset.")
-                        continue
-                    elif attempt_status.lower() == "failed":
-                        retries_left -= 1
-                        self.db.update_retry(p_name, orig_run_id, retry_count=retries_left, status="pending")
-                        print(f"[MonitoringAgent] Retry failed for {p_name} ({orig_run_id}). Retries left={retries_left}")
-                        # If this was last retry, escalate now
-                        if retries_left < 1:
-                            self.decision_agent.notify_max_retries_exceeded(run, orig_run_id)
-                        continue
-
-                # --- Case B: No retries left ---
-                if retries_left < 1:
-                    self.decision_agent.notify_max_retries_exceeded(run, orig_run_id)
-                    continue
-
-                # --- Case C: Prompt for retry ---
-                confirm = input(f"Run {orig_run_id} of {p_name} failed. Retry? (y/n): ").strip().lower()
-                if confirm != 'y':
-                    # Mark retries exhausted + escalate
-                    self.db.update_retry(p_name, orig_run_id, retry_count=0)
-                    self.decision_agent.notify_max_retries_exceeded(run, orig_run_id)
-                    continue
-
-                # --- Case D: AI Evaluation before retry ---
-                ai_res = self.decision_agent.evaluate_failure(
-                    pipeline_name=p_name,
-                    activity=None,
-                    error_message=run.get('message', ''),
-                    run_id=orig_run_id
-                )
-
-                if ai_res is None:
-                    # Notification was skipped because already sent
-                    continue
-
-                if ai_res['action'] == "none" or 'not recoverable' in ai_res['rationale'].lower():
-                    self.db.update_retry(p_name, orig_run_id, retry_count=0)
-                    self.decision_agent.notify_max_retries_exceeded(run, orig_run_id)
-                    continue
-
-                # --- Case E: Trigger actual retry ---
-                outcome = self.decision_agent.trigger_rerun_agent.rerun(orig_run_id)
-
-                if not outcome or 'runId' not in outcome:
-                    print(f"[MonitoringAgent] ERROR: Rerun for {p_name} ({orig_run_id}) failed or returned invalid response: {outcome}")
-                    # Mark as needing escalation if we cannot rerun
-                    self.db.update_retry(p_name, orig_run_id, retry_count=0)
-                    self.decision_agent.notify_max_retries_exceeded(run, orig_run_id)
-                    continue
-
-                new_retry_id = outcome.get('runId')
-
-                self.db.update_retry(
-                    p_name,
-                    orig_run_id,
-                    last_attempt_run_id=new_retry_id,
-                    status="running"
-                )
-
-                print(f"[MonitoringAgent] Triggered retry #{3 - retries_left} for {p_name} ({orig_run_id}) as {new_retry_id}")
-
-
-            # --- 4. Sleep until next poll ---
-            sleep_seconds = 300  # 5 minutes
+            # --- 6. Sleep until next poll (adaptive interval), or until an approval is answered ---
+            sleep_seconds = self.next_interval(had_activity)
             wake_time = datetime.datetime.now() + datetime.timedelta(seconds=sleep_seconds)
-            print(f"[MonitoringAgent] Polling complete. Sleeping for 5 minutes. "
+            print(f"[MonitoringAgent] Polling complete. Sleeping for {sleep_seconds} seconds. "
                   f"Next check at {wake_time.strftime('%Y-%m-%d %H:%M:%S')}.\n")
-            time.sleep(sleep_seconds)
+            # Pushed failures are handled as they arrive, without a full cycle
+            deadline = time.monotonic() + sleep_seconds
+            while not self._cycle_requested and time.monotonic() < deadline:
+                self._wakeup.wait(deadline - time.monotonic())
+                self._wakeup.clear()
+                self.process_pushed_failures()
+            self._cycle_requested = False
+
+    def wake(self):
+        """Start the next cycle now (e.g. an operator just answered an approval)."""
+        self._cycle_requested = True
+        self._wakeup.set()
+
+    def notify_pushed(self):
+        """A failure was pushed to the ingestion endpoint: process the inbox now."""
+        self._wakeup.set()
+
+    def next_interval(self, had_activity):
+        """Seconds until this factory should be polled again."""
+        running_pipelines = self.retries.pipelines_in_status("running", "deferred")
+        # Poll at the retry cadence while approvals are open, so answers are acted on quickly
+        running_pipelines |= self.approvals.waiting_pipelines(self.factory_name)
+        return self.scheduler.next_interval(had_activity, running_pipelines)
+
+    def run_cycle(self):
+        """
+        Run one poll cycle. Returns True if new failed or succeeded runs were seen.
+        """
+        with metrics.scope(self.factory_name):
+            return self._run_cycle()
+
+    def _run_cycle(self):
+        # --- 1. Get runs changed since the last successful poll (with a small overlap) ---
+        cycle_started = time.perf_counter()
+        poll_started = datetime.datetime.utcnow()
+        watermark = self.db.get_watermark(self.factory_name) or \
+            poll_started - datetime.timedelta(hours=POLL_INITIAL_LOOKBACK_HOURS)
+        snapshot = self.adf_client.get_pipeline_runs_snapshot(
+            updated_after=watermark - datetime.timedelta(seconds=POLL_OVERLAP_SECONDS),
+            updated_before=poll_started
+        )
+
+        had_activity = False
+        finished_retries = {}
+        next_watermark = poll_started
+        if snapshot is not None:
+            # Retries we triggered show up here once they finish; they are followed up in step 4
+            finished_retries = {r['runId']: r for r in snapshot["failed"] + snapshot["succeeded"]
+                                if self.retries.is_attempt(r['runId'])}
+            new_failures = [r for r in snapshot["failed"]
+                            if r['runId'] not in self.seen_runs and r['runId'] not in finished_retries]
+
+            # --- 2. Reset retry state of successful runs (new failures are registered in step 3) ---
+            self.retries.succeeded(snapshot["succeeded"])
+            self._count_succeeded(snapshot["succeeded"], watermark)
+            for run in snapshot["succeeded"]:
+                print(f"[MonitoringAgent] SUCCESS: {run['pipelineName']} run {run['runId']} -> Retry reset.")
+
+            # --- 3. Process newly failed runs (classified together first when there are several) ---
+            handled = {r['runId'] for r in self._process_new_failures(new_failures)}
+            unprocessed = [r for r in new_failures if r['runId'] not in handled]
+            if unprocessed:
+                # Read them again next cycle: they stay 'pending' and nothing else picks them up
+                next_watermark = self._held_watermark(unprocessed, watermark, poll_started)
+            had_activity = bool(new_failures or snapshot["succeeded"])
+            metrics.count("runs.succeeded", len(snapshot["succeeded"]))
+
+        # Failures pushed since the last check (normally handled already while sleeping)
+        if self.ingest_enabled:
+            had_activity = self.process_pushed_failures() or had_activity
+            self.db.purge_pushed_failures(INGEST_DEDUPE_TTL_SECONDS)
+
+        # --- 4. Follow up on retries we triggered earlier (and issue reruns ARM deferred) ---
+        with metrics.timer("poll.check_retries"):
+            self._check_running_retries(finished_retries)
+
+        # --- 5. Continue runs whose retry approval was answered (or timed out) ---
+        self.approvals.expire()
+        answered = self.approvals.answered(self.factory_name)
+        self._resume_after_approval(answered)
+        had_activity = had_activity or bool(answered)
+
+        # Persist this cycle's retry state changes before the watermark moves past them
+        self.retries.flush()
+        self.retries.maintain()
+
+        # Only advance the watermark when the run query itself succeeded
+        if snapshot is not None:
+            self.db.set_watermark(self.factory_name, next_watermark)
+        else:
+            print("[MonitoringAgent] Run query failed; watermark not advanced.")
+
+        elapsed = time.perf_counter() - cycle_started
+        metrics.observe("poll.cycle", elapsed, error=snapshot is None)
+        metrics.log_cycle(self.factory_name, elapsed, query_ok=snapshot is not None)
+        return had_activity
+
+    def _held_watermark(self, runs, watermark, poll_started):
+        """The watermark that keeps `runs` (failures whose processing raised) in the next run query."""
+        updated = [parse_adf_time(r.get('lastUpdated') or r.get('runEnd')) for r in runs]
+        if None in updated:
+            held = watermark
+        else:
+            held = min(poll_started, datetime.datetime.utcfromtimestamp(min(updated)))
+        print(f"[MonitoringAgent] {len(runs)} failure(s) not processed; watermark held at {held.isoformat()}.")
+        return held
+
+    def process_pushed_failures(self):
+        """
+        Handle failures queued by the ingestion endpoint (agents/failure_ingest.py) like
+        polled ones. Returns True if there were any. A failure is only marked processed once
+        it was handled and its retry state saved; otherwise it is released for the next check.
+        """
+        with metrics.scope(self.factory_name):
+            return self._process_pushed_failures()
+
+    def _process_pushed_failures(self):
+        taken = self.db.take_pushed_failures(self.factory_name, INGEST_CLAIM_SECONDS)
+        if not taken:
+            return False
+        # Runs handled when polled, and retries we triggered (followed up by _check_running_retries)
+        pushed = [r for r in taken
+                  if r['runId'] not in self.seen_runs and not self.retries.is_attempt(r['runId'])]
+        done = {r['runId'] for r in taken} - {r['runId'] for r in pushed}
+        try:
+            if pushed:
+                print(f"[MonitoringAgent] Processing {len(pushed)} pushed failure(s).")
+                handled = self._process_new_failures(pushed)
+                self.retries.flush()
+                done.update(r['runId'] for r in handled)
+        finally:
+            self.db.complete_pushed_failures([(r['pipelineName'], r['runId']) for r in taken if r['runId'] in done])
+            self.db.release_pushed_failures([(r['pipelineName'], r['runId']) for r in taken if r['runId'] not in done])
+        return bool(pushed)
+
+    def _process_new_failures(self, runs):
+        with metrics.timer("poll.process_failures"):
+            self._attach_failure_details(runs)
+            self.retries.register(runs)
+            # In queue mode they wait for approval first; they are classified once it is answered
+            if len(runs) > 1 and self.approvals.mode != "queue":
+                self.decision_agent.prefetch_decisions(runs)
+            handled = self._run_concurrently(
+                self._process_failed_run, runs,
+                key=lambda r: (r['pipelineName'], r['runId'])
+            )
+        for run in handled:
+            self.seen_runs.add(run['runId'])
+        metrics.count("runs.failed", len(runs))
+        return handled
+
+    def _count_succeeded(self, runs, watermark):
+        """Count succeeded runs in the run history, skipping those re-read in the watermark overlap."""
+        cutoff = watermark.replace(tzinfo=datetime.timezone.utc).timestamp()
+        self.retries.history.count_succeeded(self.factory_name, [
+            r for r in runs
+            if not self.retries.is_attempt(r['runId'])
+            and (parse_adf_time(r.get('lastUpdated') or r.get('runEnd')) or cutoff + 1) > cutoff
+        ])
+
+    def _row_lock(self, key):
+        with self._row_locks_guard:
+            lock = self._row_locks.get(key)
+            if lock is None:
+                lock = threading.Lock()
+                self._row_locks[key] = lock
+            return lock
+
+    def _run_concurrently(self, func, items, key):
+        """
+        Apply `func` to every item, up to `max_concurrent_runs` at a time, holding the
+        row lock (and, in multi-factory mode, the run lease) for `key(item)` while it runs.
+        Returns the items that completed without error.
+        """
+        def locked_call(item):
+            pipeline_name, run_id = key(item)
+            lease = f"run:{run_id}"
+            if self.lease_owner and not self.db.acquire_lease(lease, self.lease_owner, RUN_LEASE_TTL_SECONDS):
+                print(f"[MonitoringAgent] Run {run_id} of {pipeline_name} is owned by another worker - skipping.")
+                return
+            try:
+                with self._row_lock((pipeline_name, run_id)):
+                    func(item)
+            finally:
+                if self.lease_owner:
+                    self.db.release_lease(lease, self.lease_owner)
+
+        completed = []
+        if self.executor is None:
+            for item in items:
+                try:
+                    locked_call(item)
+                    completed.append(item)
+                except Exception as e:
+                    print(f"[MonitoringAgent] ERROR processing {key(item)}: {e}")
+            return completed
+
+        futures = [(item, self.executor.submit(locked_call, item)) for item in items]
+        for item, future in futures:
+            try:
+                future.result()
+                completed.append(item)
+            except Exception as e:
+                print(f"[MonitoringAgent] ERROR processing {key(item)}: {e}")
+        return completed
+
+    def _process_failed_run(self, run):
+        p_name, orig_run_id = run['pipelineName'], run['runId']
+
+        # New failures are registered in bulk by run_cycle
+        info = self.retries.get(p_name, orig_run_id)
+        if info is None:
+            self.retries.register([run])
+            info = self.retries.get(p_name, orig_run_id)
+
+        # Retries in flight are followed up by _check_running_retries
+        if info['status'] == "running" and info['last_attempt_run_id']:
+            return
+
+        self._handle_pending_run(run, info['retry_count'])
+
+    def _check_running_retries(self, finished_retries):
+        """
+        `finished_retries`: retry runs that finished since the last poll, by run ID, as found
+        in this cycle's run query; the retries missing from it are still in progress.
+        """
+        self._run_concurrently(
+            lambda row: self._check_running_retry(row, finished_retries.get(row['last_attempt_run_id'])),
+            self.retries.in_status("running"),
+            key=lambda row: (row['pipeline_name'], row['original_run_id'])
+        )
+        # Once followed up, a retry is no longer its row's latest attempt (the next retry is);
+        # re-read in the next overlap it must not look like a new failure
+        for run_id in finished_retries:
+            self.seen_runs.add(run_id)
+        self._run_concurrently(
+            self._issue_deferred_rerun, self.retries.in_status("deferred"),
+            key=lambda row: (row['pipeline_name'], row['original_run_id'])
+        )
+
+    def _check_running_retry(self, row, attempt):
+        # --- Case A: Follow up on the last retry of a tracked run ---
+        p_name, orig_run_id = row['pipeline_name'], row['original_run_id']
+        last_attempt_id = row['last_attempt_run_id']
+        if not last_attempt_id:
+            return
+
+        if attempt is None and row['last_attempt_at'] is None:
+            # Started by an older version: its start time (and so the poll window covering
+            # its outcome) is unknown, so look it up by ID
+            result = self.adf_client.get_pipeline_run_status(last_attempt_id)
+            if not result.ok:
+                return  # ARM unavailable (or the run not found yet): check again next cycle
+            attempt = result.value
+        if attempt is None:
+            return  # Wait until finished
+        attempt_status = attempt['status']
+        print(f"[MonitoringAgent] Last retry run {last_attempt_id} is {attempt_status}")
+
+        if attempt_status.lower() == "succeeded":
+            self.retries.retry_succeeded(p_name, orig_run_id, attempt)
+            print(f"[MonitoringAgent] Retry succeeded for {p_name} ({orig_run_id}). Reset.")
+        elif attempt_status.lower() == "failed":
+            retries_left = self.retries.retry_failed(p_name, orig_run_id, attempt)
+            print(f"[MonitoringAgent] Retry failed for {p_name} ({orig_run_id}). Retries left={retries_left}")
+            run = {'pipelineName': p_name, 'runId': orig_run_id, 'message': attempt.get('message', '')}
+            # Decide on the failed retry's own activity, error and failure type, not the original run's
+            self._attach_failure_details([attempt])
+            if attempt.get('failedActivity'):
+                run['failedActivity'] = attempt['failedActivity']
+            # If this was last retry, escalate now
+            if retries_left < 1:
+                self.retries.escalate(p_name, orig_run_id, "retries_exhausted")
+                self.decision_agent.notify_max_retries_exceeded(run, orig_run_id)
+            else:
+                self._handle_pending_run(run, retries_left)
+
+    def _issue_deferred_rerun(self, row):
+        # --- Case F: ARM was unavailable when the rerun was decided; issue it now ---
+        p_name, orig_run_id = row['pipeline_name'], row['original_run_id']
+        outcome = self.decision_agent.rerun_deferred(p_name, orig_run_id, row['rerun_action'])
+        if outcome is None or outcome.unavailable or outcome.indeterminate:
+            return  # issued by another worker meanwhile, or still deferred
+        if not outcome.ok or 'runId' not in outcome.value:
+            print(f"[MonitoringAgent] ERROR: Deferred rerun for {p_name} ({orig_run_id}) failed: {outcome}")
+            self.retries.escalate(p_name, orig_run_id, "rerun_rejected")
+            run = {'pipelineName': p_name, 'runId': orig_run_id, 'message': ''}
+            self.decision_agent.notify_max_retries_exceeded(run, orig_run_id)
+            return
+        print(f"[MonitoringAgent] Deferred retry for {p_name} ({orig_run_id}) triggered as {outcome.value['runId']}")
+
+    def _attach_failure_details(self, runs):
+        """Look up the failed activity of each run (one batched, cached drill-down) as run['failedActivity']."""
+        runs = [r for r in runs if 'failedActivity' not in r]
+        if not runs:
+            return
+        activity_runs = self.adf_client.get_failed_activity_runs(runs)
+        for run in runs:
+            run['failedActivity'] = self.adf_client.root_cause_activity(activity_runs.get(run['runId']))
+
+    def _resume_after_approval(self, answered):
+        """Continue the runs whose approval was answered (rows of pending_approval)."""
+        runs = [{'pipelineName': row['pipeline_name'], 'runId': row['original_run_id'],
+                 'message': row['error_message']} for row in answered]
+        tracked = [r for r in runs if self.retries.get(r['pipelineName'], r['runId'])]
+        if len(tracked) > 1:
+            # All of them are evaluated now (approved, or escalated if rejected): classify them together
+            self._attach_failure_details(tracked)
+            self.decision_agent.prefetch_decisions(tracked)
+        self._run_concurrently(self._resume_run, runs, key=lambda r: (r['pipelineName'], r['runId']))
+
+    def _resume_run(self, run):
+        p_name, orig_run_id = run['pipelineName'], run['runId']
+        info = self.retries.get(p_name, orig_run_id)
+        if info is None:
+            # The run succeeded (row reset) while it waited for approval
+            self.db.delete_approval(p_name, orig_run_id)
+            return
+        self._handle_pending_run(run, info['retry_count'])
+
+    def _handle_pending_run(self, run, retries_left):
+        p_name, orig_run_id = run['pipelineName'], run['runId']
+
+        # Failed activity, error code and failure type feed the decision and the notification
+        self._attach_failure_details([run])
+
+        # --- Case B: No retries left ---
+        if retries_left < 1:
+            self.retries.escalate(p_name, orig_run_id, "retries_exhausted")
+            self.decision_agent.notify_max_retries_exceeded(run, orig_run_id)
+            return
+
+        # --- Case C: Ask an operator to approve the retry (queued; we come back once answered) ---
+        decision = self.approvals.check(run, self.factory_name)
+        if decision is None:
+            return
+        if decision != 'approved':
+            # Mark retries exhausted + escalate
+            self.retries.escalate(p_name, orig_run_id, "declined")
+            self.decision_agent.notify_max_retries_exceeded(run, orig_run_id)
+            return
+
+        # --- Case D: AI Evaluation before retry (with the failed activity's details) ---
+        activity, error_message, failure_type = failure_details(run)
+        ai_res = self.decision_agent.evaluate_failure(
+            pipeline_name=p_name,
+            activity=activity,
+            error_message=error_message,
+            run_id=orig_run_id,
+            failure_type=failure_type
+        )
+
+        if ai_res is None:
+            # Notification was skipped because already sent
+            return
+
+        if ai_res['action'] == "none" or 'not recoverable' in ai_res['rationale'].lower():
+            self.retries.escalate(p_name, orig_run_id, "not_recoverable")
+            self.decision_agent.notify_max_retries_exceeded(run, orig_run_id)
+            return
+
+        # --- Case E: Retry was triggered by evaluate_failure as soon as the action was known ---
+        outcome = ai_res.get('rerun_outcome')
+
+        if outcome is not None and (outcome.unavailable or outcome.indeterminate):
+            # Throttled, ARM down or the reply lost: not the pipeline's fault, so don't escalate;
+            # Case F issues it (or adopts the rerun ADF started after all)
+            print(f"[MonitoringAgent] Rerun for {p_name} ({orig_run_id}) deferred until ARM is available: {outcome}")
+            return
+
+        if not outcome or not outcome.ok or 'runId' not in outcome.value:
+            print(f"[MonitoringAgent] ERROR: Rerun for {p_name} ({orig_run_id}) failed or returned invalid response: {outcome}")
+            # Mark as needing escalation if we cannot rerun
+            self.retries.escalate(p_name, orig_run_id, "rerun_rejected")
+            self.decision_agent.notify_max_retries_exceeded(run, orig_run_id)
+            return
+
+        new_retry_id = outcome.value.get('runId')
+        print(f"[MonitoringAgent] Triggered retry #{3 - retries_left} for {p_name} ({orig_run_id}) as {new_retry_id}")
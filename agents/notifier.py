@@ -1,8 +1,42 @@
 # agents/notifier.py
 
-from config import NOTIFICATION_EMAIL
+from config import NOTIFICATION_EMAIL, SMTP_SERVER, NOTIFICATION_WEBHOOK_URL
+from services.notification_delivery import NotificationDispatcher, SmtpChannel, WebhookChannel
 
 class Notifier:
+    def __init__(self, db_manager=None):
+        """
+        With a DBManager and SMTP_SERVER and/or NOTIFICATION_WEBHOOK_URL configured, messages
+        are queued in SQLite and delivered (as digests) by a background thread; otherwise
+        they are printed to the console.
+        """
+        self.recipients = [e.strip() for e in (NOTIFICATION_EMAIL or "").split(",") if e.strip()]
+        channels = {}
+        if SMTP_SERVER and self.recipients:
+            channels["email"] = SmtpChannel()
+        if NOTIFICATION_WEBHOOK_URL:
+            channels["webhook"] = WebhookChannel()
+        self.dispatcher = NotificationDispatcher(db_manager, channels) if db_manager and channels else None
+        if self.dispatcher:
+            self.dispatcher.start()  # also delivers anything left over from a previous run
+
+    def _deliver(self, header, subject, message):
+        if self.dispatcher is None:
+            print(f"\n--- {header} ---")
+            print(f"TO: {NOTIFICATION_EMAIL}")
+            print(f"SUBJECT: {subject}")
+            print(message)
+            print(f"--- END {header} ---\n")
+            return
+
+        messages = []
+        if "email" in self.dispatcher.channels:
+            messages += [("email", recipient, subject, message) for recipient in self.recipients]
+        if "webhook" in self.dispatcher.channels:
+            messages.append(("webhook", NOTIFICATION_WEBHOOK_URL, subject, message))
+        self.dispatcher.enqueue(messages)
+        print(f"[Notifier] Queued '{subject}' for {len(messages)} recipient(s).")
+
     def notify(self, pipeline_name, run_id, ai_result, rerun_outcome):
         """
         Standard notification with AI decision info.
@@ -14,12 +48,7 @@ class Notifier:
             f"Rationale: {ai_result['rationale']}\n"
             f"Rerun Outcome: {rerun_outcome}\n"
         )
-        print(f"\n--- NOTIFICATION ---")
-        print(f"TO: {NOTIFICATION_EMAIL}")
-        print(f"SUBJECT: {subject}")
-        print(message)
-        print("--- END NOTIFICATION ---\n")
-        # TODO: Implement actual sending via email or messaging service
+        self._deliver("NOTIFICATION", subject, message)
 
     def notify_custom(self, pipeline_name, run_id, full_message):
         """
@@ -27,9 +56,4 @@ class Notifier:
         This is now used by DecisionLogicAgent after AI evaluation.
         """
         subject = f"ADF Pipeline Failure — {pipeline_name}"
-        print(f"\n--- CUSTOM NOTIFICATION ---")
-        print(f"TO: {NOTIFICATION_EMAIL}")
-        print(f"SUBJECT: {subject}")
-        print(f"{full_message}")
-        print("--- END CUSTOM NOTIFICATION ---\n")
-        # TODO: Implement actual sending via email or messaging service
+        self._deliver("CUSTOM NOTIFICATION", subject, full_message)
@@ -0,0 +1,44 @@
+# agents/poll_scheduler.py
+
+from config import POLL_INTERVAL_SECONDS, POLL_RETRY_INTERVAL_SECONDS, POLL_MAX_INTERVAL_SECONDS, \
+    POLL_BACKOFF_FACTOR, PIPELINE_POLL_INTERVALS
+
+
+class PollScheduler:
+    """
+    Decides how long MonitoringAgent sleeps between cycles:
+    - shortened to `retry_interval` while retries we triggered are still running,
+    - reset to `base_interval` whenever a cycle sees pipeline activity,
+    - backed off exponentially up to `max_interval` while the factory is quiet,
+    - never longer than the cadence configured for a monitored pipeline (SLA pipelines).
+    """
+
+    def __init__(self, base_interval=POLL_INTERVAL_SECONDS, retry_interval=POLL_RETRY_INTERVAL_SECONDS,
+                 max_interval=POLL_MAX_INTERVAL_SECONDS, backoff_factor=POLL_BACKOFF_FACTOR,
+                 pipeline_intervals=None):
+        self.base_interval = base_interval
+        self.retry_interval = min(retry_interval, base_interval)
+        self.max_interval = max(max_interval, base_interval)
+        self.backoff_factor = max(backoff_factor, 1.0)
+        self.pipeline_intervals = dict(PIPELINE_POLL_INTERVALS if pipeline_intervals is None
+                                       else pipeline_intervals)
+        self._idle_interval = base_interval
+
+    def next_interval(self, had_activity, running_pipelines=()):
+        """
+        Return the number of seconds until the next poll.
+        `had_activity`: the cycle saw new failed/succeeded runs.
+        `running_pipelines`: pipelines that still have a retry in status 'running'.
+        """
+        if had_activity or running_pipelines:
+            self._idle_interval = self.base_interval
+        else:
+            self._idle_interval = min(self._idle_interval * self.backoff_factor, self.max_interval)
+
+        interval = self._idle_interval
+        if running_pipelines:
+            retry_cadences = [self.pipeline_intervals.get(p, self.retry_interval) for p in running_pipelines]
+            interval = min(interval, self.retry_interval, *retry_cadences)
+        if self.pipeline_intervals:
+            interval = min(interval, *self.pipeline_intervals.values())
+        return max(1, int(interval))
@@ -0,0 +1,311 @@
+# agents/retry_state.py
+
+import datetime
+import threading
+import time
+from config import RETRY_ROW_RETENTION_SECONDS, HISTORY_MAINTENANCE_INTERVAL_SECONDS
+from db_manager import RUN_COLUMN_DEFAULTS
+from services.metrics import metrics
+from services.run_history import RunHistory, parse_adf_time, run_duration
+
+# Retry lifecycle of a failed run (a successful run or retry removes the row):
+#   pending   -> running    rerun started (rerun_started)
+#   pending   -> deferred   ARM unavailable when the rerun was decided (defer)
+#   deferred  -> running    deferred rerun issued by a later cycle
+#   running   -> pending    the retry failed, retries left (retry_failed)
+#   running   -> (removed)  the retry succeeded (retry_succeeded)
+#   any       -> escalated  retries exhausted, declined, not recoverable or rerun rejected (escalate)
+TRANSITIONS = {
+    "pending": {"running", "deferred", "escalated"},
+    "deferred": {"running", "deferred", "escalated"},
+    "running": {"pending", "escalated"},
+    "escalated": {"escalated"},
+}
+
+
+class RetryStateMachine:
+    """
+    Retry state of one factory's failed runs, held in memory and indexed by
+    (pipeline_name, original_run_id), by status and by the run ID of the last retry.
+    Hydrated from `pipeline_retry` once; afterwards reads never touch SQLite and
+    transitions only mark the row dirty in a write-behind journal, which flush()
+    writes in one transaction (MonitoringAgent flushes at the end of every cycle).
+
+    Claiming and starting a rerun are flushed at once: they guard against issuing
+    the same rerun twice after a crash, so they must be durable before the ARM call
+    returns control.
+
+    Every transition is also recorded in the run-history archive (services/run_history.py),
+    flushed together with the state. Escalated rows are pruned once they are older
+    than RETRY_ROW_RETENTION_SECONDS, so the table only holds live state.
+    """
+
+    def __init__(self, db_manager, factory_name=None, history=None):
+        self.db = db_manager
+        self.factory_name = factory_name
+        # Share one RunHistory between the factories of a process
+        self.history = history or RunHistory(db_manager)
+        self._next_maintenance = 0.0
+        self._rows = {}          # (pipeline_name, original_run_id) -> row dict
+        self._by_status = {}     # status -> set of keys
+        self._by_attempt = {}    # last_attempt_run_id -> key
+        self._dirty = set()      # keys to upsert on the next flush
+        self._deleted = set()    # keys to delete on the next flush
+        self._lock = threading.RLock()
+        for row in self.db.get_runs(factory_name):
+            self._index(row)
+        print(f"[RetryStateMachine] Loaded {len(self._rows)} tracked run(s) for factory {factory_name}.")
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _index(self, row):
+        key = (row["pipeline_name"], row["original_run_id"])
+        self._rows[key] = row
+        self._by_status.setdefault(row["status"], set()).add(key)
+        if row["last_attempt_run_id"]:
+            self._by_attempt[row["last_attempt_run_id"]] = key
+        return key
+
+    def _unindex(self, key):
+        row = self._rows.pop(key)
+        self._by_status.get(row["status"], set()).discard(key)
+        self._by_attempt.pop(row["last_attempt_run_id"], None)
+        return row
+
+    def _update(self, key, **changes):
+        """Apply column changes to a row and journal it."""
+        row = self._rows[key]
+        if "status" in changes and changes["status"] != row["status"]:
+            self._by_status[row["status"]].discard(key)
+            self._by_status.setdefault(changes["status"], set()).add(key)
+        if "last_attempt_run_id" in changes:
+            self._by_attempt.pop(row["last_attempt_run_id"], None)
+            if changes["last_attempt_run_id"]:
+                self._by_attempt[changes["last_attempt_run_id"]] = key
+        row.update(changes)
+        self._dirty.add(key)
+
+    def _transition(self, key, status, **changes):
+        row = self._rows.get(key)
+        if row is None:
+            return False
+        if status not in TRANSITIONS.get(row["status"], ()):
+            print(f"[RetryStateMachine] Ignoring transition {row['status']} -> {status} for {key[0]} ({key[1]}).")
+            return False
+        self._update(key, status=status, **changes)
+        return True
+
+    # --- Reads (copies, so callers never see a row change under them) ---
+
+    def get(self, pipeline_name, original_run_id):
+        with self._lock:
+            row = self._rows.get((pipeline_name, original_run_id))
+            return dict(row) if row else None
+
+    def in_status(self, status):
+        with self._lock:
+            return [dict(self._rows[key]) for key in self._by_status.get(status, ())]
+
+    def pipelines_in_status(self, *statuses):
+        with self._lock:
+            return {key[0] for status in statuses for key in self._by_status.get(status, ())}
+
+    def is_attempt(self, run_id):
+        """True if `run_id` is the latest retry of a tracked run (its outcome is followed up there)."""
+        with self._lock:
+            return run_id in self._by_attempt
+
+    # --- Transitions ---
+
+    def register(self, runs):
+        """Start tracking new failed runs (dicts with pipelineName/runId) as 'pending'. Known runs are kept."""
+        with self._lock:
+            for run in runs:
+                key = (run['pipelineName'], run['runId'])
+                if key in self._rows:
+                    continue
+                row = dict(RUN_COLUMN_DEFAULTS, pipeline_name=key[0], original_run_id=key[1],
+                           factory_name=self.factory_name,
+                           failed_at=parse_adf_time(run.get('runEnd')) or time.time())
+                self._index(row)
+                self._deleted.discard(key)
+                self._dirty.add(key)
+                self.history.record_failure(self.factory_name, run)
+
+    def succeeded(self, runs):
+        """Tracked runs (dicts with pipelineName/runId) that succeeded after all: stop tracking them."""
+        with self._lock:
+            for run in runs:
+                key = (run['pipelineName'], run['runId'])
+                if key in self._rows:
+                    self._remove(key, parse_adf_time(run.get('runEnd')))
+
+    def _remove(self, key, recovered_at=None):
+        """Stop tracking a recovered run; `recovered_at` is when the successful run ended (epoch seconds)."""
+        row = self._unindex(key)
+        self._dirty.discard(key)
+        self._deleted.add(key)
+        recovered_at = recovered_at or time.time()
+        recovery_seconds = max(0.0, recovered_at - row["failed_at"]) if row["failed_at"] else None
+        self.history.record("recovered", self.factory_name, key[0], key[1],
+                            attempt_run_id=row["last_attempt_run_id"], duration_seconds=recovery_seconds)
+
+    def mark_notified(self, pipeline_name, original_run_id, notification_time):
+        with self._lock:
+            if (pipeline_name, original_run_id) in self._rows:
+                self._update((pipeline_name, original_run_id), notified=1,
+                             last_notification_time=notification_time)
+
+    def claim_rerun(self, pipeline_name, original_run_id, rerun_key):
+        """
+        Record `rerun_key` as the row's latest rerun (durably). Returns True if this call
+        recorded it, False if a rerun with the same key was already claimed (or the row
+        isn't tracked). The claim is decided by a conditional UPDATE in SQLite, not by the
+        in-memory row: during a lease takeover two workers may hold the same row. Flushes
+        never write `rerun_key` over an existing row, so they can't undo another worker's claim.
+        """
+        key = (pipeline_name, original_run_id)
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None or row["rerun_key"] == rerun_key:
+                return False
+            self.flush(keys=[key])  # the row must exist in SQLite to be claimed
+            if not self.db.claim_rerun(pipeline_name, original_run_id, rerun_key):
+                return False
+            row["rerun_key"] = rerun_key
+            return True
+
+    def rerun_started(self, pipeline_name, original_run_id, attempt_run_id, action=None):
+        with self._lock:
+            key = (pipeline_name, original_run_id)
+            if self._transition(key, "running", last_attempt_run_id=attempt_run_id, last_attempt_at=time.time()):
+                self.history.record("rerun", self.factory_name, pipeline_name, original_run_id,
+                                    attempt_run_id=attempt_run_id, action=action)
+                self.flush(keys=[key])
+
+    def defer(self, pipeline_name, original_run_id, rerun_action):
+        """Park a rerun ARM could not take; the claim is released so a later cycle can issue it."""
+        with self._lock:
+            key = (pipeline_name, original_run_id)
+            if self._transition(key, "deferred", rerun_action=rerun_action, rerun_key=None):
+                self.flush(keys=[key])
+                self.db.release_rerun(pipeline_name, original_run_id)
+
+    def retry_succeeded(self, pipeline_name, original_run_id, attempt):
+        """The latest retry (`attempt`, the retry's run) succeeded: the failure is resolved."""
+        with self._lock:
+            key = (pipeline_name, original_run_id)
+            if key not in self._rows:
+                return
+            self.history.record("retry_succeeded", self.factory_name, pipeline_name, original_run_id,
+                                attempt_run_id=attempt.get('runId'), duration_seconds=run_duration(attempt))
+            self._remove(key, parse_adf_time(attempt.get('runEnd')))
+
+    def retry_failed(self, pipeline_name, original_run_id, attempt):
+        """
+        The latest retry failed: back to 'pending' with one retry less, and not yet notified,
+        so the failed retry is evaluated (and escalated or retried) like a new failure.
+        Returns the retries left.
+        """
+        with self._lock:
+            key = (pipeline_name, original_run_id)
+            row = self._rows.get(key)
+            if row is None:
+                return 0
+            retries_left = row["retry_count"] - 1
+            if self._transition(key, "pending", retry_count=retries_left, notified=0):
+                self.history.record("retry_failed", self.factory_name, pipeline_name, original_run_id,
+                                    attempt_run_id=attempt.get('runId'), message=attempt.get('message'),
+                                    duration_seconds=run_duration(attempt))
+            return retries_left
+
+    def escalate(self, pipeline_name, original_run_id, reason=None):
+        """
+        No (further) retry. `reason` is archived with it: "retries_exhausted", "declined",
+        "not_recoverable" or "rerun_rejected".
+        """
+        with self._lock:
+            key = (pipeline_name, original_run_id)
+            row = self._rows.get(key)
+            if row is None or row["status"] == "escalated":
+                return
+            if self._transition(key, "escalated", retry_count=0):
+                self.history.record("escalated", self.factory_name, pipeline_name, original_run_id, action=reason)
+
+    # --- Housekeeping ---
+
+    def prune(self, max_age_seconds=RETRY_ROW_RETENTION_SECONDS):
+        """
+        Drop escalated rows (and rows of older versions that ran out of retries) older than
+        `max_age_seconds`; their history stays in the archive. Returns how many were dropped.
+        """
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            stale = [key for key, row in self._rows.items()
+                     if (row["status"] == "escalated" or (row["status"] == "pending" and row["retry_count"] < 1))
+                     and (_row_time(row) or 0) < cutoff]
+            for key in stale:
+                self._unindex(key)
+                self._dirty.discard(key)
+                self._deleted.add(key)
+        return len(stale)
+
+    def maintain(self):
+        """Prune old rows and run the archive's compaction/retention, at most once an interval."""
+        if time.time() < self._next_maintenance:
+            return
+        self._next_maintenance = time.time() + HISTORY_MAINTENANCE_INTERVAL_SECONDS
+        pruned = self.prune()
+        if pruned:
+            print(f"[RetryStateMachine] Pruned {pruned} escalated run(s) of factory {self.factory_name}.")
+        self.flush()
+        self.history.maintain()
+
+    # --- Write-behind journal ---
+
+    def flush(self, keys=None):
+        """Write journaled changes (all, or only `keys`) to pipeline_retry in one transaction."""
+        with self._lock:
+            if keys is None:
+                upserts, deletes = self._dirty, self._deleted
+                self._dirty, self._deleted = set(), set()
+            else:
+                upserts = {k for k in keys if k in self._dirty}
+                deletes = {k for k in keys if k in self._deleted}
+                self._dirty -= upserts
+                self._deleted -= deletes
+            if not upserts and not deletes:
+                self._flush_history(keys)
+                return
+            try:
+                with metrics.timer("retry_state.flush"), self.db.transaction():
+                    if deletes:
+                        self.db.delete_runs(deletes)
+                    if upserts:
+                        self.db.upsert_runs([dict(self._rows[k]) for k in upserts])
+            except Exception:
+                # Keep the changes journaled; the next flush tries again
+                self._dirty |= upserts
+                self._deleted |= deletes
+                raise
+            metrics.count("retry_state.rows_written", len(upserts) + len(deletes))
+            self._flush_history(keys)
+
+    def _flush_history(self, keys):
+        if keys is not None:
+            return  # single-row flushes keep the state durable; history follows with the next full flush
+        try:
+            self.history.flush()
+        except Exception as e:
+            print(f"[RetryStateMachine] ERROR writing run history: {e}")
+
+
+def _row_time(row):
+    """When the row's run failed (or, for rows of older versions, was last notified), as epoch seconds."""
+    if row["failed_at"]:
+        return row["failed_at"]
+    if row["last_notification_time"]:
+        return datetime.datetime.fromisoformat(row["last_notification_time"]).replace(
+            tzinfo=datetime.timezone.utc).timestamp()
+    return None
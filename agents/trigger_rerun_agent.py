@@ -3,8 +3,24 @@ class TriggerRerunAgent:
     def __init__(self, adf_client):
         self.adf_client = adf_client
 
-    def rerun(self, run_id):
-        print(f"[TriggerRerunAgent] Triggering rerun for original runId={run_id}")
+    def rerun(self, run_id, pipeline_name=None, recovery=False):
+        """
+        Rerun a failed run. With `recovery` (AI decision 'partial'), resume from the failed
+        activity instead of re-executing the whole pipeline; falls back to a full rerun
+        if ADF rejects the recovery run. Returns the ArmResult of the rerun request.
+        """
+        if recovery and pipeline_name:
+            print(f"[TriggerRerunAgent] Triggering recovery rerun from the failed activity of runId={run_id}")
+            outcome = self.adf_client.rerun_from_failure(pipeline_name, run_id)
+            if outcome.ok and 'runId' in outcome.value:
+                print(f"[TriggerRerunAgent] Recovery rerun started: {outcome}")
+                return outcome
+            if outcome.unavailable:
+                return outcome  # a full rerun would be throttled just the same
+            if outcome.indeterminate:
+                return outcome  # the recovery run may have started; a full rerun could duplicate it
+            print("[TriggerRerunAgent] Recovery rerun failed; falling back to a full rerun.")
+        print(f"[TriggerRerunAgent] Triggering rerun of runId={run_id}")
         outcome = self.adf_client.rerun_pipeline_by_run_id(run_id)
         print(f"[TriggerRerunAgent] Rerun started: {outcome}")
         return outcome
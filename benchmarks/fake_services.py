@@ -0,0 +1,325 @@
+"""
+Local stand-in for the services the monitor talks to, for benchmarks:
+    POST /{tenant}/oauth2/token                                   Azure AD client credentials
+    POST .../factories/{f}/queryPipelineRuns                      paginated (continuationToken)
+    GET  .../factories/{f}/pipelineruns/{runId}
+    POST .../factories/{f}/pipelineruns/{runId}/rerun
+    POST .../factories/{f}/pipelineruns/{runId}/queryActivityruns
+    POST .../factories/{f}/pipelines/{name}/createRun
+    POST /v1/chat/completions                                     canned decisions (incl. json_schema batches)
+    POST /v1/embeddings                                           deterministic vectors
+    GET  /_stats                                                  request counts per endpoint
+    GET  /_events?factory=...                                     Event Grid events for the failed runs
+Latency, page size, an injected error rate (HTTP 503), throttling rate (HTTP 429 with
+Retry-After) and lost-reply rate (reruns started but answered with HTTP 503) are configurable.
+
+Run it on its own with:
+    python -m benchmarks.fake_services --port 8900 --runs 1000
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+EMBEDDING_DIM = 1536
+
+
+class FakeAzure:
+    """Run data and behaviour knobs shared by all request handlers."""
+
+    def __init__(self, runs=1000, failure_ratio=0.05, pipelines=("pipeline_a", "pipeline_b"), page_size=100,
+                 latency_ms=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1, retry_status="Succeeded",
+                 lost_reply_rate=0.0, seed=0):
+        self.page_size = page_size
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.retry_status = retry_status
+        self.lost_reply_rate = lost_reply_rate
+        self.random = random.Random(seed)
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.runs = self._make_runs(runs, failure_ratio, list(pipelines))
+        self.run_index = {r["runId"]: r for r in self.runs}
+
+    def _make_runs(self, count, failure_ratio, pipelines):
+        now = time.time()
+        runs = []
+        for i in range(count):
+            start = now - 3600 + 3000 * i / max(1, count)
+            failed = int((i + 1) * failure_ratio) > int(i * failure_ratio)  # evenly spread, exact share
+            run_id = str(uuid.UUID(int=self.random.getrandbits(128)))
+            runs.append({
+                "runId": run_id,
+                "runGroupId": run_id,
+                "isLatest": True,
+                "pipelineName": pipelines[i % len(pipelines)],
+                "status": "Failed" if failed else "Succeeded",
+                "runStart": _iso(start),
+                "runEnd": _iso(start + 60),
+                "lastUpdated": _iso(start + 60),
+                "message": (f"Operation on target Copy{i % 7} failed: ErrorCode=2200, "
+                            f"Failure happened on 'Sink' side. Request {i} was throttled." if failed else ""),
+            })
+        return runs
+
+    def start_retry(self, path):
+        """
+        Add a retry run (it finishes at once with `retry_status`) so queries and GETs find it.
+        A rerun of a known run joins its run group, and the original is no longer the latest.
+        """
+        path, _, query = path.partition("?")
+        match = re.search(r"/pipelines/([^/]+)/createRun$", path) or re.search(r"/pipelineruns/([^/]+)/rerun$", path)
+        reference = re.search(r"referencePipelineRunId=([^&]+)", query)
+        with self.lock:
+            original = self.run_index.get(reference.group(1) if reference else match.group(1))
+            pipeline_name = original["pipelineName"] if original else unquote(match.group(1))
+            now = _iso(time.time())
+            run_id = str(uuid.uuid4())
+            run = {"runId": run_id, "runGroupId": original["runGroupId"] if original else run_id, "isLatest": True,
+                   "pipelineName": pipeline_name, "status": self.retry_status,
+                   "runStart": now, "runEnd": now, "lastUpdated": now,
+                   "message": "" if self.retry_status == "Succeeded" else "Retry failed again."}
+            if original:
+                original["isLatest"] = False
+            self.runs.append(run)
+            self.run_index[run["runId"]] = run
+        return run["runId"]
+
+    def record(self, endpoint):
+        with self.lock:
+            self.counts[endpoint] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def failure_events(self, factory="bench-factory", subscription_id="bench-subscription",
+                       resource_group="bench-rg"):
+        """The failed runs as Event Grid events, as a push subscription would deliver them."""
+        factory_id = (f"/subscriptions/{subscription_id}/resourceGroups/{resource_group}"
+                      f"/providers/Microsoft.DataFactory/factories/{factory}")
+        return [{
+            "id": str(uuid.UUID(int=int(run["runId"].replace("-", ""), 16) ^ 1)),
+            "topic": factory_id,
+            "subject": f"{factory_id}/pipelineruns/{run['runId']}",
+            "eventType": "Microsoft.DataFactory.PipelineRunFailed",
+            "eventTime": run["lastUpdated"],
+            "dataVersion": "1.0",
+            "data": {key: run[key] for key in ("runId", "pipelineName", "status", "message",
+                                               "runStart", "runEnd", "lastUpdated")},
+        } for run in self.runs if run["status"] == "Failed"]
+
+    def reset_stats(self):
+        with self.lock:
+            self.counts.clear()
+
+
+def _iso(ts):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(ts)) + ".0000000Z"
+
+
+def _fake_embedding(text):
+    seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    vector = [rng.uniform(-1, 1) for _ in range(EMBEDDING_DIM)]
+    norm = sum(v * v for v in vector) ** 0.5
+    return [v / norm for v in vector]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real endpoints
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def _reply(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if not raw:
+            return {}
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(raw)
+        return {"raw": raw.decode("utf-8")}
+
+    def _simulate(self, endpoint):
+        self.fake.record(endpoint)
+        if self.fake.latency_ms:
+            time.sleep(self.fake.latency_ms / 1000)
+        if self.fake.error_rate and self.fake.random.random() < self.fake.error_rate:
+            self.fake.record(endpoint + ":error")
+            self._reply(503, {"error": {"code": "ServiceUnavailable", "message": "injected failure"}})
+            return False
+        if self.fake.throttle_rate and self.fake.random.random() < self.fake.throttle_rate:
+            self.fake.record(endpoint + ":throttled")
+            self._reply(429, {"error": {"code": "TooManyRequests", "message": "injected throttling"}},
+                        headers={"Retry-After": str(self.fake.retry_after)})
+            return False
+        return True
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/_stats":
+            return self._reply(200, self.fake.stats())
+        if path == "/_events":
+            query = dict(q.split("=", 1) for q in self.path.partition("?")[2].split("&") if "=" in q)
+            return self._reply(200, self.fake.failure_events(**query))
+        match = re.search(r"/pipelineruns/([^/]+)$", path)
+        if match:
+            if not self._simulate("pipelineruns.get"):
+                return
+            run = self.fake.run_index.get(match.group(1))
+            if run is None:
+                return self._reply(404, {"error": {"code": "NotFound"}})
+            return self._reply(200, run)
+        self._reply(404, {"error": {"code": "NotFound", "path": path}})
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        body = self._body()
+        if path == "/_reset":
+            self.fake.reset_stats()
+            return self._reply(200, {})
+        if path.endswith("/oauth2/token"):
+            if self._simulate("token"):
+                self._reply(200, {"access_token": "fake-token", "expires_on": str(int(time.time()) + 3600)})
+        elif path.endswith("/queryPipelineRuns"):
+            if self._simulate("queryPipelineRuns"):
+                self._reply(200, self._query_pipeline_runs(body))
+        elif path.endswith("/queryActivityruns"):
+            if self._simulate("queryActivityruns"):
+                run_id = path.split("/")[-2]
+                # Half the failures match a local failure rule, the other half need GPT
+                message = "Request was throttled by the sink." if int(run_id[-1], 16) % 2 else \
+                    "Type=System.InvalidOperationException,Message=Unexpected value in column 'amount'."
+                self._reply(200, {"value": [{
+                    "activityName": "Copy1", "activityType": "Copy", "pipelineRunId": run_id, "status": "Failed",
+                    "activityRunStart": "2026-01-01T00:00:00Z", "activityRunEnd": "2026-01-01T00:01:00Z",
+                    "error": {"errorCode": "2200", "failureType": "SystemError", "message": message},
+                }]})
+        elif path.endswith("/rerun") or path.endswith("/createRun"):
+            if self._simulate("rerun"):
+                run_id = self.fake.start_retry(self.path)
+                if self.fake.lost_reply_rate and self.fake.random.random() < self.fake.lost_reply_rate:
+                    self.fake.record("rerun:lost_reply")
+                    return self._reply(503, {"error": {"code": "GatewayTimeout", "message": "reply lost"}})
+                self._reply(200, {"runId": run_id})
+        elif path.endswith("/chat/completions"):
+            if self._simulate("chat"):
+                self._reply(200, self._chat(body))
+        elif path.endswith("/embeddings"):
+            if self._simulate("embeddings"):
+                inputs = body.get("input", [])
+                inputs = [inputs] if isinstance(inputs, (str, int)) or (inputs and isinstance(inputs[0], int)) \
+                    else inputs
+                self._reply(200, {
+                    "object": "list", "model": body.get("model", "fake"),
+                    "data": [{"object": "embedding", "index": i, "embedding": _fake_embedding(str(t))}
+                             for i, t in enumerate(inputs)],
+                    "usage": {"prompt_tokens": 0, "total_tokens": 0},
+                })
+        else:
+            self._reply(404, {"error": {"code": "NotFound", "path": path}})
+
+    def _query_pipeline_runs(self, body):
+        names, statuses, groups, latest_only = None, None, None, False
+        for f in body.get("filters", []):
+            if f.get("operand") == "PipelineName":
+                names = set(f["values"])
+            elif f.get("operand") == "Status":
+                statuses = set(f["values"])
+            elif f.get("operand") == "RunGroupId":
+                groups = set(f["values"])
+            elif f.get("operand") == "LatestOnly":
+                latest_only = f["values"] == ["true"]
+        after = body.get("lastUpdatedAfter", "")[:19]
+        before = body.get("lastUpdatedBefore", "9999")[:19]
+        matching = [r for r in self.fake.runs
+                    if (names is None or r["pipelineName"] in names)
+                    and (statuses is None or r["status"] in statuses)
+                    and (groups is None or r["runGroupId"] in groups)
+                    and (not latest_only or r["isLatest"])
+                    and after <= r["lastUpdated"][:19] <= before]
+        offset = int(body.get("continuationToken") or 0)
+        page = matching[offset:offset + self.fake.page_size]
+        result = {"value": page}
+        if offset + self.fake.page_size < len(matching):
+            result["continuationToken"] = str(offset + self.fake.page_size)
+        return result
+
+    def _chat(self, body):
+        prompt = body["messages"][-1]["content"]
+        if body.get("response_format", {}).get("type") == "json_schema":
+            ids = [int(i) for i in re.findall(r"^\[(\d+)\]", prompt, re.MULTILINE)]
+            content = json.dumps({"decisions": [
+                {"id": i, "action": "partial", "rationale": "transient throttling, retry the failed activity"}
+                for i in ids
+            ]})
+        else:
+            content = "partial - the sink throttled the copy; retrying the failed activity should succeed."
+        return {
+            "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_services(fake, host="127.0.0.1", port=0):
+    """
+    Serve `fake` from a daemon thread. Returns (server, base_url); assign server.fake to
+    switch to another data set without changing the URL.
+    """
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.fake = fake
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-services", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local ADF / Azure AD / OpenAI stand-in")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--runs", type=int, default=1000)
+    parser.add_argument("--failure-ratio", type=float, default=0.05)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeAzure(runs=args.runs, failure_ratio=args.failure_ratio, page_size=args.page_size,
+                     latency_ms=args.latency_ms, error_rate=args.error_rate, throttle_rate=args.throttle_rate)
+    server, url = start_fake_services(fake, port=args.port)
+    print(f"Serving {args.runs} fake runs on {url} (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
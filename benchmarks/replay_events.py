@@ -0,0 +1,80 @@
+"""
+Replay pipeline-failure events into the monitor's ingestion endpoint (agents/failure_ingest.py),
+as Event Grid would deliver them:
+
+    python -m benchmarks.replay_events --validate                            # subscription handshake
+    python -m benchmarks.replay_events --file events.json                    # events saved to a file
+    python -m benchmarks.replay_events --source http://127.0.0.1:8900 --factory bench-factory
+
+`--source` takes the failed runs of a running stand-in (benchmarks/fake_services.py). Events are
+posted in batches of `--batch-size`; `--repeat` sends them again to exercise deduplication.
+Reports the endpoint's accepted/duplicate/ignored counts and the request latencies.
+"""
+
+import argparse
+import json
+import time
+import uuid
+import requests
+
+
+def load_events(args):
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as f:
+            events = json.load(f)
+        return events if isinstance(events, list) else [events]
+    res = requests.get(f"{args.source.rstrip('/')}/_events", params={"factory": args.factory}, timeout=30)
+    res.raise_for_status()
+    return res.json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay failure events into the ingestion endpoint")
+    parser.add_argument("--target", default="http://127.0.0.1:8770/events")
+    parser.add_argument("--token", help="value of INGEST_HTTP_TOKEN, if set")
+    parser.add_argument("--file", help="JSON file with one event or a list of events")
+    parser.add_argument("--source", default="http://127.0.0.1:8900", help="fake services to take failed runs from")
+    parser.add_argument("--factory", default="bench-factory")
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--validate", action="store_true", help="only send a SubscriptionValidationEvent")
+    args = parser.parse_args()
+
+    session = requests.Session()
+    if args.token:
+        session.headers["X-Ingest-Token"] = args.token
+
+    if args.validate:
+        code = str(uuid.uuid4())
+        res = session.post(args.target, json=[{
+            "id": str(uuid.uuid4()), "subject": "", "eventType": "Microsoft.EventGrid.SubscriptionValidationEvent",
+            "eventTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "dataVersion": "1",
+            "data": {"validationCode": code},
+        }], timeout=30)
+        ok = res.ok and res.json().get("validationResponse") == code
+        print(f"Validation {'succeeded' if ok else 'FAILED'}: HTTP {res.status_code} {res.text}")
+        return
+
+    events = load_events(args)
+    totals = {"accepted": 0, "duplicates": 0, "ignored": 0}
+    latencies = []
+    for _ in range(args.repeat):
+        for i in range(0, len(events), max(1, args.batch_size)):
+            started = time.perf_counter()
+            res = session.post(args.target, json=events[i:i + args.batch_size], timeout=30)
+            latencies.append(time.perf_counter() - started)
+            if not res.ok:
+                print(f"HTTP {res.status_code}: {res.text}")
+                continue
+            for key in totals:
+                totals[key] += res.json().get(key, 0)
+
+    latencies.sort()
+    print(f"Sent {len(events)} event(s) x{args.repeat} in {len(latencies)} request(s): {totals}")
+    if latencies:
+        print(f"Latency ms: p50={latencies[len(latencies) // 2] * 1000:.1f} "
+              f"max={latencies[-1] * 1000:.1f}")
+
+
+if __name__ == "__main__":
+    main()
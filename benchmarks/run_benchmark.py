@@ -0,0 +1,181 @@
+"""
+End-to-end poll-cycle benchmark against the local stand-in services (benchmarks/fake_services.py).
+Builds the same agents as main.py on a throwaway SQLite DB, points them at the stand-in and runs
+MonitoringAgent.run_cycle() a few times per scenario, reporting per cycle:
+    latency, HTTP calls by endpoint, DB write statements / commits, peak Python heap and RSS.
+
+    python -m benchmarks.run_benchmark                        # small, medium and large scenarios
+    python -m benchmarks.run_benchmark --scenario large --latency-ms 20 --error-rate 0.01 --throttle-rate 0.01
+    python -m benchmarks.run_benchmark --runs 5000 --json results.json
+
+Nothing here talks to Azure or OpenAI: the endpoints, credentials and approval mode are
+overridden through the environment before the project modules are imported.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fake_services import FakeAzure, start_fake_services
+
+SCENARIOS = {
+    "small": {"runs": 10, "failure_ratio": 0.2},
+    "medium": {"runs": 1000, "failure_ratio": 0.05},
+    "large": {"runs": 50000, "failure_ratio": 0.02},
+}
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+def _configure_environment(base_url):
+    """Point every endpoint at the stand-in; must run before config is imported."""
+    os.environ.update({
+        "ARM_ENDPOINT": base_url,
+        "AZURE_AD_ENDPOINT": base_url,
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+        "OPENAI_API_KEY": "bench-key",
+        "ADF_SUBSCRIPTION_ID": "bench-subscription",
+        "ADF_RESOURCE_GROUP": "bench-rg",
+        "ADF_FACTORY_NAME": "bench-factory",
+        "ADF_TENANT_ID": "bench-tenant",
+        "ADF_CLIENT_ID": "bench-client",
+        "ADF_CLIENT_SECRET": "bench-secret",
+        "NOTIFICATION_EMAIL": "bench@example.com",
+        "SMTP_SERVER": "",
+        "NOTIFICATION_WEBHOOK_URL": "",
+        "APPROVAL_MODE": "auto",
+        "APPROVAL_HTTP_PORT": "0",
+    })
+    if "config" in sys.modules:
+        raise RuntimeError("config was imported before the benchmark environment was set")
+
+
+class DBWriteCounter:
+    """Counts write statements and commits issued on a sqlite3 connection."""
+
+    def __init__(self, conn):
+        self.writes = 0
+        self.commits = 0
+        conn.set_trace_callback(self._trace)
+
+    def _trace(self, statement):
+        head = statement.lstrip()[:7].upper()
+        if head.startswith(WRITE_STATEMENTS):
+            self.writes += 1
+        elif head.startswith("COMMIT"):
+            self.commits += 1
+
+    def reset(self):
+        self.writes = self.commits = 0
+
+
+def _build_monitor(db_file):
+    from db_manager import DBManager
+    from agents.decision_logic_agent import DecisionLogicAgent
+    from agents.monitoring_agent import MonitoringAgent
+    from agents.notifier import Notifier
+    from agents.trigger_rerun_agent import TriggerRerunAgent
+    from services.adf_client import AzureDataFactoryClient
+    from services.decision_cache import DecisionCache
+    from services.openai_client import OpenAIClient
+
+    db_manager = DBManager(db_file)
+    adf_client = AzureDataFactoryClient()
+    decision_agent = DecisionLogicAgent(OpenAIClient(DecisionCache(db_manager)), TriggerRerunAgent(adf_client),
+                                        Notifier(db_manager), db_manager)
+    return MonitoringAgent(adf_client, decision_agent, db_manager), db_manager
+
+
+def run_scenario(server, name, runs, failure_ratio, cycles, page_size, latency_ms, error_rate, throttle_rate=0.0,
+                 verbose=False):
+    from config import PIPELINES_TO_MONITOR
+
+    fake = FakeAzure(runs=runs, failure_ratio=failure_ratio, pipelines=PIPELINES_TO_MONITOR, page_size=page_size,
+                     latency_ms=latency_ms, error_rate=error_rate, throttle_rate=throttle_rate)
+    server.fake = fake
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        monitor, db_manager = _build_monitor(os.path.join(tmp, "bench.db"))
+        counter = DBWriteCounter(db_manager.conn)
+        for cycle in range(1, cycles + 1):
+            fake.reset_stats()
+            counter.reset()
+            tracemalloc.start()
+            output = io.StringIO()
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(sys.stdout if verbose else output):
+                monitor.run_cycle()
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            calls = fake.stats()
+            results.append({
+                "scenario": name,
+                "runs": runs,
+                "cycle": cycle,
+                "latency_s": round(elapsed, 3),
+                "http_calls": sum(v for k, v in calls.items() if ":" not in k),
+                "calls_by_endpoint": calls,
+                "db_writes": counter.writes,
+                "db_commits": counter.commits,
+                "peak_heap_mb": round(peak / (1024 * 1024), 1),
+                "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            })
+        db_manager.conn.close()
+    return results
+
+
+def _print_results(results):
+    header = f"{'scenario':<8} {'runs':>6} {'cycle':>5} {'latency s':>9} {'calls':>6} {'db writes':>9} " \
+             f"{'commits':>7} {'heap MB':>7} {'RSS MB':>7}  calls by endpoint"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        endpoints = ", ".join(f"{k}={v}" for k, v in sorted(r["calls_by_endpoint"].items()))
+        print(f"{r['scenario']:<8} {r['runs']:>6} {r['cycle']:>5} {r['latency_s']:>9} {r['http_calls']:>6} "
+              f"{r['db_writes']:>9} {r['db_commits']:>7} {r['peak_heap_mb']:>7} {r['max_rss_mb']:>7}  {endpoints}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll-cycle benchmark against local stand-in services")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append",
+                        help="scenario(s) to run (default: all)")
+    parser.add_argument("--runs", type=int, help="custom scenario with this many runs in the window")
+    parser.add_argument("--failure-ratio", type=float, default=0.05, help="failed share of --runs")
+    parser.add_argument("--cycles", type=int, default=2, help="poll cycles per scenario")
+    parser.add_argument("--page-size", type=int, default=100, help="runs per queryPipelineRuns page")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added latency per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the monitor's own output")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_services(FakeAzure(runs=0))
+    _configure_environment(base_url)
+    if args.runs:
+        scenarios = {"custom": {"runs": args.runs, "failure_ratio": args.failure_ratio}}
+    else:
+        scenarios = {name: SCENARIOS[name] for name in (args.scenario or SCENARIOS)}
+
+    results = []
+    for name, scenario in scenarios.items():
+        print(f"[Benchmark] Running scenario '{name}' ({scenario['runs']} runs)...", file=sys.stderr)
+        results += run_scenario(server, name, scenario["runs"], scenario["failure_ratio"], args.cycles, args.page_size,
+                                args.latency_ms, args.error_rate, args.throttle_rate, verbose=args.verbose)
+    server.shutdown()
+    _print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 # Store configuration (populate with your secrets in development only—use KeyVault/env vars in prod!)
 import os
+import json
 from dotenv import load_dotenv
 
 load_dotenv()  # Load variables from .env file
@@ -12,10 +13,172 @@ ADF_CLIENT_ID = os.getenv('ADF_CLIENT_ID')
 ADF_CLIENT_SECRET = os.getenv('ADF_CLIENT_SECRET')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 NOTIFICATION_EMAIL = os.getenv('NOTIFICATION_EMAIL')
+# Optional delivery channels; notifications are only printed when neither is configured
+SMTP_SERVER = os.getenv('SMTP_SERVER')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
+SMTP_USERNAME = os.getenv('SMTP_USERNAME')
+SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
+SMTP_SENDER = os.getenv('SMTP_SENDER', SMTP_USERNAME or 'adf-monitor@localhost')
+NOTIFICATION_WEBHOOK_URL = os.getenv('NOTIFICATION_WEBHOOK_URL')
+
+# Azure AD token is reused until this many seconds before it expires
+AZURE_TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv('AZURE_TOKEN_REFRESH_MARGIN_SECONDS', '300'))
+# Max keep-alive connections held open to ARM / Azure AD
+ARM_HTTP_POOL_SIZE = int(os.getenv('ARM_HTTP_POOL_SIZE', '20'))
+# Service endpoints; override only to point the monitor at a stand-in (see benchmarks/)
+ARM_ENDPOINT = os.getenv('ARM_ENDPOINT', 'https://management.azure.com').rstrip('/')
+AZURE_AD_ENDPOINT = os.getenv('AZURE_AD_ENDPOINT', 'https://login.microsoftonline.com').rstrip('/')
+# ARM request engine (services/arm_requests.py): rate limits, retries, circuit breaker, timeouts
+ARM_READS_PER_SECOND = float(os.getenv('ARM_READS_PER_SECOND', '25'))
+ARM_READ_BURST = int(os.getenv('ARM_READ_BURST', '250'))
+ARM_WRITES_PER_SECOND = float(os.getenv('ARM_WRITES_PER_SECOND', '10'))
+ARM_WRITE_BURST = int(os.getenv('ARM_WRITE_BURST', '200'))
+ARM_RATELIMIT_MIN_REMAINING = int(os.getenv('ARM_RATELIMIT_MIN_REMAINING', '20'))
+ARM_MAX_RETRIES = int(os.getenv('ARM_MAX_RETRIES', '3'))
+ARM_RETRY_BASE_SECONDS = float(os.getenv('ARM_RETRY_BASE_SECONDS', '1'))
+ARM_MAX_RETRY_WAIT_SECONDS = float(os.getenv('ARM_MAX_RETRY_WAIT_SECONDS', '60'))
+ARM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('ARM_CIRCUIT_FAILURE_THRESHOLD', '5'))
+ARM_CIRCUIT_RESET_SECONDS = int(os.getenv('ARM_CIRCUIT_RESET_SECONDS', '60'))
+ARM_CONNECT_TIMEOUT_SECONDS = float(os.getenv('ARM_CONNECT_TIMEOUT_SECONDS', '10'))
+ARM_READ_TIMEOUT_SECONDS = float(os.getenv('ARM_READ_TIMEOUT_SECONDS', '60'))
+
+# Incremental polling: lookback used before a watermark exists, and overlap re-read each cycle
+POLL_INITIAL_LOOKBACK_HOURS = int(os.getenv('POLL_INITIAL_LOOKBACK_HOURS', '2'))
+POLL_OVERLAP_SECONDS = int(os.getenv('POLL_OVERLAP_SECONDS', '120'))
+# Already-handled run IDs remembered in memory (oldest evicted first)
+SEEN_RUNS_MAX_ENTRIES = int(os.getenv('SEEN_RUNS_MAX_ENTRIES', '10000'))
+SEEN_RUNS_TTL_SECONDS = int(os.getenv('SEEN_RUNS_TTL_SECONDS', '86400'))
+# Failed runs evaluated/retried in parallel per poll cycle (1 = process sequentially)
+MAX_CONCURRENT_RUNS = int(os.getenv('MAX_CONCURRENT_RUNS', '8'))
+# Failed-activity drill-down (queryActivityruns): parallel queries, runs cached in memory
+ACTIVITY_QUERY_CONCURRENCY = int(os.getenv('ACTIVITY_QUERY_CONCURRENCY', '8'))
+ACTIVITY_RUN_CACHE_MAX_ENTRIES = int(os.getenv('ACTIVITY_RUN_CACHE_MAX_ENTRIES', '2000'))
+
+# Adaptive poll interval: faster while retries run, backing off up to the max while quiet
+POLL_INTERVAL_SECONDS = int(os.getenv('POLL_INTERVAL_SECONDS', '300'))
+POLL_RETRY_INTERVAL_SECONDS = int(os.getenv('POLL_RETRY_INTERVAL_SECONDS', '30'))
+POLL_MAX_INTERVAL_SECONDS = int(os.getenv('POLL_MAX_INTERVAL_SECONDS', '1800'))
+POLL_BACKOFF_FACTOR = float(os.getenv('POLL_BACKOFF_FACTOR', '2'))
+
+# GPT retry decisions cached by normalized error signature: in-memory LRU + SQLite table
+DECISION_CACHE_MAX_ENTRIES = int(os.getenv('DECISION_CACHE_MAX_ENTRIES', '5000'))
+DECISION_CACHE_MEMORY_TTL_SECONDS = int(os.getenv('DECISION_CACHE_MEMORY_TTL_SECONDS', '3600'))
+DECISION_CACHE_TTL_SECONDS = int(os.getenv('DECISION_CACHE_TTL_SECONDS', '604800'))  # 7 days
+# Failures seen in the same cycle are classified together in structured-output requests
+OPENAI_BATCH_MODEL = os.getenv('OPENAI_BATCH_MODEL', 'gpt-4o')
+OPENAI_BATCH_MAX_ITEMS = int(os.getenv('OPENAI_BATCH_MAX_ITEMS', '20'))
+
+# RAG caches: query embeddings by text hash, KB solutions by retrieved chunks + failure text
+RAG_EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv('RAG_EMBEDDING_CACHE_TTL_SECONDS', '2592000'))  # 30 days
+RAG_SOLUTION_CACHE_TTL_SECONDS = int(os.getenv('RAG_SOLUTION_CACHE_TTL_SECONDS', '604800'))  # 7 days
+# KB retrieval: "vector" (FAISS), "hybrid" (BM25 + FAISS) or "lexical" (BM25 only)
+RAG_RETRIEVAL_MODE = os.getenv('RAG_RETRIEVAL_MODE', 'hybrid')
+# Knowledge-base index builds: PDF parsing processes, chunks per embedding request, parallel requests
+RAG_BUILD_WORKERS = int(os.getenv('RAG_BUILD_WORKERS', str(os.cpu_count() or 2)))
+RAG_EMBED_BATCH_SIZE = int(os.getenv('RAG_EMBED_BATCH_SIZE', '256'))
+RAG_EMBED_CONCURRENCY = int(os.getenv('RAG_EMBED_CONCURRENCY', '4'))
+# RAG prompt context: token budget and the similarity above which a passage is a duplicate
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv('RAG_CONTEXT_TOKEN_BUDGET', '1500'))
+RAG_CONTEXT_DEDUP_THRESHOLD = float(os.getenv('RAG_CONTEXT_DEDUP_THRESHOLD', '0.8'))
+
+# Local failure rules checked before asking GPT (first match wins); FAILURE_RULES_FILE overrides them
+FAILURE_RULES_FILE = os.getenv('FAILURE_RULES_FILE')
+if FAILURE_RULES_FILE:
+    with open(FAILURE_RULES_FILE) as f:
+        FAILURE_RULES = json.load(f)
+else:
+    FAILURE_RULES = [
+        # Permanent: retrying cannot help until someone fixes the setup
+        {"name": "authentication", "action": "none",
+         "error_codes": ["AuthorizationFailed", "InvalidAuthenticationToken", "UserErrorInvalidCredential"],
+         "patterns": [r"AADSTS\d+", r"authentication failed", r"login failed", r"invalid (client secret|credentials?|password)",
+                      r"\bunauthorized\b", r"\bforbidden\b", r"status code:? 40[13]\b"]},
+        {"name": "missing_object", "action": "none",
+         "error_codes": ["UserErrorFileNotFound", "UserErrorSourceBlobNotExists", "ResourceNotFound", "PathNotFound"],
+         "patterns": [r"does not exist", r"invalid object name", r"(file|table|container|path|blob) .{0,80}not found",
+                      r"status code:? 404\b"]},
+        {"name": "schema_mismatch", "action": "none",
+         "error_codes": ["UserErrorInvalidColumnMappingColumnNotFound", "UserErrorSchemaMappingCannotInferSinkColumnType",
+                         "UserErrorColumnNameNotAllowNull", "UserErrorInvalidDataValue"],
+         "patterns": [r"schema mismatch", r"column .{0,80} (not found|does not exist)", r"cannot be converted",
+                      r"conversion failed", r"data type mismatch"]},
+        # Transient: rerun the failed activity
+        {"name": "throttling", "action": "partial",
+         "error_codes": ["TooManyRequests", "ServerBusy", "ServiceUnavailable"],
+         "patterns": [r"throttl", r"rate limit", r"status code:? (429|503)\b", r"server is busy"]},
+        {"name": "timeout", "action": "partial",
+         "error_codes": ["GatewayTimeout", "OperationTimedOut"],
+         "patterns": [r"timed? ?out", r"timeout expired", r"status code:? 504\b"]},
+        {"name": "connectivity", "action": "partial",
+         "error_codes": [],
+         "patterns": [r"connection (was )?(reset|closed|refused|forcibly closed|aborted)", r"transport-level error",
+                      r"temporarily unavailable", r"network (error|is unreachable)", r"remote name could not be resolved"]},
+    ]
+
+# Notification outbox: digest window per recipient, and backoff of failed sends
+NOTIFICATION_DIGEST_WINDOW_SECONDS = int(os.getenv('NOTIFICATION_DIGEST_WINDOW_SECONDS', '60'))
+NOTIFICATION_DIGEST_MAX_MESSAGES = int(os.getenv('NOTIFICATION_DIGEST_MAX_MESSAGES', '50'))
+NOTIFICATION_RETRY_BASE_SECONDS = int(os.getenv('NOTIFICATION_RETRY_BASE_SECONDS', '30'))
+NOTIFICATION_RETRY_MAX_SECONDS = int(os.getenv('NOTIFICATION_RETRY_MAX_SECONDS', '3600'))
+
+# Retry approval: "queue", "prompt" or "auto"; unanswered approvals get APPROVAL_TIMEOUT_ACTION
+APPROVAL_MODE = os.getenv('APPROVAL_MODE', 'queue')
+APPROVAL_TIMEOUT_SECONDS = int(os.getenv('APPROVAL_TIMEOUT_SECONDS', '3600'))
+APPROVAL_TIMEOUT_ACTION = os.getenv('APPROVAL_TIMEOUT_ACTION', 'reject')
+# Local approval endpoint (0 disables it); only started when APPROVAL_HTTP_TOKEN is set
+APPROVAL_HTTP_HOST = os.getenv('APPROVAL_HTTP_HOST', '127.0.0.1')
+APPROVAL_HTTP_PORT = int(os.getenv('APPROVAL_HTTP_PORT', '8765'))
+APPROVAL_HTTP_TOKEN = os.getenv('APPROVAL_HTTP_TOKEN')
+
+# Push ingestion endpoint for failed-run alerts (agents/failure_ingest.py; 0 disables it)
+INGEST_HTTP_HOST = os.getenv('INGEST_HTTP_HOST', '127.0.0.1')
+INGEST_HTTP_PORT = int(os.getenv('INGEST_HTTP_PORT', '0'))
+INGEST_HTTP_TOKEN = os.getenv('INGEST_HTTP_TOKEN')
+INGEST_RECONCILE_INTERVAL_SECONDS = int(os.getenv('INGEST_RECONCILE_INTERVAL_SECONDS', '1800'))
+INGEST_CHECK_SECONDS = int(os.getenv('INGEST_CHECK_SECONDS', '5'))
+INGEST_DEDUPE_TTL_SECONDS = int(os.getenv('INGEST_DEDUPE_TTL_SECONDS', '604800'))  # 7 days
+INGEST_CLAIM_SECONDS = int(os.getenv('INGEST_CLAIM_SECONDS', '600'))
+
+# Metrics (services/metrics.py): Prometheus endpoint (0 disables it) and per-cycle log line
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+METRICS_HTTP_HOST = os.getenv('METRICS_HTTP_HOST', '127.0.0.1')
+METRICS_HTTP_PORT = int(os.getenv('METRICS_HTTP_PORT', '9464'))
+
+# Run-history archive (services/run_history.py): CSV partitions, retention and DB rollups
+HISTORY_ENABLED = os.getenv('HISTORY_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+HISTORY_DIR = os.getenv('HISTORY_DIR', 'run_history')
+HISTORY_COMPACT_AFTER_DAYS = int(os.getenv('HISTORY_COMPACT_AFTER_DAYS', '2'))
+HISTORY_RETENTION_DAYS = int(os.getenv('HISTORY_RETENTION_DAYS', '365'))
+HISTORY_ROLLUP_RETENTION_DAYS = int(os.getenv('HISTORY_ROLLUP_RETENTION_DAYS', '730'))
+HISTORY_MAINTENANCE_INTERVAL_SECONDS = int(os.getenv('HISTORY_MAINTENANCE_INTERVAL_SECONDS', '3600'))
+RETRY_ROW_RETENTION_SECONDS = int(os.getenv('RETRY_ROW_RETENTION_SECONDS', '604800'))  # 7 days
+
 PIPELINES_TO_MONITOR = [
     "get_rule_id",
     "ADO_Pipeline_Trigger",
     "GetRuleId via API_ Trigger"
     ]
 
+# Factories to monitor: the ADF_* factory above, or a JSON list in ADF_FACTORIES_FILE
+ADF_FACTORIES_FILE = os.getenv('ADF_FACTORIES_FILE')
+if ADF_FACTORIES_FILE:
+    with open(ADF_FACTORIES_FILE) as f:
+        ADF_FACTORIES = json.load(f)
+else:
+    ADF_FACTORIES = [{
+        "subscription_id": ADF_SUBSCRIPTION_ID,
+        "resource_group": ADF_RESOURCE_GROUP,
+        "factory_name": ADF_FACTORY_NAME,
+    }]
+for _factory in ADF_FACTORIES:
+    _factory.setdefault("pipelines", PIPELINES_TO_MONITOR)
+
+# Multi-factory mode: worker processes, and how long a worker owns a factory / a run
+MONITOR_WORKERS = int(os.getenv('MONITOR_WORKERS', '1'))
+FACTORY_LEASE_TTL_SECONDS = int(os.getenv('FACTORY_LEASE_TTL_SECONDS', '600'))
+RUN_LEASE_TTL_SECONDS = int(os.getenv('RUN_LEASE_TTL_SECONDS', '900'))
 
+# Optional per-pipeline max poll interval in seconds (e.g. pipelines with an SLA)
+PIPELINE_POLL_INTERVALS = {
+    # "get_rule_id": 60,
+    }
@@ -1,13 +1,94 @@
 # db_manager.py
 
+import json
 import sqlite3
+import time
 import datetime
+import functools
+import threading
+from contextlib import contextmanager
+from config import ADF_FACTORIES
+from services.metrics import metrics
+
+
+def synchronized(method):
+    """Serialize access to the shared connection when failed runs are processed concurrently."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+# Columns of pipeline_retry besides the key, with the values a brand-new row gets
+RUN_COLUMN_DEFAULTS = {
+    "retry_count": 2,
+    "last_attempt_run_id": None,
+    "status": "pending",
+    "notified": 0,
+    "last_notification_time": None,
+    "factory_name": None,
+    "rerun_key": None,
+    "rerun_action": None,
+    "last_attempt_at": None,
+    "failed_at": None,
+}
+
+# Columns the write-behind upsert never overwrites: only claim_rerun/release_rerun change them
+CLAIM_COLUMNS = ("rerun_key",)
+
+# Additive counters of run_history_daily (see services/run_history.py)
+HISTORY_COUNTERS = ("runs_succeeded", "failures", "retries", "retries_succeeded", "retries_failed",
+                    "retry_seconds", "escalations", "recoveries", "recovery_seconds")
+
 
 class DBManager:
+    """
+    Owns the single SQLite connection of a process. Create one and pass it to every
+    agent that needs it rather than opening further connections to the same file.
+    """
+
     def __init__(self, db_file="pipeline_monitor.db"):
-        self.conn = sqlite3.connect(db_file)
+        # Generous busy timeout: several worker processes may share this file
+        self.conn = sqlite3.connect(db_file, check_same_thread=False, timeout=30)
+        # WAL lets readers run alongside the writer; with synchronous=NORMAL a commit
+        # no longer waits on an fsync (only checkpoints do)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.lock = threading.RLock()
+        self._tx_depth = 0
         self.create_table()
 
+    @contextmanager
+    def transaction(self):
+        """
+        Group several writes into one commit:
+            with db.transaction():
+                db.upsert_runs(...)
+                db.delete_runs(...)
+        Nested blocks join the outermost one. Other threads wait until it ends.
+        """
+        with self.lock:
+            self._tx_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._tx_depth -= 1
+                if self._tx_depth == 0:
+                    self.conn.rollback()
+                raise
+            self._tx_depth -= 1
+            if self._tx_depth == 0:
+                with metrics.timer("sqlite.commit"):
+                    self.conn.commit()
+
+    def _commit(self):
+        if self._tx_depth == 0:
+            with metrics.timer("sqlite.commit"):
+                self.conn.commit()
+
+    @synchronized
     def create_table(self):
         cursor = self.conn.cursor()
         cursor.execute("""
@@ -22,66 +103,597 @@ class DBManager:
                 PRIMARY KEY (pipeline_name, original_run_id)
             )
         """)
+        self._add_column_if_missing("pipeline_retry", "factory_name", "TEXT")
+        # Idempotency key of the last rerun issued for the row (see claim_rerun)
+        self._add_column_if_missing("pipeline_retry", "rerun_key", "TEXT")
+        # Decided action ("full"/"partial") of a rerun deferred while ARM was unavailable
+        self._add_column_if_missing("pipeline_retry", "rerun_action", "TEXT")
+        # When the last retry was started (epoch seconds); bounds the batched retry status query
+        self._add_column_if_missing("pipeline_retry", "last_attempt_at", "REAL")
+        # When the original run failed (epoch seconds); start of its time to recovery
+        self._add_column_if_missing("pipeline_retry", "failed_at", "REAL")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_pipeline_retry_status ON pipeline_retry (status)")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_pipeline_retry_last_notification_time
+            ON pipeline_retry (last_notification_time)
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS poll_watermark (
+                factory_name TEXT PRIMARY KEY,
+                last_updated_after TEXT
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS monitor_lease (
+                resource TEXT PRIMARY KEY,
+                owner TEXT,
+                expires_at REAL
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS gpt_decision_cache (
+                signature TEXT PRIMARY KEY,
+                action TEXT,
+                rationale TEXT,
+                created_at REAL
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS rag_embedding_cache (
+                text_hash TEXT PRIMARY KEY,
+                embedding BLOB,
+                created_at REAL
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS pending_approval (
+                pipeline_name TEXT,
+                original_run_id TEXT,
+                factory_name TEXT,
+                error_message TEXT,
+                requested_at REAL,
+                decision TEXT,
+                decided_at REAL,
+                decided_by TEXT,
+                PRIMARY KEY (pipeline_name, original_run_id)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS failure_inbox (
+                pipeline_name TEXT,
+                original_run_id TEXT,
+                factory_name TEXT,
+                run_json TEXT,
+                received_at REAL,
+                processed_at REAL,
+                PRIMARY KEY (pipeline_name, original_run_id)
+            )
+        """)
+        # Until when a worker handles the pushed failure (see take_pushed_failures)
+        self._add_column_if_missing("failure_inbox", "claimed_until", "REAL")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_failure_inbox_factory_processed
+            ON failure_inbox (factory_name, processed_at)
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS notification_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT,
+                recipient TEXT,
+                subject TEXT,
+                body TEXT,
+                created_at REAL,
+                next_attempt_at REAL,
+                attempts INTEGER DEFAULT 0,
+                last_error TEXT,
+                claim_token TEXT,
+                claimed_until REAL
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_notification_outbox_next_attempt_at
+            ON notification_outbox (next_attempt_at)
+        """)
+        # Daily rollups of the run-history archive, so trend queries never scan the archive
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS run_history_daily (
+                day TEXT,
+                factory_name TEXT,
+                pipeline_name TEXT,
+                {", ".join(f"{c} REAL DEFAULT 0" for c in HISTORY_COUNTERS)},
+                PRIMARY KEY (day, factory_name, pipeline_name)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS run_history_signature_daily (
+                day TEXT,
+                factory_name TEXT,
+                pipeline_name TEXT,
+                signature TEXT,
+                failures INTEGER,
+                example TEXT,
+                PRIMARY KEY (day, factory_name, pipeline_name, signature)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS rag_solution_cache (
+                cache_key TEXT PRIMARY KEY,
+                index_version TEXT,
+                solution TEXT,
+                created_at REAL
+            )
+        """)
+        # Rows written before multi-factory monitoring have no factory: they belong to the
+        # single .env factory, which is ADF_FACTORIES[0]
+        for table in ("pipeline_retry", "pending_approval"):
+            cursor.execute(f"UPDATE {table} SET factory_name=? WHERE factory_name IS NULL",
+                           (ADF_FACTORIES[0]["factory_name"],))
         self.conn.commit()
 
-    def insert_run(self, pipeline_name, original_run_id, retry_count=2):
+    def _add_column_if_missing(self, table, column, declaration):
+        columns = [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+    @synchronized
+    def acquire_lease(self, resource, owner, ttl_seconds):
+        """
+        Take or renew ownership of `resource` (e.g. a factory or a run ID) for `ttl_seconds`.
+        Succeeds if the resource is free, already ours, or its previous lease expired.
+        """
+        now = time.time()
+        cursor = self.conn.execute("""
+            INSERT INTO monitor_lease (resource, owner, expires_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(resource) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE monitor_lease.owner = excluded.owner OR monitor_lease.expires_at < ?
+        """, (resource, owner, now + ttl_seconds, now))
+        self._commit()
+        return cursor.rowcount == 1
+
+    @synchronized
+    def release_lease(self, resource, owner):
+        self.conn.execute("""
+            DELETE FROM monitor_lease
+            WHERE resource=? AND owner=?
+        """, (resource, owner))
+        self._commit()
+
+    @synchronized
+    def get_cached_decision(self, signature, max_age_seconds):
         cursor = self.conn.cursor()
         cursor.execute("""
-            INSERT OR IGNORE INTO pipeline_retry
-            (pipeline_name, original_run_id, retry_count, last_attempt_run_id, status, notified)
-            VALUES (?, ?, ?, NULL, 'pending', 0)
-        """, (pipeline_name, original_run_id, retry_count))
-        self.conn.commit()
+            SELECT action, rationale FROM gpt_decision_cache
+            WHERE signature = ? AND created_at >= ?
+        """, (signature, time.time() - max_age_seconds))
+        row = cursor.fetchone()
+        return {"action": row[0], "rationale": row[1]} if row else None
+
+    @synchronized
+    def put_cached_decision(self, signature, action, rationale):
+        self.conn.execute("""
+            INSERT OR REPLACE INTO gpt_decision_cache (signature, action, rationale, created_at)
+            VALUES (?, ?, ?, ?)
+        """, (signature, action, rationale, time.time()))
+        self._commit()
+
+    @synchronized
+    def purge_decision_cache(self, max_age_seconds):
+        self.conn.execute("DELETE FROM gpt_decision_cache WHERE created_at < ?", (time.time() - max_age_seconds,))
+        self._commit()
 
-    def get_run_info(self, pipeline_name, original_run_id):
+    @synchronized
+    def get_cached_embedding(self, text_hash, max_age_seconds):
         cursor = self.conn.cursor()
         cursor.execute("""
-            SELECT retry_count, last_attempt_run_id, status, notified, last_notification_time
-            FROM pipeline_retry
-            WHERE pipeline_name = ? AND original_run_id = ?
-        """, (pipeline_name, original_run_id))
+            SELECT embedding FROM rag_embedding_cache
+            WHERE text_hash = ? AND created_at >= ?
+        """, (text_hash, time.time() - max_age_seconds))
         row = cursor.fetchone()
-        return {
-            "retry_count": row[0],
-            "last_attempt_run_id": row[1],
-            "status": row[2],
-            "notified": row[3],
-            "last_notification_time": row[4]
-        } if row else None
-
-    def update_retry(self, pipeline_name, original_run_id, retry_count=None, last_attempt_run_id=None, status=None, notified=None, last_notification_time=None):
+        return row[0] if row else None
+
+    @synchronized
+    def put_cached_embedding(self, text_hash, embedding):
+        self.conn.execute("""
+            INSERT OR REPLACE INTO rag_embedding_cache (text_hash, embedding, created_at)
+            VALUES (?, ?, ?)
+        """, (text_hash, embedding, time.time()))
+        self._commit()
+
+    @synchronized
+    def get_cached_solution(self, cache_key, index_version, max_age_seconds):
         cursor = self.conn.cursor()
-        fields, params = [], []
-        if retry_count is not None:
-            fields.append("retry_count=?")
-            params.append(retry_count)
-        if last_attempt_run_id is not None:
-            fields.append("last_attempt_run_id=?")
-            params.append(last_attempt_run_id)
-        if status is not None:
-            fields.append("status=?")
-            params.append(status)
-        if notified is not None:
-            fields.append("notified=?")
-            params.append(notified)
-        if last_notification_time is not None:
-            fields.append("last_notification_time=?")
-            params.append(last_notification_time)
-
-        if not fields:
-            return
-
-        params += [pipeline_name, original_run_id]
-        cursor.execute(f"""
-            UPDATE pipeline_retry
-            SET {", ".join(fields)}
+        cursor.execute("""
+            SELECT solution FROM rag_solution_cache
+            WHERE cache_key = ? AND index_version = ? AND created_at >= ?
+        """, (cache_key, index_version, time.time() - max_age_seconds))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    @synchronized
+    def put_cached_solution(self, cache_key, index_version, solution):
+        self.conn.execute("""
+            INSERT OR REPLACE INTO rag_solution_cache (cache_key, index_version, solution, created_at)
+            VALUES (?, ?, ?, ?)
+        """, (cache_key, index_version, solution, time.time()))
+        self._commit()
+
+    @synchronized
+    def purge_stale_solutions(self, index_version):
+        """Drop solutions computed against any other version of the RAG index."""
+        self.conn.execute("DELETE FROM rag_solution_cache WHERE index_version != ?", (index_version,))
+        self._commit()
+
+    @synchronized
+    def request_approval(self, pipeline_name, original_run_id, factory_name, error_message):
+        """Add a pending approval; a request that already exists keeps its original time."""
+        self.conn.execute("""
+            INSERT OR IGNORE INTO pending_approval
+            (pipeline_name, original_run_id, factory_name, error_message, requested_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (pipeline_name, original_run_id, factory_name, error_message, time.time()))
+        self._commit()
+
+    @synchronized
+    def decide_approval(self, original_run_id, decision, decided_by, pipeline_name=None):
+        """Answer an open approval ('approved' / 'rejected'). False if there is no open request."""
+        query = """
+            UPDATE pending_approval
+            SET decision=?, decided_at=?, decided_by=?
+            WHERE original_run_id=? AND decision IS NULL
+        """
+        params = [decision, time.time(), decided_by, original_run_id]
+        if pipeline_name is not None:
+            query += " AND pipeline_name=?"
+            params.append(pipeline_name)
+        cursor = self.conn.execute(query, params)
+        self._commit()
+        return cursor.rowcount > 0
+
+    @synchronized
+    def expire_approvals(self, max_age_seconds, decision):
+        """Answer open approvals older than `max_age_seconds` with `decision`. Returns how many."""
+        now = time.time()
+        cursor = self.conn.execute("""
+            UPDATE pending_approval
+            SET decision=?, decided_at=?, decided_by='timeout'
+            WHERE decision IS NULL AND requested_at < ?
+        """, (decision, now, now - max_age_seconds))
+        self._commit()
+        return cursor.rowcount
+
+    @synchronized
+    def get_approval(self, pipeline_name, original_run_id):
+        row = self.conn.execute("""
+            SELECT decision, decided_by, requested_at
+            FROM pending_approval
             WHERE pipeline_name=? AND original_run_id=?
-        """, params)
-        self.conn.commit()
+        """, (pipeline_name, original_run_id)).fetchone()
+        return {"decision": row[0], "decided_by": row[1], "requested_at": row[2]} if row else None
+
+    @synchronized
+    def list_approvals(self, decided=False, factory_name=None):
+        """Open (or, with decided=True, answered) approvals, optionally of one factory, oldest first."""
+        query = f"""
+            SELECT pipeline_name, original_run_id, factory_name, error_message, requested_at,
+                   decision, decided_at, decided_by
+            FROM pending_approval
+            WHERE decision IS {"NOT " if decided else ""}NULL
+        """
+        params = []
+        if factory_name is not None:
+            query += " AND factory_name = ?"
+            params.append(factory_name)
+        cursor = self.conn.execute(query + " ORDER BY requested_at", params)
+        return [{
+            "pipeline_name": row[0],
+            "original_run_id": row[1],
+            "factory_name": row[2],
+            "error_message": row[3],
+            "requested_at": row[4],
+            "decision": row[5],
+            "decided_at": row[6],
+            "decided_by": row[7]
+        } for row in cursor.fetchall()]
 
-    def delete_run(self, pipeline_name, original_run_id):
+    @synchronized
+    def delete_approval(self, pipeline_name, original_run_id):
         self.conn.execute("""
-            DELETE FROM pipeline_retry
+            DELETE FROM pending_approval
             WHERE pipeline_name=? AND original_run_id=?
         """, (pipeline_name, original_run_id))
-        self.conn.commit()
+        self._commit()
+
+    @synchronized
+    def enqueue_pushed_failures(self, runs):
+        """
+        Queue failed runs pushed to the ingestion endpoint (run dicts as returned by
+        queryPipelineRuns plus 'factoryName'). Runs already queued, processed within the
+        inbox retention or tracked in pipeline_retry (as a failure or as its latest retry)
+        are skipped. Returns the runs queued.
+        """
+        queued = []
+        now = time.time()
+        with self.transaction():
+            for run in runs:
+                cursor = self.conn.execute("""
+                    INSERT OR IGNORE INTO failure_inbox
+                    (pipeline_name, original_run_id, factory_name, run_json, received_at)
+                    SELECT ?, ?, ?, ?, ?
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM pipeline_retry
+                        WHERE pipeline_name=? AND (original_run_id=? OR last_attempt_run_id=?)
+                    )
+                """, (run['pipelineName'], run['runId'], run['factoryName'], json.dumps(run), now,
+                      run['pipelineName'], run['runId'], run['runId']))
+                if cursor.rowcount == 1:
+                    queued.append(run)
+        return queued
+
+    @synchronized
+    def take_pushed_failures(self, factory_name, claim_seconds):
+        """
+        Claim the factory's unprocessed pushed failures for `claim_seconds` and return them
+        (oldest first). Report the outcome with complete_pushed_failures or
+        release_pushed_failures; a claim left open lapses and the failure is taken again.
+        """
+        now = time.time()
+        with self.transaction():
+            rows = self.conn.execute("""
+                SELECT pipeline_name, original_run_id, run_json
+                FROM failure_inbox
+                WHERE factory_name=? AND processed_at IS NULL AND (claimed_until IS NULL OR claimed_until < ?)
+                ORDER BY received_at
+            """, (factory_name, now)).fetchall()
+            self.conn.executemany("""
+                UPDATE failure_inbox SET claimed_until=?
+                WHERE pipeline_name=? AND original_run_id=?
+            """, [(now + claim_seconds, row[0], row[1]) for row in rows])
+        return [json.loads(row[2]) for row in rows]
+
+    @synchronized
+    def complete_pushed_failures(self, keys):
+        """Mark claimed (pipeline_name, original_run_id) pushed failures as processed."""
+        with self.transaction():
+            self.conn.executemany("""
+                UPDATE failure_inbox SET processed_at=?, claimed_until=NULL
+                WHERE pipeline_name=? AND original_run_id=?
+            """, [(time.time(), pipeline_name, run_id) for pipeline_name, run_id in keys])
+
+    @synchronized
+    def release_pushed_failures(self, keys):
+        """Give claimed pushed failures back, to be taken again by the next check."""
+        with self.transaction():
+            self.conn.executemany("""
+                UPDATE failure_inbox SET claimed_until=NULL
+                WHERE pipeline_name=? AND original_run_id=?
+            """, list(keys))
+
+    @synchronized
+    def purge_pushed_failures(self, max_age_seconds):
+        """Forget processed pushed failures older than `max_age_seconds` (their dedupe window)."""
+        self.conn.execute("DELETE FROM failure_inbox WHERE processed_at < ?", (time.time() - max_age_seconds,))
+        self._commit()
+
+    @synchronized
+    def enqueue_notifications(self, messages, deliver_after):
+        """Queue (channel, recipient, subject, body) tuples for delivery from `deliver_after` (epoch seconds) on."""
+        now = time.time()
+        self.conn.executemany("""
+            INSERT INTO notification_outbox (channel, recipient, subject, body, created_at, next_attempt_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(channel, recipient, subject, body, now, deliver_after) for channel, recipient, subject, body in messages])
+        self._commit()
+
+    @synchronized
+    def claim_due_notifications(self, claim_token, claim_seconds):
+        """
+        Claim every unclaimed message of each (channel, recipient) that has at least one
+        message due, so they can be sent as one digest. Claims expire after `claim_seconds`,
+        which hands the messages of a crashed sender to the next one. Returns the claimed rows.
+        """
+        now = time.time()
+        self.conn.execute("""
+            UPDATE notification_outbox
+            SET claim_token=?, claimed_until=?
+            WHERE (claimed_until IS NULL OR claimed_until < ?)
+              AND (channel, recipient) IN (
+                  SELECT channel, recipient FROM notification_outbox
+                  WHERE next_attempt_at <= ? AND (claimed_until IS NULL OR claimed_until < ?)
+              )
+        """, (claim_token, now + claim_seconds, now, now, now))
+        self._commit()
+        cursor = self.conn.execute("""
+            SELECT id, channel, recipient, subject, body, attempts
+            FROM notification_outbox
+            WHERE claim_token=?
+            ORDER BY id
+        """, (claim_token,))
+        return [{
+            "id": row[0],
+            "channel": row[1],
+            "recipient": row[2],
+            "subject": row[3],
+            "body": row[4],
+            "attempts": row[5]
+        } for row in cursor.fetchall()]
+
+    @synchronized
+    def delete_notifications(self, ids):
+        self.conn.executemany("DELETE FROM notification_outbox WHERE id=?", [(i,) for i in ids])
+        self._commit()
+
+    @synchronized
+    def reschedule_notifications(self, ids, next_attempt_at, error):
+        """Release claimed messages after a failed send, to be retried at `next_attempt_at`."""
+        self.conn.executemany("""
+            UPDATE notification_outbox
+            SET attempts=attempts + 1, next_attempt_at=?, last_error=?, claim_token=NULL, claimed_until=NULL
+            WHERE id=?
+        """, [(next_attempt_at, error, i) for i in ids])
+        self._commit()
+
+    @synchronized
+    def next_notification_due(self):
+        """Earliest next_attempt_at in the outbox, or None when it is empty."""
+        row = self.conn.execute("SELECT MIN(next_attempt_at) FROM notification_outbox").fetchone()
+        return row[0]
+
+    @synchronized
+    def add_history_rollups(self, daily, signatures):
+        """
+        Add counts to the run-history rollups in one transaction.
+        `daily`: {(day, factory_name, pipeline_name): {counter: delta}} (counters from HISTORY_COUNTERS)
+        `signatures`: {(day, factory_name, pipeline_name, signature): (failures, example message)}
+        """
+        columns = ", ".join(HISTORY_COUNTERS)
+        with self.transaction():
+            self.conn.executemany(f"""
+                INSERT INTO run_history_daily (day, factory_name, pipeline_name, {columns})
+                VALUES ({", ".join("?" * (len(HISTORY_COUNTERS) + 3))})
+                ON CONFLICT(day, factory_name, pipeline_name) DO UPDATE SET
+                {", ".join(f"{c} = {c} + excluded.{c}" for c in HISTORY_COUNTERS)}
+            """, [list(key) + [deltas.get(c, 0) for c in HISTORY_COUNTERS] for key, deltas in daily.items()])
+            self.conn.executemany("""
+                INSERT INTO run_history_signature_daily
+                (day, factory_name, pipeline_name, signature, failures, example)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(day, factory_name, pipeline_name, signature) DO UPDATE SET
+                failures = failures + excluded.failures
+            """, [list(key) + [count, example] for key, (count, example) in signatures.items()])
+
+    @synchronized
+    def sum_history_rollups(self, since_day, factory_name=None):
+        """Counters of run_history_daily summed per pipeline from `since_day` (YYYY-MM-DD) on."""
+        query = f"""
+            SELECT pipeline_name, {", ".join(f"SUM({c})" for c in HISTORY_COUNTERS)}
+            FROM run_history_daily
+            WHERE day >= ?
+        """
+        params = [since_day]
+        if factory_name is not None:
+            query += " AND factory_name = ?"
+            params.append(factory_name)
+        query += " GROUP BY pipeline_name ORDER BY pipeline_name"
+        return [dict(zip(("pipeline_name",) + HISTORY_COUNTERS, row)) for row in self.conn.execute(query, params)]
+
+    @synchronized
+    def top_history_signatures(self, since_day, factory_name=None, limit=10):
+        """Most frequent failure signatures from `since_day` on, with an example message."""
+        query = """
+            SELECT pipeline_name, signature, SUM(failures) AS total, MAX(example)
+            FROM run_history_signature_daily
+            WHERE day >= ?
+        """
+        params = [since_day]
+        if factory_name is not None:
+            query += " AND factory_name = ?"
+            params.append(factory_name)
+        query += " GROUP BY pipeline_name, signature ORDER BY total DESC LIMIT ?"
+        params.append(limit)
+        return [{"pipeline_name": row[0], "signature": row[1], "failures": row[2], "example": row[3]}
+                for row in self.conn.execute(query, params)]
+
+    @synchronized
+    def purge_history_rollups(self, before_day):
+        """Drop rollup rows of days before `before_day` (YYYY-MM-DD)."""
+        self.conn.execute("DELETE FROM run_history_daily WHERE day < ?", (before_day,))
+        self.conn.execute("DELETE FROM run_history_signature_daily WHERE day < ?", (before_day,))
+        self._commit()
+
+    @synchronized
+    def get_watermark(self, factory_name):
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT last_updated_after FROM poll_watermark WHERE factory_name = ?
+        """, (factory_name,))
+        row = cursor.fetchone()
+        return datetime.datetime.fromisoformat(row[0]) if row and row[0] else None
+
+    @synchronized
+    def set_watermark(self, factory_name, last_updated_after):
+        self.conn.execute("""
+            INSERT INTO poll_watermark (factory_name, last_updated_after)
+            VALUES (?, ?)
+            ON CONFLICT(factory_name) DO UPDATE SET last_updated_after = excluded.last_updated_after
+        """, (factory_name, last_updated_after.isoformat()))
+        self._commit()
+
+    @synchronized
+    def get_runs(self, factory_name=None):
+        """
+        All pipeline_retry rows as dicts (to hydrate RetryStateMachine); with `factory_name`,
+        only that factory's rows.
+        """
+        columns = ["pipeline_name", "original_run_id"] + list(RUN_COLUMN_DEFAULTS)
+        query = f"SELECT {', '.join(columns)} FROM pipeline_retry"
+        params = []
+        if factory_name is not None:
+            query += " WHERE factory_name = ?"
+            params.append(factory_name)
+        return [dict(zip(columns, row)) for row in self.conn.execute(query, params)]
+
+    @synchronized
+    def claim_rerun(self, pipeline_name, original_run_id, rerun_key):
+        """
+        Record `rerun_key` as the row's latest rerun. Returns True if this call recorded it,
+        False if a rerun with the same key was already claimed (or the row doesn't exist).
+        The check and the write are one UPDATE, so of two processes claiming the same
+        rerun only one wins.
+        """
+        cursor = self.conn.execute("""
+            UPDATE pipeline_retry
+            SET rerun_key=?
+            WHERE pipeline_name=? AND original_run_id=? AND (rerun_key IS NULL OR rerun_key != ?)
+        """, (rerun_key, pipeline_name, original_run_id, rerun_key))
+        self._commit()
+        return cursor.rowcount == 1
+
+    @synchronized
+    def release_rerun(self, pipeline_name, original_run_id):
+        """Clear the row's rerun claim, so the same rerun can be claimed again."""
+        self.conn.execute("""
+            UPDATE pipeline_retry
+            SET rerun_key=NULL
+            WHERE pipeline_name=? AND original_run_id=?
+        """, (pipeline_name, original_run_id))
+        self._commit()
+
+    @synchronized
+    def upsert_runs(self, rows):
+        """
+        Apply many row changes in one transaction. Each row is a dict with
+        `pipeline_name`, `original_run_id` and any columns to set; missing rows are
+        created (unset columns take RUN_COLUMN_DEFAULTS), existing rows only get
+        the given columns updated, except CLAIM_COLUMNS, which are left as they are.
+        """
+        groups = {}
+        for row in rows:
+            fields = tuple(c for c in RUN_COLUMN_DEFAULTS if c in row and c not in CLAIM_COLUMNS)
+            groups.setdefault(fields, []).append(row)
+
+        columns = list(RUN_COLUMN_DEFAULTS)
+        with self.transaction():
+            for fields, group in groups.items():
+                if fields:
+                    conflict = "DO UPDATE SET " + ", ".join(f"{c}=excluded.{c}" for c in fields)
+                else:
+                    conflict = "DO NOTHING"
+                self.conn.executemany(f"""
+                    INSERT INTO pipeline_retry (pipeline_name, original_run_id, {", ".join(columns)})
+                    VALUES ({", ".join("?" * (len(columns) + 2))})
+                    ON CONFLICT(pipeline_name, original_run_id) {conflict}
+                """, [
+                    [row["pipeline_name"], row["original_run_id"]] +
+                    [row.get(c, RUN_COLUMN_DEFAULTS[c]) for c in columns]
+                    for row in group
+                ])
+
+    @synchronized
+    def delete_runs(self, keys):
+        """Delete many (pipeline_name, original_run_id) rows in one transaction."""
+        with self.transaction():
+            self.conn.executemany("""
+                DELETE FROM pipeline_retry
+                WHERE pipeline_name=? AND original_run_id=?
+            """, list(keys))
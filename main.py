@@ -1,24 +1,79 @@
+import time
+STARTED_AT = time.perf_counter()  # before the imports below, which dominate startup
+
+import argparse
+import multiprocessing
+from config import ADF_FACTORIES, MONITOR_WORKERS
 from db_manager import DBManager
+from agents.approval_queue import ApprovalQueue, start_approval_server
 from agents.decision_logic_agent import DecisionLogicAgent
+from agents.failure_ingest import FailureIngestor, start_ingest_server
+from agents.factory_worker import run_worker
 from agents.monitoring_agent import MonitoringAgent
 from agents.notifier import Notifier
 from agents.trigger_rerun_agent import TriggerRerunAgent
 from services.openai_client import OpenAIClient
+from services.decision_cache import DecisionCache
 from services.adf_client import AzureDataFactoryClient
+from services.metrics import start_metrics_server
+from services.resource_usage import format_rss
 
 def main():
+    parser = argparse.ArgumentParser(description="AI-powered ADF pipeline monitor")
+    parser.add_argument("--workers", type=int, default=MONITOR_WORKERS,
+                        help="worker processes sharing the factories in ADF_FACTORIES")
+    args = parser.parse_args()
+
+    if len(ADF_FACTORIES) > 1 or args.workers > 1:
+        run_multi_factory(args.workers)
+        return
+
     print("[Main] Initializing agents and clients...")
 
-    db_manager = DBManager()  # ✅ new
-    notifier = Notifier()
+    db_manager = DBManager()  # one shared connection for every agent
+    notifier = Notifier(db_manager)
     adf_client = AzureDataFactoryClient()
-    openai_client = OpenAIClient()
+    openai_client = OpenAIClient(DecisionCache(db_manager))
     trigger_agent = TriggerRerunAgent(adf_client)
     decision_agent = DecisionLogicAgent(openai_client, trigger_agent, notifier, db_manager)
-    monitoring_agent = MonitoringAgent(adf_client, decision_agent)
-    
+    approvals = ApprovalQueue(db_manager)
+    monitoring_agent = MonitoringAgent(adf_client, decision_agent, db_manager, approval_queue=approvals)
+    approvals.on_decision = monitoring_agent.wake
+    start_approval_server(approvals)
+    # Pushed failures are processed right away; an alert without run details triggers a full poll
+    ingestor = FailureIngestor(db_manager, on_failure=lambda factory: monitoring_agent.notify_pushed(),
+                               on_alert=lambda factory: monitoring_agent.wake())
+    start_ingest_server(ingestor)
+    start_metrics_server()
+
+    print(f"[Main] Startup took {(time.perf_counter() - STARTED_AT) * 1000:.0f} ms (RSS {format_rss()}).")
     print("[Main] Starting monitoring agent polling loop.")
     monitoring_agent.poll()
 
+def run_multi_factory(workers):
+    """
+    Spread ADF_FACTORIES over `workers` processes. Run the same command on other
+    nodes against the same pipeline_monitor.db to scale out further; factory and
+    run leases keep instances from stepping on each other.
+    """
+    print(f"[Main] Starting {workers} worker process(es) for {len(ADF_FACTORIES)} factories.")
+    if workers <= 1:
+        start_approval_server(ApprovalQueue(DBManager()))
+        start_ingest_server(FailureIngestor(DBManager()))
+        run_worker(0, 1)
+        return
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(i, workers), name=f"adf-monitor-{i}")
+        for i in range(workers)
+    ]
+    for p in processes:
+        p.start()
+    # One approval and one ingestion endpoint for all workers; they pick answers and
+    # pushed failures up from the shared DB
+    start_approval_server(ApprovalQueue(DBManager()))
+    start_ingest_server(FailureIngestor(DBManager()))
+    for p in processes:
+        p.join()
+
 if __name__ == "__main__":
     main()
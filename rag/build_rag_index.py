@@ -1,52 +1,166 @@
 """
 Builds a FAISS index from PDFs in the knowledge_pdfs/ folder so the RAG retriever can use them.
 Run this whenever you add/update PDFs:
-    python rag/build_rag_index.py
+    python -m rag.build_rag_index
+
+By default the build is incremental: PDFs whose content hash matches manifest.json are
+skipped, and only the vectors of added, changed or removed PDFs are added to / deleted
+from the existing index. Changed PDFs are parsed and split in a process pool, and their
+chunks are embedded in batches with bounded concurrency. Force a from-scratch build with:
+    python -m rag.build_rag_index --full
+
+Each build also writes lexical_index.json, a BM25 inverted index over the same chunks.
+
+To rewrite an existing pickled index (index.pkl) as docstore.json without re-embedding:
+    python -m rag.build_rag_index --convert-docstore
 """
 
+import hashlib
+import json
 import os
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from langchain_openai import OpenAIEmbeddings
-from config import OPENAI_API_KEY
+from config import OPENAI_API_KEY, RAG_BUILD_WORKERS, RAG_EMBED_BATCH_SIZE, RAG_EMBED_CONCURRENCY
+from rag.index_store import INDEX_DIR, DOCSTORE_FILE, load_vectorstore, save_vectorstore
+from rag.lexical_index import LexicalIndex
 
 # Paths
 PDF_DIR = os.path.join(os.path.dirname(__file__), "..", "knowledge_pdfs")
-INDEX_DIR = os.path.join(os.path.dirname(__file__), "faiss_index")
+MANIFEST_FILE = "manifest.json"
 
-def build_index():
-    if not OPENAI_API_KEY:
-        raise ValueError("OPENAI_API_KEY not set in environment or config.py")
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-    all_docs = []
-    for fname in os.listdir(PDF_DIR):
-        if not fname.lower().endswith(".pdf"):
-            continue
-        pdf_path = os.path.join(PDF_DIR, fname)
-        print(f"[RAG] Loading PDF: {fname}")
-        loader = PyPDFLoader(pdf_path)
-        docs = loader.load()
+def _load_and_split(pdf_path, fname, content_hash):
+    """
+    Runs in a worker process: parse one PDF and split it into chunks.
+    Returns (chunk_ids, texts, metadatas) with chunk IDs derived from the file hash.
+    """
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-        # Split into manageable chunks
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        split_docs = splitter.split_documents(docs)
+    docs = PyPDFLoader(pdf_path).load()
 
+    # Split into manageable chunks
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    split_docs = splitter.split_documents(docs)
+
+    ids, texts, metadatas = [], [], []
+    for i, d in enumerate(split_docs):
         # Record source metadata
-        for d in split_docs:
-            d.metadata['source_file'] = fname
-        all_docs.extend(split_docs)
+        d.metadata['source_file'] = fname
+        ids.append(f"{fname}:{content_hash[:12]}:{i}")
+        texts.append(d.page_content)
+        metadatas.append(d.metadata)
+    return ids, texts, metadatas
+
+def _embed_in_batches(embeddings, texts):
+    """Embed `texts` in batches of RAG_EMBED_BATCH_SIZE, up to RAG_EMBED_CONCURRENCY requests at a time."""
+    batches = [texts[i:i + RAG_EMBED_BATCH_SIZE] for i in range(0, len(texts), RAG_EMBED_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=RAG_EMBED_CONCURRENCY) as pool:
+        results = list(pool.map(embeddings.embed_documents, batches))
+    return [vector for batch in results for vector in batch]
+
+def _load_manifest():
+    path = os.path.join(INDEX_DIR, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def _save_manifest(manifest):
+    path = os.path.join(INDEX_DIR, MANIFEST_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
 
-    print(f"[RAG] {len(all_docs)} total chunks extracted from PDFs.")
+def build_index(full=False):
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY not set in environment or config.py")
 
-    # Create embeddings for all chunks
     embeddings = OpenAIEmbeddings(api_key=OPENAI_API_KEY)
-    vectorstore = FAISS.from_documents(all_docs, embeddings)
+    manifest = None if full else _load_manifest()
+    if manifest and manifest.get("embedding_model") != embeddings.model:
+        print("[RAG] Embedding model changed since last build; rebuilding from scratch.")
+        manifest = None
+    if manifest and not os.path.exists(os.path.join(INDEX_DIR, DOCSTORE_FILE)):
+        manifest = None
+    previous = manifest["files"] if manifest else {}
+
+    # Work out what changed since the last build
+    current = {}
+    for fname in sorted(os.listdir(PDF_DIR)):
+        if fname.lower().endswith(".pdf"):
+            current[fname] = _file_hash(os.path.join(PDF_DIR, fname))
+    changed = [f for f, h in current.items() if previous.get(f, {}).get("sha256") != h]
+    removed = [f for f in previous if f not in current]
+    unchanged = len(current) - len(changed)
+    print(f"[RAG] {len(changed)} new/changed, {len(removed)} removed, {unchanged} unchanged PDF(s).")
+
+    if manifest and not changed and not removed:
+        print(f"[RAG] Index in {INDEX_DIR} is up to date.")
+        return
+
+    # Parse and split the changed PDFs in parallel
+    new_files = {}
+    all_ids, all_texts, all_metadatas = [], [], []
+    if changed:
+        with ProcessPoolExecutor(max_workers=RAG_BUILD_WORKERS) as pool:
+            futures = {
+                fname: pool.submit(_load_and_split, os.path.join(PDF_DIR, fname), fname, current[fname])
+                for fname in changed
+            }
+            for fname, future in futures.items():
+                ids, texts, metadatas = future.result()
+                print(f"[RAG] Loaded PDF: {fname} ({len(ids)} chunks)")
+                new_files[fname] = {"sha256": current[fname], "chunk_ids": ids}
+                all_ids.extend(ids)
+                all_texts.extend(texts)
+                all_metadatas.extend(metadatas)
 
-    # Save the FAISS index to disk
-    os.makedirs(INDEX_DIR, exist_ok=True)
-    vectorstore.save_local(INDEX_DIR)
-    print(f"[RAG] Index built and saved to {INDEX_DIR}")
+    print(f"[RAG] {len(all_texts)} chunk(s) to embed.")
+    vectors = _embed_in_batches(embeddings, all_texts) if all_texts else []
+
+    if manifest:
+        # Patch the existing index: drop vectors of changed/removed files, add the new ones
+        vectorstore = load_vectorstore(embeddings, INDEX_DIR, mmap=False)
+        stale_ids = [cid for f in changed + removed for cid in previous.get(f, {}).get("chunk_ids", [])]
+        if stale_ids:
+            vectorstore.delete(stale_ids)
+        if all_ids:
+            vectorstore.add_embeddings(list(zip(all_texts, vectors)), metadatas=all_metadatas, ids=all_ids)
+        files = {f: entry for f, entry in previous.items() if f not in removed}
+        files.update(new_files)
+        print(f"[RAG] Removed {len(stale_ids)} and added {len(all_ids)} vector(s).")
+    else:
+        if not all_ids:
+            raise ValueError(f"No PDF chunks found in {PDF_DIR}")
+        from langchain_community.vectorstores import FAISS
+        vectorstore = FAISS.from_embeddings(list(zip(all_texts, vectors)), embeddings,
+                                            metadatas=all_metadatas, ids=all_ids)
+        files = new_files
+
+    # Save the FAISS index to disk, with the BM25 index rebuilt over all chunks (local, cheap)
+    save_vectorstore(vectorstore, INDEX_DIR)
+    LexicalIndex.from_vectorstore(vectorstore).save(INDEX_DIR)
+    _save_manifest({"embedding_model": embeddings.model, "files": files})
+    print(f"[RAG] Index saved to {INDEX_DIR} ({vectorstore.index.ntotal} vectors).")
+
+def convert_docstore():
+    """Re-save a legacy index.pkl index in the docstore.json format (no embedding calls)."""
+    embeddings = OpenAIEmbeddings(api_key=OPENAI_API_KEY)
+    vectorstore = load_vectorstore(embeddings, INDEX_DIR, mmap=False)
+    save_vectorstore(vectorstore, INDEX_DIR)
+    LexicalIndex.from_vectorstore(vectorstore).save(INDEX_DIR)
+    print(f"[RAG] Wrote docstore.json and lexical_index.json for {vectorstore.index.ntotal} vectors in {INDEX_DIR}")
 
 if __name__ == "__main__":
-    build_index()
+    if "--convert-docstore" in sys.argv[1:]:
+        convert_docstore()
+    else:
+        build_index(full="--full" in sys.argv[1:])
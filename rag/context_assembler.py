@@ -0,0 +1,115 @@
+"""
+Builds the documentation context for the RAG prompt from the retrieved chunks.
+The index is split with chunk_overlap=200, so neighbouring hits repeat text; the
+assembler stitches overlapping chunks of the same source file back together, drops
+near-duplicate passages, and packs the rest (most relevant first) into a token budget.
+"""
+
+import re
+from config import RAG_CONTEXT_TOKEN_BUDGET, RAG_CONTEXT_DEDUP_THRESHOLD
+
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 400  # a little above the splitter's chunk_overlap
+SEPARATOR = "\n\n---\n\n"
+
+
+def _merge_overlapping(first, second):
+    """`first` + `second` if the end of `first` repeats the start of `second`, else None."""
+    if second in first:
+        return first
+    for k in range(min(len(first), len(second), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:k]):
+            return first + second[k:]
+    return None
+
+
+def _shingles(text, size=5):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class ContextAssembler:
+    def __init__(self, model_name="gpt-4o", token_budget=RAG_CONTEXT_TOKEN_BUDGET,
+                 dedup_threshold=RAG_CONTEXT_DEDUP_THRESHOLD):
+        self.model_name = model_name
+        self.token_budget = token_budget
+        self.dedup_threshold = dedup_threshold
+        self._encoding = None
+
+    def _get_encoding(self):
+        if self._encoding is None:
+            try:
+                import tiktoken
+                try:
+                    self._encoding = tiktoken.encoding_for_model(self.model_name)
+                except KeyError:
+                    self._encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                # tiktoken missing, or its BPE file can't be fetched (offline host): estimate ~4 chars per token
+                print(f"[ContextAssembler] Local tokenizer unavailable ({type(e).__name__}); estimating tokens.")
+                self._encoding = False
+        return self._encoding
+
+    def count_tokens(self, text):
+        encoding = self._get_encoding()
+        return len(encoding.encode(text)) if encoding else (len(text) + 3) // 4
+
+    def _truncate(self, text, max_tokens):
+        encoding = self._get_encoding()
+        if encoding:
+            return encoding.decode(encoding.encode(text)[:max_tokens])
+        return text[:max_tokens * 4]
+
+    def assemble(self, docs):
+        """
+        `docs`: retrieved Documents, most relevant first. Returns the context string.
+        """
+        # 1. Stitch overlapping/adjacent chunks of the same source file together
+        passages = []  # [source_file, text], in order of first (best) appearance
+        for doc in docs:
+            source = doc.metadata.get('source_file', 'Unknown')
+            text = doc.page_content.strip()
+            for passage in passages:
+                if passage[0] != source:
+                    continue
+                merged = _merge_overlapping(passage[1], text) or _merge_overlapping(text, passage[1])
+                if merged is not None:
+                    passage[1] = merged
+                    break
+            else:
+                passages.append([source, text])
+
+        # 2. Drop passages that are near-duplicates of a more relevant one
+        kept, kept_shingles = [], []
+        for source, text in passages:
+            shingles = _shingles(text)
+            if any(len(shingles & other) / len(shingles | other) >= self.dedup_threshold
+                   for other in kept_shingles):
+                continue
+            kept.append(f"Source: {source}\n{text}")
+            kept_shingles.append(shingles)
+
+        # 3. Pack into the token budget, most relevant first
+        sections, used = [], 0
+        separator_tokens = self.count_tokens(SEPARATOR)
+        for section in kept:
+            cost = self.count_tokens(section) + (separator_tokens if sections else 0)
+            if used + cost <= self.token_budget:
+                sections.append(section)
+                used += cost
+            elif not sections:
+                # Even the best passage is too long: keep its beginning
+                sections.append(self._truncate(section, self.token_budget))
+                used = self.token_budget
+                break
+        context = SEPARATOR.join(sections)
+
+        naive = SEPARATOR.join(
+            f"Source: {d.metadata.get('source_file', 'Unknown')}\n{d.page_content}" for d in docs
+        )
+        naive_tokens, context_tokens = self.count_tokens(naive), self.count_tokens(context)
+        print(f"[ContextAssembler] Context {context_tokens} tokens from {len(docs)} chunk(s) "
+              f"(saved {naive_tokens - context_tokens} of {naive_tokens}).")
+        return context
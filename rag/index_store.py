@@ -0,0 +1,111 @@
+"""
+On-disk format of the RAG index in rag/faiss_index/:
+    index.faiss     FAISS vectors, opened memory-mapped so pages load on demand
+    docstore.json   chunk texts/metadata and the vector -> chunk id mapping
+
+docstore.json replaces LangChain's pickled index.pkl: it loads faster (plain JSON, and
+Documents are only built for chunks a search actually returns) and is not executable.
+Indexes that only have index.pkl still load; run
+    python -m rag.build_rag_index --convert-docstore
+once to write docstore.json for them.
+"""
+
+import hashlib
+import json
+import os
+
+INDEX_DIR = os.path.join(os.path.dirname(__file__), "faiss_index")
+FAISS_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.json"
+
+_lazy_docstore_cls = None
+
+
+def _lazy_docstore_class():
+    """InMemoryDocstore whose entries stay raw dicts until a search returns them."""
+    global _lazy_docstore_cls
+    if _lazy_docstore_cls is None:
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+        from langchain_core.documents import Document
+
+        class LazyDocstore(InMemoryDocstore):
+            def search(self, search):
+                doc = self._dict.get(search)
+                if isinstance(doc, dict):
+                    doc = Document(page_content=doc["page_content"], metadata=doc["metadata"])
+                    self._dict[search] = doc
+                return doc if doc is not None else f"ID {search} not found."
+
+        _lazy_docstore_cls = LazyDocstore
+    return _lazy_docstore_cls
+
+
+def index_version(index_dir=INDEX_DIR):
+    """
+    Fingerprint of the index files on disk (size + mtime). Changes whenever the index
+    is rebuilt, which is what invalidates cached KB solutions.
+    """
+    parts = []
+    for name in (FAISS_FILE, DOCSTORE_FILE, "index.pkl", "lexical_index.json"):
+        try:
+            st = os.stat(os.path.join(index_dir, name))
+            parts.append(f"{name}:{st.st_size}:{st.st_mtime_ns}")
+        except OSError:
+            continue
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def _read_faiss_index(path, mmap):
+    import faiss
+    if mmap:
+        try:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            # Not every index type/FAISS build supports mmap; fall back to a full read
+            print(f"[RAG] Memory-mapped load not supported for this index ({e}); reading into RAM.")
+    return faiss.read_index(path)
+
+
+def load_vectorstore(embeddings, index_dir=INDEX_DIR, mmap=True):
+    """
+    Open the FAISS vector store in `index_dir`. Pass mmap=False when the index will be
+    modified (memory-mapped indexes are read-only).
+    """
+    from langchain_community.vectorstores import FAISS
+
+    docstore_path = os.path.join(index_dir, DOCSTORE_FILE)
+    if not os.path.exists(docstore_path):
+        print("[RAG] docstore.json not found; loading legacy pickled index.pkl.")
+        return FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+
+    index = _read_faiss_index(os.path.join(index_dir, FAISS_FILE), mmap)
+    with open(docstore_path, encoding="utf-8") as f:
+        data = json.load(f)
+    docstore = _lazy_docstore_class()(data["docs"])
+    index_to_docstore_id = {int(k): v for k, v in data["index_to_docstore_id"].items()}
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def save_vectorstore(vectorstore, index_dir=INDEX_DIR):
+    """Write index.faiss and docstore.json (atomically replacing the previous files)."""
+    import faiss
+
+    os.makedirs(index_dir, exist_ok=True)
+    docs = {}
+    for doc_id, doc in vectorstore.docstore._dict.items():
+        if isinstance(doc, dict):
+            docs[doc_id] = doc
+        else:
+            docs[doc_id] = {"page_content": doc.page_content, "metadata": doc.metadata}
+    data = {
+        "index_to_docstore_id": {str(k): v for k, v in vectorstore.index_to_docstore_id.items()},
+        "docs": docs,
+    }
+
+    faiss_path = os.path.join(index_dir, FAISS_FILE)
+    faiss.write_index(vectorstore.index, faiss_path + ".tmp")
+    docstore_path = os.path.join(index_dir, DOCSTORE_FILE)
+    with open(docstore_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(faiss_path + ".tmp", faiss_path)
+    os.replace(docstore_path + ".tmp", docstore_path)
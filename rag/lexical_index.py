@@ -0,0 +1,124 @@
+"""
+Local BM25 inverted index over the knowledge-base chunks, stored next to the FAISS index
+as lexical_index.json. ADF errors are full of exact tokens (error codes like "ErrorCode: 2200",
+ErrorCode=UserErrorFailedFileOperation, connector names) that dense similarity often
+misses; this index matches them directly, with no embedding call.
+"""
+
+import json
+import math
+import os
+import re
+from collections import Counter
+
+LEXICAL_INDEX_FILE = "lexical_index.json"
+
+# Words joined by '=', '.', '-' or '_' stay together as one token ("errorcode=usererrorfailedfileoperation"),
+# and each part is indexed on its own as well
+_COMPOUND_TOKEN = re.compile(r"[a-z0-9]+(?:[=._-][a-z0-9]+)*")
+# ErrorCode=..., UserError*/SystemError* and SNAKE_CASE names (AZURE_QUOTA_EXCEEDED_EXCEPTION)
+_CODE_TOKEN = re.compile(r"^(?:errorcode=\S+|(?:user|system)error\w+|[a-z0-9]+(?:_[a-z0-9]+){2,})$")
+# Numeric codes only where they are labelled as one ("ErrorCode: 2200", "error code 2200"),
+# not every number in a message (years, durations, row counts, request IDs)
+_NUMERIC_CODE = re.compile(r"\berror\s?code\s*[:=]?\s*(\d{3,5})\b")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it of on or that the this to was were will with".split()
+)
+
+
+def tokenize(text):
+    tokens = []
+    for compound in _COMPOUND_TOKEN.findall((text or "").lower()):
+        parts = re.split(r"[=._-]", compound)
+        if len(parts) > 1:
+            tokens.append(compound)
+        tokens.extend(p for p in parts if p and p not in _STOPWORDS)
+    return tokens
+
+
+def code_terms(text):
+    """Tokens that look like ADF error codes, which should match exactly."""
+    terms = {t for t in tokenize(text) if _CODE_TOKEN.match(t)}
+    terms.update(_NUMERIC_CODE.findall((text or "").lower()))
+    return terms
+
+
+class LexicalIndex:
+    def __init__(self, chunk_ids, doc_lengths, postings, k1=1.5, b=0.75):
+        self.chunk_ids = chunk_ids
+        self.doc_lengths = doc_lengths
+        self.postings = postings  # term -> [[doc_index, term_frequency], ...]
+        self.k1 = k1
+        self.b = b
+        n = len(chunk_ids)
+        self.avg_length = (sum(doc_lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            for term, plist in postings.items()
+        }
+        self._terms_by_doc = None
+
+    @classmethod
+    def build(cls, chunks):
+        """`chunks`: iterable of (chunk_id, text)."""
+        chunk_ids, doc_lengths, postings = [], [], {}
+        for doc_index, (chunk_id, text) in enumerate(chunks):
+            counts = Counter(tokenize(text))
+            chunk_ids.append(chunk_id)
+            doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append([doc_index, tf])
+        return cls(chunk_ids, doc_lengths, postings)
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore):
+        chunks = []
+        for chunk_id in vectorstore.index_to_docstore_id.values():
+            doc = vectorstore.docstore.search(chunk_id)
+            chunks.append((chunk_id, doc.page_content))
+        return cls.build(chunks)
+
+    def save(self, index_dir):
+        path = os.path.join(index_dir, LEXICAL_INDEX_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"chunk_ids": self.chunk_ids, "doc_lengths": self.doc_lengths,
+                       "postings": self.postings}, f)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, index_dir):
+        """Returns None when the index has no lexical_index.json (built by an older version)."""
+        path = os.path.join(index_dir, LEXICAL_INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["chunk_ids"], data["doc_lengths"], data["postings"])
+
+    def search(self, query, k):
+        """Top-k (chunk_id, bm25_score) pairs for `query`."""
+        scores = {}
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = self.idf[term]
+            for doc_index, tf in plist:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_index] / (self.avg_length or 1))
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.chunk_ids[i], score) for i, score in ranked]
+
+    def knows_all(self, terms):
+        """True if every one of `terms` occurs somewhere in the index."""
+        return all(term in self.postings for term in terms)
+
+    def contains_all(self, chunk_id, terms):
+        """True if the chunk contains every one of `terms`."""
+        if self._terms_by_doc is None:
+            by_doc = {}
+            for term, plist in self.postings.items():
+                for doc_index, _ in plist:
+                    by_doc.setdefault(self.chunk_ids[doc_index], set()).add(term)
+            self._terms_by_doc = by_doc
+        return set(terms) <= self._terms_by_doc.get(chunk_id, set())
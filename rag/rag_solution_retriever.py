@@ -1,16 +1,23 @@
 """
 RAGSolutionRetriever
 Given a failure rationale, searches the FAISS index built from your PDFs and uses GPT to suggest a solution.
-"""
 
-import os
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from config import OPENAI_API_KEY
+Constructing the retriever is cheap: LangChain, the FAISS index and the chat client are
+only loaded on the first get_solution() call, so monitors that see no failures never pay for them.
+"""
 
-INDEX_DIR = os.path.join(os.path.dirname(__file__), "faiss_index")
+import hashlib
+import threading
+import time
+from array import array
+from config import OPENAI_API_KEY, RAG_EMBEDDING_CACHE_TTL_SECONDS, RAG_SOLUTION_CACHE_TTL_SECONDS, \
+    RAG_RETRIEVAL_MODE
+from rag.context_assembler import ContextAssembler
+from rag.index_store import INDEX_DIR, index_version, load_vectorstore
+from rag.lexical_index import LexicalIndex, code_terms
+from services.error_signature import normalize_error_message
+from services.metrics import metrics
+from services.resource_usage import rss_mb, format_rss
 
 PROMPT_TEMPLATE = """You are an Azure Data Factory troubleshooting assistant.
 Given this failure reason from a pipeline run:
@@ -25,39 +32,182 @@ Provide a direct, actionable, step-by-step solution based ONLY on the above docu
 If no relevant solution is in the documentation, reply exactly: 'No documented solution found.'
 """
 
+class _LoadedIndex:
+    """One loaded index version. Replaced as a whole on reload, so a query never mixes versions."""
+    __slots__ = ("vectorstore", "lexical", "embeddings", "version")
+
+    def __init__(self, vectorstore, lexical, embeddings, version):
+        self.vectorstore = vectorstore
+        self.lexical = lexical
+        self.embeddings = embeddings
+        self.version = version
+
+
 class RAGSolutionRetriever:
-    def __init__(self, top_k=3, model_name="gpt-4o"):
+    def __init__(self, top_k=3, model_name="gpt-4o", index_dir=INDEX_DIR, db_manager=None,
+                 retrieval_mode=RAG_RETRIEVAL_MODE):
         if not OPENAI_API_KEY:
             raise ValueError("OPENAI_API_KEY not set in environment or config.py")
+        if retrieval_mode not in ("vector", "hybrid", "lexical"):
+            raise ValueError(f"Unknown RAG retrieval mode: {retrieval_mode}")
+
+        self.top_k = top_k
+        self.retrieval_mode = retrieval_mode
+        self.model_name = model_name
+        self.index_dir = index_dir
+        # Optional DBManager: caches query embeddings and final solutions across calls/restarts
+        self.db = db_manager
+        self._index = None  # _LoadedIndex, swapped in one assignment by _ensure_loaded
+        self.llm = None
+        self._load_lock = threading.Lock()
+        self.assembler = ContextAssembler(model_name)
+
+    def _ensure_loaded(self):
+        """
+        The loaded index, (re)loaded when missing or rebuilt. Queries keep the object they got
+        for their whole search, so a concurrent reload never pairs a new FAISS index with
+        an old docstore.
+        """
+        # A rebuilt index shows up as a new version: reload it (and stop using old solutions)
+        loaded = self._index
+        if loaded is not None and index_version(self.index_dir) == loaded.version:
+            return loaded
+        with self._load_lock:
+            current_version = index_version(self.index_dir)
+            loaded = self._index
+            if loaded is not None and current_version == loaded.version:
+                return loaded
+            started, rss_before = time.perf_counter(), rss_mb()
+
+            # Heavy imports are deferred until the first failure needs a solution
+            from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+            from langchain_core.prompts import PromptTemplate
+            from langchain_core.output_parsers import StrOutputParser
 
-        # Load index and retriever
-        embeddings = OpenAIEmbeddings(api_key=OPENAI_API_KEY)
-        self.vectorstore = FAISS.load_local(INDEX_DIR, embeddings, allow_dangerous_deserialization=True)
-        self.retriever = self.vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": top_k})
+            # Load index (memory-mapped)
+            # Queries are short failure rationales: skip the client-side tiktoken length check
+            # (it costs a tokenization per query and a vocabulary download on first use)
+            embeddings = OpenAIEmbeddings(api_key=OPENAI_API_KEY, check_embedding_ctx_length=False)
+            vectorstore = load_vectorstore(embeddings, self.index_dir)
+            lexical = LexicalIndex.load(self.index_dir)
+            if lexical is None and self.retrieval_mode != "vector":
+                print("[RAGSolutionRetriever] No lexical_index.json; falling back to vector-only retrieval. "
+                      "Rebuild the index to enable lexical search.")
 
-        # Setup LLM & prompt
-        self.llm = ChatOpenAI(model_name=model_name, temperature=0, api_key=OPENAI_API_KEY)
-        self.prompt = PromptTemplate.from_template(PROMPT_TEMPLATE)
-        self.parser = StrOutputParser()
+            # Setup LLM & prompt (independent of the index version)
+            if self.llm is None:
+                self.llm = ChatOpenAI(model_name=self.model_name, temperature=0, api_key=OPENAI_API_KEY)
+                self.prompt = PromptTemplate.from_template(PROMPT_TEMPLATE)
+                self.parser = StrOutputParser()
+            loaded = self._index = _LoadedIndex(vectorstore, lexical, embeddings, current_version)
+            if self.db:
+                self.db.purge_stale_solutions(current_version)
 
-    def get_solution(self, failure_reason: str) -> str:
-        """Retrieve and summarize a solution for the given failure reason."""
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            metrics.observe("rag.load", elapsed_ms / 1000)
+            rss_after = rss_mb()
+            rss_delta = f"{rss_after - rss_before:+.1f} MB" if None not in (rss_before, rss_after) else "n/a"
+            print(f"[RAGSolutionRetriever] Loaded {vectorstore.index.ntotal} vectors in {elapsed_ms:.0f} ms "
+                  f"(RSS {format_rss()}, {rss_delta}).")
+            return loaded
+
+    def _embed_query(self, embeddings, text: str):
+        """Embedding for a query, served from the cache when the same text was embedded before."""
+        if not self.db:
+            with metrics.timer("rag.embed"):
+                return embeddings.embed_query(text)
+        text_hash = hashlib.sha1(f"{embeddings.model}|{text}".encode("utf-8")).hexdigest()
+        cached = self.db.get_cached_embedding(text_hash, RAG_EMBEDDING_CACHE_TTL_SECONDS)
+        metrics.cache("embedding", hits=cached is not None, misses=cached is None)
+        if cached is not None:
+            return array("f", cached).tolist()
+        with metrics.timer("rag.embed"):
+            vector = embeddings.embed_query(text)
+        self.db.put_cached_embedding(text_hash, array("f", vector).tobytes())
+        return vector
+
+    def _vector_search(self, loaded, query: str, k: int):
+        """Top-k chunk IDs by embedding similarity."""
+        import numpy as np
+        vector = np.array([self._embed_query(loaded.embeddings, query)], dtype=np.float32)
+        with metrics.timer("rag.faiss_search"):
+            _, indices = loaded.vectorstore.index.search(vector, k)
+        return [loaded.vectorstore.index_to_docstore_id[int(i)] for i in indices[0] if i != -1]
+
+    def _search(self, loaded, query: str, error_message: str = ""):
+        """
+        Top-k chunks for the failure as (chunk_id, Document) pairs, and the error codes they
+        all quote when the lexical fast path took them (else None).
+        """
+        lexical_query = f"{query}\n{error_message or ''}"
+        chunk_ids, matched_codes = None, None
+        lexical = loaded.lexical
+
+        if lexical is not None and self.retrieval_mode != "vector":
+            with metrics.timer("rag.bm25_search"):
+                lexical_ids = [cid for cid, _ in lexical.search(lexical_query, self.top_k * 2)]
+            codes = code_terms(lexical_query)
+            if self.retrieval_mode == "lexical":
+                chunk_ids = lexical_ids[:self.top_k]
+            elif codes and lexical_ids and lexical.knows_all(codes) and lexical.contains_all(lexical_ids[0], codes):
+                # Exact match on documented error codes: the chunks quoting them are the answer, no network call
+                print(f"[RAGSolutionRetriever] Lexical fast path on {sorted(codes)}.")
+                chunk_ids = [cid for cid in lexical_ids[:self.top_k] if lexical.contains_all(cid, codes)]
+                matched_codes = codes
+            else:
+                # Reciprocal rank fusion of the lexical and vector rankings
+                scores = {}
+                for ranking in (lexical_ids, self._vector_search(loaded, query, self.top_k * 2)):
+                    for rank, cid in enumerate(ranking):
+                        scores[cid] = scores.get(cid, 0.0) + 1.0 / (60 + rank)
+                chunk_ids = sorted(scores, key=scores.get, reverse=True)[:self.top_k]
+
+        if chunk_ids is None:
+            chunk_ids = self._vector_search(loaded, query, self.top_k)
+        return [(cid, loaded.vectorstore.docstore.search(cid)) for cid in chunk_ids], matched_codes
+
+    def get_solution(self, failure_reason: str, error_message: str = "") -> str:
+        """
+        Retrieve and summarize a solution for the given failure reason.
+        `error_message` (the raw ADF error) adds exact error codes to the lexical search;
+        when the knowledge base quotes them, the matching passages are returned as they are
+        (or a solution cached for them), without calling the LLM.
+        """
         if not failure_reason.strip():
             return "No documented solution found."
 
+        loaded = self._ensure_loaded()
+
         # Get top_k relevant chunks from the vector store
-        docs = self.retriever.invoke(failure_reason)
-        if not docs:
+        hits, matched_codes = self._search(loaded, failure_reason, error_message)
+        if not hits:
             return "No documented solution found."
 
-        # Format retrieved docs for prompt
-        context = "\n\n---\n\n".join(
-            [f"Source: {d.metadata.get('source_file', 'Unknown')}\n{d.page_content}" for d in docs]
-        )
+        # Same chunks for the same (normalized) failure -> same answer; skip the LLM call
+        solution_key = None
+        if self.db:
+            chunk_ids = ",".join(sorted(chunk_id for chunk_id, _ in hits))
+            signature = normalize_error_message(failure_reason)
+            solution_key = hashlib.sha1(f"{chunk_ids}|{signature}".encode("utf-8")).hexdigest()
+            cached = self.db.get_cached_solution(solution_key, loaded.version, RAG_SOLUTION_CACHE_TTL_SECONDS)
+            metrics.cache("rag_solution", hits=cached is not None, misses=cached is None)
+            if cached is not None:
+                print("[RAGSolutionRetriever] Solution cache hit.")
+                return cached
+
+        # Format retrieved docs for prompt: overlapping chunks merged, duplicates dropped, within the token budget
+        context = self.assembler.assemble([d for _, d in hits])
+        if matched_codes:
+            metrics.count("rag.fast_path")
+            return f"Documented for {', '.join(sorted(matched_codes))}:\n{context}"
 
         # Prepare final prompt
         prompt_msg = self.prompt.invoke({"failure_reason": failure_reason, "context": context})
 
         # Get response from LLM
-        response = self.llm.invoke(prompt_msg)
-        return self.parser.invoke(response)
+        with metrics.timer("rag.llm"):
+            response = self.llm.invoke(prompt_msg)
+        solution = self.parser.invoke(response)
+        if solution_key:
+            self.db.put_cached_solution(solution_key, loaded.version, solution)
+        return solution
@@ -1,174 +1,291 @@
-import requests
 import datetime
-from config import ADF_SUBSCRIPTION_ID, ADF_RESOURCE_GROUP, ADF_FACTORY_NAME, ADF_TENANT_ID, \
-    ADF_CLIENT_ID, ADF_CLIENT_SECRET, PIPELINES_TO_MONITOR
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from services.arm_requests import ArmRequestEngine, ArmResult
+from services.azure_credentials import AzureTokenCredential, create_pooled_session
+from services.metrics import metrics
+from config import ADF_FACTORIES, ARM_ENDPOINT, ACTIVITY_RUN_CACHE_MAX_ENTRIES, ACTIVITY_QUERY_CONCURRENCY
+
+# Activities that only fail because something inside them failed
+CONTAINER_ACTIVITY_TYPES = {"ForEach", "Until", "IfCondition", "Switch", "ExecutePipeline"}
+# Activity-run query window for runs whose start/end times we don't know
+DEFAULT_ACTIVITY_LOOKBACK = datetime.timedelta(days=7)
 
 
 class AzureDataFactoryClient:
-    def _get_token(self):
+    def __init__(self, factory=None, credential=None, session=None, engine=None):
+        # Target factory: one entry of ADF_FACTORIES (defaults to the single .env factory)
+        factory = factory or ADF_FACTORIES[0]
+        self.subscription_id = factory["subscription_id"]
+        self.resource_group = factory["resource_group"]
+        self.factory_name = factory["factory_name"]
+        self.pipelines = list(factory["pipelines"])
+
+        # One keep-alive pool and one cached token shared by every ARM call
+        # (pass the same credential/session to clients of several factories to share them)
+        self.session = session or create_pooled_session()
+        self.credential = credential or AzureTokenCredential(session=self.session)
+        # Rate limits, retries and circuit breakers; share one engine across factories too
+        self.engine = engine or ArmRequestEngine(self.session, self.credential)
+
+        # run_id -> failed activity runs; a finished run's activity runs never change
+        self._activity_cache = OrderedDict()
+        self._activity_cache_lock = threading.Lock()
+
+    def _factory_url(self, path):
+        return (
+            f"{ARM_ENDPOINT}/subscriptions/{self.subscription_id}/resourceGroups/"
+            f"{self.resource_group}/providers/Microsoft.DataFactory/factories/"
+            f"{self.factory_name}/{path}?api-version=2018-06-01"
+        )
+
+    def _request(self, method, path, endpoint, write=False, **kwargs):
+        """One ARM call through the shared engine; returns an ArmResult."""
+        return self.engine.request(method, self._factory_url(path), endpoint, self.subscription_id,
+                                   write=write, **kwargs)
+
+    def query_pipeline_runs(self, filter_params):
         """
-        Authenticate with Azure AD to get Bearer token for ADF REST API access.
+        Pipeline runs matching `filter_params`, following `continuationToken` page by
+        page so busy factories don't lose runs after the first page. Returns an
+        ArmResult with the list of runs (unavailable if any page could not be read).
         """
-        print("[ADFClient] Fetching Azure AD token...")
-        url = f"https://login.microsoftonline.com/{ADF_TENANT_ID}/oauth2/token"
-        payload = {
-            'grant_type': 'client_credentials',
-            'client_id': ADF_CLIENT_ID,
-            'client_secret': ADF_CLIENT_SECRET,
-            'resource': 'https://management.azure.com/'
+        return self._query_all("queryPipelineRuns", filter_params, "arm.query_pipeline_runs")
+
+    def _query_all(self, path, filter_params, endpoint):
+        body = dict(filter_params)
+        items = []
+        while True:
+            result = self._request("POST", path, endpoint, json=body)
+            if not result.ok:
+                return result
+            items.extend(result.value.get("value", []))
+            token = result.value.get("continuationToken")
+            if not token:
+                break
+            body["continuationToken"] = token
+        result.value = items
+        return result
+
+    def get_pipeline_runs_snapshot(self, hours=2, statuses=("Failed", "Succeeded"),
+                                   updated_after=None, updated_before=None):
+        """
+        Query ADF once for runs of the monitored pipelines updated in the last `hours`
+        (or between `updated_after` and `updated_before` when given),
+        with pipeline-name and status filters applied server side.
+        Returns {"failed": [...], "succeeded": [...]}, or None if ARM was unavailable
+        (throttled, down) or rejected the query - never an empty snapshot in that case.
+        """
+        print("[ADFClient] Querying pipeline run snapshot from ADF...")
+        updated_before = updated_before or datetime.datetime.utcnow()
+        updated_after = updated_after or updated_before - datetime.timedelta(hours=hours)
+        filter_params = {
+            "lastUpdatedAfter": updated_after.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            "lastUpdatedBefore": updated_before.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            "filters": [
+                {"operand": "PipelineName", "operator": "In", "values": self.pipelines},
+                {"operand": "Status", "operator": "In", "values": list(statuses)}
+            ]
         }
-        try:
-            res = requests.post(url, data=payload)
-            res.raise_for_status()
-            print("[ADFClient] Token received.")
-            return res.json()["access_token"]
-        except Exception as e:
-            print(f"[ADFClient] Failed to obtain token: {e}")
-            raise  # re-raise since token is required
+        result = self.query_pipeline_runs(filter_params)
+        if not result.ok:
+            print(f"[ADFClient] Error fetching pipeline run snapshot: {result}")
+            return None
+        snapshot = {"failed": [], "succeeded": []}
+        for run in result.value:
+            status = run.get("status")
+            if status == "Failed":
+                snapshot["failed"].append(run)
+            elif status == "Succeeded":
+                snapshot["succeeded"].append(run)
+        print(f"[ADFClient] {len(snapshot['failed'])} failed and {len(snapshot['succeeded'])} successful "
+              f"pipeline(s) updated since {filter_params['lastUpdatedAfter']} (filtered to monitored pipelines).")
+        return snapshot
 
-    def get_failed_pipelines(self, hours=2):
+    def get_failed_activity_runs(self, runs):
         """
-        Query ADF for failed pipeline runs in the last `hours`.
-        Returns ONLY those in PIPELINES_TO_MONITOR.
-        """
-        print("[ADFClient] Querying failed pipeline runs from ADF...")
-        token = self._get_token()
-        url = (
-            f"https://management.azure.com/subscriptions/{ADF_SUBSCRIPTION_ID}/resourceGroups/"
-            f"{ADF_RESOURCE_GROUP}/providers/Microsoft.DataFactory/factories/"
-            f"{ADF_FACTORY_NAME}/queryPipelineRuns?api-version=2018-06-01"
-        )
+        Failed activity runs of each pipeline run in `runs` (run dicts as returned by
+        queryPipelineRuns, or anything with a 'runId'), as {run_id: [activity_run, ...]}.
+        Runs not cached yet are queried through queryActivityruns in parallel (all pages);
+        runs whose query failed (or ARM was unavailable for) are left out of the result.
+        """
+        result, missing = {}, {}
+        with self._activity_cache_lock:
+            for run in runs:
+                cached = self._activity_cache.get(run['runId'])
+                if cached is not None:
+                    self._activity_cache.move_to_end(run['runId'])
+                    result[run['runId']] = cached
+                else:
+                    missing.setdefault(run['runId'], run)
+        missing = list(missing.values())
+        metrics.cache("activity_runs", hits=len(result), misses=len(missing))
+        if not missing:
+            return result
+
+        def query(run):
+            result = self._query_all(f"pipelineruns/{run['runId']}/queryActivityruns", self._activity_filter(run),
+                                     "arm.query_activity_runs")
+            if not result.ok:
+                print(f"[ADFClient] Error fetching activity runs for runId {run['runId']}: {result}")
+                return run['runId'], None
+            return run['runId'], result.value
+
+        if len(missing) == 1:
+            fetched = [query(missing[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(ACTIVITY_QUERY_CONCURRENCY, len(missing))) as pool:
+                fetched = list(pool.map(query, missing))
+
+        with self._activity_cache_lock:
+            for run_id, activities in fetched:
+                if activities is None:
+                    continue
+                result[run_id] = activities
+                self._activity_cache[run_id] = activities
+                self._activity_cache.move_to_end(run_id)
+            while len(self._activity_cache) > ACTIVITY_RUN_CACHE_MAX_ENTRIES:
+                self._activity_cache.popitem(last=False)
+        print(f"[ADFClient] Fetched failed activity runs for {len(missing)} pipeline run(s).")
+        return result
+
+    @staticmethod
+    def _activity_filter(run):
+        # queryActivityruns needs a lastUpdated window; bracket the pipeline run generously
+        def parse(value):
+            return datetime.datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S') if value else None
         now = datetime.datetime.utcnow()
-        filter_params = {
-            "lastUpdatedAfter": (now - datetime.timedelta(hours=hours)).strftime('%Y-%m-%dT%H:%M:%SZ'),
-            "lastUpdatedBefore": now.strftime('%Y-%m-%dT%H:%M:%SZ')
+        start = parse(run.get('runStart')) or now - DEFAULT_ACTIVITY_LOOKBACK
+        end = parse(run.get('runEnd')) or now
+        return {
+            "lastUpdatedAfter": (start - datetime.timedelta(minutes=5)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            "lastUpdatedBefore": (end + datetime.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            "filters": [{"operand": "Status", "operator": "Equals", "values": ["Failed"]}]
         }
-        headers = {"Authorization": f"Bearer {token}"}
-        try:
-            res = requests.post(url, headers=headers, json=filter_params)
-            res.raise_for_status()
-            runs = res.json().get("value", [])
-            failed = [
-                run for run in runs
-                if run.get("status") == "Failed"
-                and run.get("pipelineName") in PIPELINES_TO_MONITOR
-            ]
-            print(f"[ADFClient] {len(failed)} failed pipeline(s) detected in last {hours} hour(s) "
-                  f"(filtered to monitored pipelines).")
-            return failed
-        except Exception as e:
-            print(f"[ADFClient] Error fetching failed pipeline runs: {e}")
-            if hasattr(e, 'response'):
-                print(f"Response content: {e.response.text}")
-            return []
+
+    @staticmethod
+    def root_cause_activity(activities):
+        """
+        The failed activity that most likely caused the run to fail: the first one to end,
+        preferring real work over containers (ForEach, ExecutePipeline, ...) that fail
+        because of it. Returns a summary dict, or None.
+        """
+        if not activities:
+            return None
+        candidates = [a for a in activities if a.get('activityType') not in CONTAINER_ACTIVITY_TYPES] or activities
+        activity = min(candidates, key=lambda a: a.get('activityRunEnd') or a.get('activityRunStart') or "")
+        error = activity.get('error') or {}
+        return {
+            "activityName": activity.get('activityName'),
+            "activityType": activity.get('activityType'),
+            "errorCode": error.get('errorCode'),
+            "failureType": error.get('failureType'),
+            "message": error.get('message', ''),
+        }
+
+    def get_failed_pipelines(self, hours=2):
+        """
+        Query ADF for failed pipeline runs in the last `hours`.
+        Returns ONLY those of the monitored pipelines, or None if ARM was unavailable.
+        """
+        snapshot = self.get_pipeline_runs_snapshot(hours=hours, statuses=("Failed",))
+        return snapshot["failed"] if snapshot else None
 
     def get_successful_pipelines(self, hours=2):
         """
         Query ADF for succeeded pipeline runs in the last `hours`.
-        Returns ONLY those in PIPELINES_TO_MONITOR.
-        """
-        print("[ADFClient] Querying successful pipeline runs from ADF...")
-        token = self._get_token()
-        url = (
-            f"https://management.azure.com/subscriptions/{ADF_SUBSCRIPTION_ID}/resourceGroups/"
-            f"{ADF_RESOURCE_GROUP}/providers/Microsoft.DataFactory/factories/"
-            f"{ADF_FACTORY_NAME}/queryPipelineRuns?api-version=2018-06-01"
-        )
-        now = datetime.datetime.utcnow()
-        filter_params = {
-            "lastUpdatedAfter": (now - datetime.timedelta(hours=hours)).strftime('%Y-%m-%dT%H:%M:%SZ'),
-            "lastUpdatedBefore": now.strftime('%Y-%m-%dT%H:%M:%SZ')
-        }
-        headers = {"Authorization": f"Bearer {token}"}
-        try:
-            res = requests.post(url, headers=headers, json=filter_params)
-            res.raise_for_status()
-            runs = res.json().get("value", [])
-            succeeded = [
-                run for run in runs
-                if run.get("status") == "Succeeded"
-                and run.get("pipelineName") in PIPELINES_TO_MONITOR
-            ]
-            print(f"[ADFClient] {len(succeeded)} successful pipeline(s) detected in last {hours} hour(s) "
-                  f"(filtered to monitored pipelines).")
-            return succeeded
-        except Exception as e:
-            print(f"[ADFClient] Error fetching successful pipeline runs: {e}")
-            if hasattr(e, 'response'):
-                print(f"Response content: {e.response.text}")
-            return []
+        Returns ONLY those of the monitored pipelines, or None if ARM was unavailable.
+        """
+        snapshot = self.get_pipeline_runs_snapshot(hours=hours, statuses=("Succeeded",))
+        return snapshot["succeeded"] if snapshot else None
 
     def rerun_pipeline(self, pipeline_name, start_activity=None):
         """
         Start a NEW pipeline run by its name (not tied to a specific failed run).
         Useful for fresh runs, not for retrying failed runs.
+        Returns an ArmResult ({"runId": "..."} when ok).
         """
         print(f"[ADFClient] Triggering pipeline '{pipeline_name}' (start_activity={start_activity})...")
-        token = self._get_token()
-        url = (
-            f"https://management.azure.com/subscriptions/{ADF_SUBSCRIPTION_ID}/resourceGroups/"
-            f"{ADF_RESOURCE_GROUP}/providers/Microsoft.DataFactory/factories/"
-            f"{ADF_FACTORY_NAME}/pipelines/{pipeline_name}/createRun?api-version=2018-06-01"
-        )
         body = {}
         if start_activity:
             body = {
                 "isRecovery": True,
                 "startActivityName": start_activity
             }
-        headers = {"Authorization": f"Bearer {token}"}
-        try:
-            res = requests.post(url, headers=headers, json=body)
-            res.raise_for_status()
+        result = self._request("POST", f"pipelines/{pipeline_name}/createRun", "arm.create_run", write=True, json=body)
+        if result.ok:
             print("[ADFClient] Pipeline run started successfully.")
-            return res.json()
-        except Exception as e:
-            print(f"[ADFClient] Error starting pipeline: {e}")
-            if hasattr(e, 'response'):
-                print(f"Response content: {e.response.text}")
-            return None
+        else:
+            print(f"[ADFClient] Error starting pipeline: {result}")
+        return result
+
+    def rerun_from_failure(self, pipeline_name, run_id, start_activity=None):
+        """
+        Recovery rerun of a failed run: activities that succeeded in `run_id` are skipped
+        and execution resumes at the failed activity (or at `start_activity` when given).
+        Returns an ArmResult ({"runId": "..."} of the new run when ok).
+        """
+        print(f"[ADFClient] Triggering recovery rerun of runId={run_id} "
+              f"from {start_activity or 'the failed activity'}...")
+        params = {"referencePipelineRunId": run_id, "isRecovery": "true"}
+        if start_activity:
+            params["startActivityName"] = start_activity
+        else:
+            params["startFromFailure"] = "true"
+        result = self._request("POST", f"pipelines/{pipeline_name}/createRun", "arm.recovery_run", write=True,
+                               params=params, json={})
+        if result.ok:
+            print("[ADFClient] Recovery rerun started successfully.")
+        else:
+            print(f"[ADFClient] Error starting recovery rerun: {result}")
+        return result
 
     def rerun_pipeline_by_run_id(self, run_id):
         """
         Trigger a rerun of a specific failed run (ADF Monitor -> Rerun equivalent).
         This uses the original runId and creates a new one for the rerun.
+        Returns an ArmResult ({"runId": "..."} for the new run when ok).
         """
         print(f"[ADFClient] Triggering rerun from monitor for runId={run_id}...")
-        token = self._get_token()
-        url = (
-            f"https://management.azure.com/subscriptions/{ADF_SUBSCRIPTION_ID}/resourceGroups/"
-            f"{ADF_RESOURCE_GROUP}/providers/Microsoft.DataFactory/factories/"
-            f"{ADF_FACTORY_NAME}/pipelineruns/{run_id}/rerun?api-version=2018-06-01"
-        )
-        headers = {"Authorization": f"Bearer {token}"}
-        try:
-            res = requests.post(url, headers=headers)
-            res.raise_for_status()
+        result = self._request("POST", f"pipelineruns/{run_id}/rerun", "arm.rerun", write=True)
+        if result.ok:
             print("[ADFClient] Monitor rerun triggered successfully.")
-            return res.json()  # returns {"runId": "..."} for new run
-        except Exception as e:
-            print(f"[ADFClient] Error rerunning pipeline run by run_id: {e}")
-            if hasattr(e, 'response'):
-                print(f"Response content: {e.response.text}")
-            return None
+        else:
+            print(f"[ADFClient] Error rerunning pipeline run by run_id: {result}")
+        return result
+
+    def find_rerun(self, run_id):
+        """
+        The latest rerun of `run_id`, if one was started (e.g. by a rerun request whose reply
+        was lost), as an ArmResult whose value is the rerun's run dict or None. ADF marks a run
+        that has been rerun as no longer `isLatest`; its reruns share its `runGroupId`.
+        """
+        original = self.get_pipeline_run_status(run_id)
+        if not original.ok:
+            return original
+        run = original.value
+        if run.get('isLatest', True) or not run.get('runGroupId'):
+            return ArmResult(ArmResult.OK, None)
+        filter_params = self._activity_filter(run)
+        filter_params["lastUpdatedBefore"] = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        filter_params["filters"] = [
+            {"operand": "RunGroupId", "operator": "Equals", "values": [run['runGroupId']]},
+            {"operand": "LatestOnly", "operator": "Equals", "values": ["true"]}
+        ]
+        result = self.query_pipeline_runs(filter_params)
+        if not result.ok:
+            return result
+        reruns = [r for r in result.value if r['runId'] != run_id]
+        result.value = max(reruns, key=lambda r: r.get('runStart') or '') if reruns else None
+        return result
 
     def get_pipeline_run_status(self, run_id):
         """
-        Get current status of a specific pipeline run.
+        Get current status of a specific pipeline run, as an ArmResult whose value
+        contains 'status': 'InProgress'|'Failed'|'Succeeded'.
         """
-        token = self._get_token()
-        url = (
-            f"https://management.azure.com/subscriptions/{ADF_SUBSCRIPTION_ID}/resourceGroups/"
-            f"{ADF_RESOURCE_GROUP}/providers/Microsoft.DataFactory/factories/"
-            f"{ADF_FACTORY_NAME}/pipelineruns/{run_id}?api-version=2018-06-01"
-        )
-        headers = {"Authorization": f"Bearer {token}"}
-        try:
-            res = requests.get(url, headers=headers)
-            res.raise_for_status()
-            return res.json()  # contains 'status': 'InProgress'|'Failed'|'Succeeded'
-        except Exception as e:
-            print(f"[ADFClient] Error checking run status for runId {run_id}: {e}")
-            if hasattr(e, 'response'):
-                print(f"Response content: {e.response.text}")
-            return None
+        result = self._request("GET", f"pipelineruns/{run_id}", "arm.get_run")
+        if not result.ok:
+            print(f"[ADFClient] Error checking run status for runId {run_id}: {result}")
+        return result
@@ -0,0 +1,289 @@
+# services/arm_requests.py
+"""
+Shared request engine for ARM (Azure Resource Manager) calls. Every request
+    - takes a token from a client-side token bucket per (subscription, reads|writes),
+      sized to ARM's own limits, so that many factories and worker threads do not
+      exhaust the subscription's quota together,
+    - is retried on throttling (429), transient server errors and network errors,
+      waiting for Retry-After when ARM sends one and a jittered exponential backoff
+      otherwise (writes are only retried on 429, which ARM never executed; a write that
+      hit a server or network error may have been executed and is reported as indeterminate),
+    - honours the x-ms-ratelimit-remaining-subscription-* headers by slowing down
+      before ARM starts throttling, and
+    - goes through a circuit breaker per endpoint class, which fails fast while ARM
+      keeps failing instead of queueing more doomed calls.
+The outcome is an ArmResult, so callers can tell "no runs" from "ARM unavailable".
+"""
+
+import random
+import threading
+import time
+import requests
+from config import ARM_READS_PER_SECOND, ARM_READ_BURST, ARM_WRITES_PER_SECOND, ARM_WRITE_BURST, \
+    ARM_MAX_RETRIES, ARM_RETRY_BASE_SECONDS, ARM_MAX_RETRY_WAIT_SECONDS, ARM_RATELIMIT_MIN_REMAINING, \
+    ARM_CIRCUIT_FAILURE_THRESHOLD, ARM_CIRCUIT_RESET_SECONDS, ARM_CONNECT_TIMEOUT_SECONDS, ARM_READ_TIMEOUT_SECONDS
+from services.metrics import metrics
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class ArmResult:
+    """
+    Outcome of an ARM request:
+        ok             the call succeeded; `value` holds the parsed response
+        unavailable    throttled, server/network error, no Azure AD token or circuit open - try again later
+        indeterminate  a write hit a server or network error: ARM may have executed it, so check
+                       before sending it again
+        failed         ARM rejected the request (4xx other than 429); retrying won't help
+    """
+    OK, UNAVAILABLE, INDETERMINATE, FAILED = "ok", "unavailable", "indeterminate", "failed"
+
+    def __init__(self, status, value=None, status_code=None, error=None):
+        self.status = status
+        self.value = value
+        self.status_code = status_code
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.status == self.OK
+
+    @property
+    def unavailable(self):
+        return self.status == self.UNAVAILABLE
+
+    @property
+    def indeterminate(self):
+        return self.status == self.INDETERMINATE
+
+    @property
+    def empty(self):
+        """True for a successful call that returned nothing (e.g. no failed runs)."""
+        return self.ok and not self.value
+
+    def __repr__(self):
+        if self.ok:
+            return repr(self.value)
+        code = f"HTTP {self.status_code}: " if self.status_code else ""
+        return f"<ARM {self.status}: {code}{self.error}>"
+
+
+class TokenBucket:
+    """Blocking token bucket: `rate` tokens per second, at most `capacity` saved up."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold every caller back for `seconds` (ARM said Retry-After for the whole subscription)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def limit(self, remaining):
+        """Never hold more tokens than ARM says are left in its own bucket."""
+        with self._lock:
+            self._tokens = min(self._tokens, float(remaining))
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures; while open, calls fail fast.
+    After `reset_seconds` one trial call is let through (half-open): success closes
+    the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=ARM_CIRCUIT_FAILURE_THRESHOLD, reset_seconds=ARM_CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def release(self):
+        """The call never reached ARM: free the half-open trial without judging ARM by it."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        """Returns True if this failure opened the circuit."""
+        with self._lock:
+            self.failures += 1
+            was_open = self.opened_at is not None
+            if was_open or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+            return not was_open and self.opened_at is not None
+
+
+class ArmRequestEngine:
+    """
+    Sends ARM requests for any number of AzureDataFactoryClients; share one instance
+    (like the session and credential) so limits apply across factories.
+    """
+
+    def __init__(self, session, credential, reads_per_second=ARM_READS_PER_SECOND, read_burst=ARM_READ_BURST,
+                 writes_per_second=ARM_WRITES_PER_SECOND, write_burst=ARM_WRITE_BURST, max_retries=ARM_MAX_RETRIES):
+        self.session = session
+        self.credential = credential
+        self.limits = {"read": (reads_per_second, read_burst), "write": (writes_per_second, write_burst)}
+        self.max_retries = max_retries
+        self._buckets = {}   # (subscription_id, "read"|"write") -> TokenBucket
+        self._breakers = {}  # endpoint class -> CircuitBreaker
+        self._lock = threading.Lock()
+
+    def _bucket(self, subscription_id, kind):
+        with self._lock:
+            bucket = self._buckets.get((subscription_id, kind))
+            if bucket is None:
+                bucket = self._buckets[(subscription_id, kind)] = TokenBucket(*self.limits[kind])
+            return bucket
+
+    def breaker(self, endpoint):
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = self._breakers[endpoint] = CircuitBreaker()
+            return breaker
+
+    def request(self, method, url, endpoint, subscription_id, write=False, **kwargs):
+        """
+        Send one ARM request. `endpoint` names the endpoint class (circuit breaker and
+        metrics stage, e.g. "arm.query_pipeline_runs"). Returns an ArmResult whose value
+        is the parsed JSON body.
+        """
+        kind = "write" if write else "read"
+        bucket = self._bucket(subscription_id, kind)
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            metrics.count("arm.circuit_rejected")
+            return ArmResult(ArmResult.UNAVAILABLE, error=f"circuit open for {endpoint}")
+
+        attempt, refreshed_token = 0, False
+        while True:
+            bucket.acquire()
+            started = time.perf_counter()
+            status_code, retry_after = None, None
+            try:
+                token = self.credential.get_token()
+            except Exception as e:
+                # Azure AD unavailable: nothing was sent, and ARM's breaker has nothing to learn from it
+                metrics.count("arm.token_errors")
+                breaker.release()
+                return ArmResult(ArmResult.UNAVAILABLE, error=f"no Azure AD token: {e}")
+            try:
+                res = self.session.request(method, url, headers={"Authorization": f"Bearer {token}"},
+                                           timeout=(ARM_CONNECT_TIMEOUT_SECONDS, ARM_READ_TIMEOUT_SECONDS),
+                                           **kwargs)
+                status_code = res.status_code
+                self._apply_rate_limit_headers(res, bucket, kind)
+                if res.ok:
+                    value = res.json() if res.content else {}
+                    metrics.observe(endpoint, time.perf_counter() - started)
+                    breaker.record_success()
+                    return ArmResult(ArmResult.OK, value, status_code)
+                error = _error_message(res)
+                retry_after = _retry_after_seconds(res)
+            except ValueError as e:
+                # ARM answered, but with a body that isn't JSON: nothing a retry would fix
+                metrics.observe(endpoint, time.perf_counter() - started, error=True)
+                breaker.record_success()
+                return ArmResult(ArmResult.FAILED, status_code=status_code, error=str(e))
+            except requests.RequestException as e:
+                # Connection refused or reset, timeouts, truncated responses
+                error = f"{type(e).__name__}: {e}"
+            metrics.observe(endpoint, time.perf_counter() - started, error=True)
+
+            if status_code == 401 and not refreshed_token:
+                # Token revoked or rotated early: fetch a new one and try once more
+                self.credential.invalidate()
+                refreshed_token = True
+                continue
+            if status_code is not None and status_code not in RETRYABLE_STATUS_CODES:
+                breaker.record_success()  # ARM is up; the request itself was rejected
+                return ArmResult(ArmResult.FAILED, status_code=status_code, error=error)
+
+            if status_code == 429:
+                metrics.count("arm.throttled")
+                if retry_after:
+                    bucket.pause(min(retry_after, ARM_MAX_RETRY_WAIT_SECONDS))
+            # A write that hit a server or network error may have been executed; don't repeat it
+            retryable = status_code == 429 or not write
+            if not retryable or attempt >= self.max_retries:
+                if breaker.record_failure():
+                    print(f"[ArmRequestEngine] Circuit for {endpoint} opened after {breaker.failures} "
+                          f"consecutive failures; failing fast for {breaker.reset_seconds}s.")
+                status = ArmResult.UNAVAILABLE if retryable else ArmResult.INDETERMINATE
+                return ArmResult(status, status_code=status_code, error=error)
+
+            attempt += 1
+            delay = retry_after if retry_after is not None else \
+                random.uniform(0, ARM_RETRY_BASE_SECONDS * 2 ** (attempt - 1))  # full jitter
+            delay = min(delay, ARM_MAX_RETRY_WAIT_SECONDS)
+            metrics.count("arm.retries")
+            print(f"[ArmRequestEngine] {endpoint} {status_code or 'network error'}: {error}. "
+                  f"Retry {attempt}/{self.max_retries} in {delay:.1f}s.")
+            time.sleep(delay)
+
+    @staticmethod
+    def _apply_rate_limit_headers(res, bucket, kind):
+        remaining = res.headers.get(f"x-ms-ratelimit-remaining-subscription-{kind}s")
+        if remaining is not None and remaining.isdigit() and int(remaining) <= ARM_RATELIMIT_MIN_REMAINING:
+            bucket.limit(max(0, int(remaining) - ARM_RATELIMIT_MIN_REMAINING // 2))
+
+
+def _retry_after_seconds(res):
+    value = res.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None  # HTTP-date form; fall back to backoff
+
+
+def _error_message(res):
+    try:
+        error = res.json().get("error", {})
+        return f"{error.get('code')}: {error.get('message')}" if isinstance(error, dict) else str(error)
+    except ValueError:
+        return res.text[:200] or res.reason
@@ -0,0 +1,85 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from config import ADF_TENANT_ID, ADF_CLIENT_ID, ADF_CLIENT_SECRET, \
+    AZURE_TOKEN_REFRESH_MARGIN_SECONDS, ARM_HTTP_POOL_SIZE, AZURE_AD_ENDPOINT, ARM_CONNECT_TIMEOUT_SECONDS, \
+    ARM_READ_TIMEOUT_SECONDS
+from services.metrics import metrics
+
+
+def create_pooled_session(pool_size=ARM_HTTP_POOL_SIZE):
+    """
+    Build a requests.Session that keeps TCP+TLS connections alive and reuses them
+    across calls, instead of opening a new connection for each bare requests.post.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class AzureTokenCredential:
+    """
+    Client-credentials token for the ARM API, cached until shortly before `expires_on`.
+    Concurrent callers that find the token stale wait on one refresh instead of each
+    making their own round trip to Azure AD.
+    """
+
+    def __init__(self, session=None, refresh_margin=AZURE_TOKEN_REFRESH_MARGIN_SECONDS,
+                 resource="https://management.azure.com/"):
+        self.session = session or create_pooled_session()
+        self.refresh_margin = refresh_margin
+        self.resource = resource
+        self._token = None
+        self._expires_on = 0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self):
+        return self._token is not None and time.time() < self._expires_on - self.refresh_margin
+
+    def get_token(self):
+        """Return a valid Bearer token, fetching a new one only when the cached one is about to expire."""
+        if self._is_fresh():
+            return self._token
+        with self._lock:
+            # Another caller may have refreshed while we waited for the lock
+            if self._is_fresh():
+                return self._token
+            self._refresh()
+            return self._token
+
+    def invalidate(self):
+        """Drop the cached token, e.g. after ARM rejected it with a 401."""
+        with self._lock:
+            self._token = None
+            self._expires_on = 0
+
+    def _refresh(self):
+        print("[ADFClient] Fetching Azure AD token...")
+        url = f"{AZURE_AD_ENDPOINT}/{ADF_TENANT_ID}/oauth2/token"
+        payload = {
+            'grant_type': 'client_credentials',
+            'client_id': ADF_CLIENT_ID,
+            'client_secret': ADF_CLIENT_SECRET,
+            'resource': self.resource
+        }
+        try:
+            with metrics.timer("aad.token"):
+                res = self.session.post(url, data=payload,
+                                        timeout=(ARM_CONNECT_TIMEOUT_SECONDS, ARM_READ_TIMEOUT_SECONDS))
+                res.raise_for_status()
+                body = res.json()
+        except Exception as e:
+            print(f"[ADFClient] Failed to obtain token: {e}")
+            raise  # re-raise since token is required
+
+        # v1 endpoint returns `expires_on` as epoch seconds; fall back to `expires_in`
+        if body.get("expires_on"):
+            expires_on = float(body["expires_on"])
+        else:
+            expires_on = time.time() + float(body.get("expires_in", 3600))
+        self._token = body["access_token"]
+        self._expires_on = expires_on
+        print(f"[ADFClient] Token received (valid for {int(expires_on - time.time())}s).")
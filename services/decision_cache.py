@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import OrderedDict
+from services.metrics import metrics
+from config import DECISION_CACHE_MAX_ENTRIES, DECISION_CACHE_MEMORY_TTL_SECONDS, DECISION_CACHE_TTL_SECONDS
+
+
+class DecisionCache:
+    """
+    Retry decisions from GPT keyed by error signature (see services/error_signature.py).
+    Lookups go to an in-memory LRU first and then to the `gpt_decision_cache` table, so
+    decisions survive restarts and are shared by every worker using the same DB.
+    """
+
+    def __init__(self, db_manager, max_entries=DECISION_CACHE_MAX_ENTRIES,
+                 memory_ttl_seconds=DECISION_CACHE_MEMORY_TTL_SECONDS, ttl_seconds=DECISION_CACHE_TTL_SECONDS):
+        self.db = db_manager
+        self.max_entries = max_entries
+        self.memory_ttl_seconds = memory_ttl_seconds
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # signature -> (stored_at, decision)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def get(self, signature):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(signature)
+            if entry and now - entry[0] <= self.memory_ttl_seconds:
+                self._entries.move_to_end(signature)
+                self.memory_hits += 1
+                metrics.cache("decision", hits=1)
+                return dict(entry[1])
+            if entry:
+                del self._entries[signature]
+
+        decision = self.db.get_cached_decision(signature, max_age_seconds=self.ttl_seconds)
+        metrics.cache("decision", hits=decision is not None, misses=decision is None)
+        with self._lock:
+            if decision is None:
+                self.misses += 1
+                return None
+            self.db_hits += 1
+            self._remember(signature, decision, now)
+        return dict(decision)
+
+    def put(self, signature, decision):
+        with self._lock:
+            self._remember(signature, decision, time.time())
+        self.db.put_cached_decision(signature, decision["action"], decision["rationale"])
+
+    def _remember(self, signature, decision, stored_at):
+        self._entries[signature] = (stored_at, dict(decision))
+        self._entries.move_to_end(signature)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.memory_hits + self.db_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.memory_hits + self.db_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,32 @@
+import hashlib
+import re
+
+# Volatile parts of ADF error messages that differ between otherwise identical failures
+_VOLATILE_PATTERNS = [
+    (re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.I), "<guid>"),
+    (re.compile(r"\d{4}-\d{2}-\d{2}[t ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(z|[+-]\d{2}:?\d{2})?", re.I), "<ts>"),
+    (re.compile(r"\d{1,2}/\d{1,2}/\d{2,4}( \d{1,2}:\d{2}(:\d{2})?( ?[ap]m)?)?", re.I), "<ts>"),
+    (re.compile(r"\b\d{2}:\d{2}:\d{2}(\.\d+)?\b"), "<ts>"),
+    (re.compile(r"\b[a-z][a-z0-9+.-]*://\S+", re.I), "<url>"),
+    (re.compile(r"(?<![\w])(?:[a-z]:)?(?:[\\/][^\s\\/'\",;]+){2,}[\\/]?", re.I), "<path>"),
+    (re.compile(r"\b[0-9a-f]{16,}\b", re.I), "<hex>"),
+    (re.compile(r"\b\d{5,}\b"), "<n>"),
+]
+
+
+def normalize_error_message(error_message):
+    """
+    Lower-case the message and replace GUIDs/run IDs, timestamps, URLs, paths and long
+    numbers with placeholders, so repeats of the same failure normalize to the same text.
+    Short numbers such as ADF error codes (e.g. 2200) are kept.
+    """
+    text = (error_message or "").lower()
+    for pattern, placeholder in _VOLATILE_PATTERNS:
+        text = pattern.sub(placeholder, text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def error_signature(pipeline_name, error_message, activity=None):
+    """Stable key for "the same failure": pipeline, failed activity and normalized error text."""
+    raw = f"{pipeline_name}|{activity or ''}|{normalize_error_message(error_message)}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
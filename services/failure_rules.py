@@ -0,0 +1,85 @@
+import re
+import threading
+import time
+from collections import Counter
+from config import FAILURE_RULES
+from services.metrics import metrics
+
+RULE_ACTIONS = ("full", "partial", "none")
+
+
+class FailureRuleClassifier:
+    """
+    Decides the retry action for failures with a well-known cause (throttling, timeouts,
+    bad credentials, missing objects, ...) from the FAILURE_RULES table, without an LLM
+    call. Each rule's codes and patterns are compiled into a single regex at startup.
+    classify() returns None when no rule matches, and the failure goes to GPT.
+    """
+
+    def __init__(self, rules=FAILURE_RULES):
+        self.rules = []
+        for rule in rules:
+            if rule.get("action") not in RULE_ACTIONS:
+                raise ValueError(f"Failure rule '{rule.get('name')}' has invalid action {rule.get('action')!r}")
+            terms = [rf"\b{re.escape(code)}\b" for code in rule.get("error_codes", [])]
+            terms += rule.get("patterns", [])
+            self.rules.append({
+                "name": rule["name"],
+                "action": rule["action"],
+                "regex": re.compile("|".join(f"(?:{t})" for t in terms), re.IGNORECASE) if terms else None,
+                "failure_types": {t.lower() for t in rule.get("failure_types", [])},
+            })
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = 0
+
+    def classify(self, error_message, failure_type=None, record=True):
+        """
+        {"action", "rationale", "rule"} from the first matching rule, or None. With
+        record=False the hit or miss isn't counted; the caller counts it with record()
+        once the failure is decided (so a failure classified twice counts once).
+        """
+        started = time.perf_counter()
+        message = error_message or ""
+        for rule in self.rules:
+            if rule["failure_types"] and (failure_type or "").lower() not in rule["failure_types"]:
+                continue
+            match = rule["regex"].search(message) if rule["regex"] else None
+            if rule["regex"] and not match:
+                continue
+            elapsed = time.perf_counter() - started
+            metrics.observe("rules.classify", elapsed)
+            matched = f"'{match.group(0)}'" if match else f"failure type {failure_type}"
+            result = {
+                "action": rule["action"],
+                "rationale": f"{rule['action']} - matched local failure rule '{rule['name']}' on {matched}.",
+                "rule": rule["name"],
+                "elapsed_us": elapsed * 1e6,
+            }
+            if record:
+                self.record(result)
+            return result
+        metrics.observe("rules.classify", time.perf_counter() - started)
+        if record:
+            self.record(None)
+        return None
+
+    def record(self, result):
+        """Count the outcome of classify() for one failure: a rule hit, or a miss (None) sent to GPT."""
+        with self._lock:
+            if result:
+                self.hits[result["rule"]] += 1
+            else:
+                self.misses += 1
+        metrics.count(f"rules.matched.{result['rule']}" if result else "rules.unmatched")
+
+    def stats(self):
+        with self._lock:
+            matched = sum(self.hits.values())
+            total = matched + self.misses
+            return {
+                "rule_hits": dict(self.hits),
+                "matched": matched,
+                "sent_to_gpt": self.misses,
+                "match_ratio": matched / total if total else 0.0,
+            }
@@ -0,0 +1,269 @@
+# services/metrics.py
+"""
+Hot-path instrumentation: latency histograms, call and error counts per stage (Azure AD
+token, ARM queries, GPT, embeddings, FAISS/BM25 search, SQLite commits, notification
+sends), cache hit ratios and event counts. Everything is kept in-process and exposed
+    - in Prometheus text format on a local HTTP endpoint (GET /metrics), and
+    - as one structured JSON line per poll cycle ("[Metrics] {...}"), with what that
+      factory did since its previous line (work done inside metrics.scope(factory_name)).
+
+    from services.metrics import metrics
+    with metrics.timer("arm.query_pipeline_runs"):
+        ...
+    metrics.cache("decision", hits=1)
+
+With METRICS_ENABLED=false every call returns immediately.
+"""
+
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import METRICS_ENABLED, METRICS_HTTP_HOST, METRICS_HTTP_PORT
+
+# Histogram bucket upper bounds in seconds: SQLite commits sit at the bottom, GPT at the top
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PREFIX = "adf_monitor"
+
+
+class _Stage:
+    __slots__ = ("buckets", "count", "total", "errors", "max")
+
+    def __init__(self, bucket_count):
+        self.buckets = [0] * (bucket_count + 1)  # last slot is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.max = 0.0
+
+
+class _Timer:
+    __slots__ = ("registry", "stage", "started")
+
+    def __init__(self, registry, stage):
+        self.registry = registry
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.stage, time.perf_counter() - self.started, error=exc_type is not None)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+class Metrics:
+    def __init__(self, enabled=METRICS_ENABLED, buckets=LATENCY_BUCKETS):
+        self.enabled = enabled
+        self.bucket_bounds = tuple(buckets)
+        self._stages = {}   # stage -> _Stage
+        self._caches = {}   # cache name -> [hits, misses]
+        self._counts = {}   # event name -> count
+        self._lock = threading.Lock()
+        # Per factory, for its cycle lines: totals when its open scope began, and the
+        # activity of its finished scopes not logged yet (see scope() and log_cycle())
+        self._scope_start = {}
+        self._scope_depth = {}
+        self._unlogged = {}
+
+    def timer(self, stage):
+        """Context manager timing one call of `stage`; an exception counts as an error."""
+        if not self.enabled:
+            return _NOOP_TIMER
+        return _Timer(self, stage)
+
+    def observe(self, stage, seconds, error=False):
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = _Stage(len(self.bucket_bounds))
+            entry.buckets[bisect.bisect_left(self.bucket_bounds, seconds)] += 1
+            entry.count += 1
+            entry.total += seconds
+            entry.max = max(entry.max, seconds)
+            if error:
+                entry.errors += 1
+
+    def cache(self, name, hits=0, misses=0):
+        """Record lookups of an in-process or SQLite cache."""
+        if not self.enabled or not (hits or misses):
+            return
+        with self._lock:
+            entry = self._caches.setdefault(name, [0, 0])
+            entry[0] += hits
+            entry[1] += misses
+
+    def count(self, event, value=1):
+        """Count an event (e.g. runs seen, rules matched)."""
+        if not self.enabled or not value:
+            return
+        with self._lock:
+            self._counts[event] = self._counts.get(event, 0) + value
+
+    def snapshot(self):
+        """Current totals: {"stages": {...}, "caches": {...}, "counts": {...}}."""
+        with self._lock:
+            stages = {
+                name: {"count": s.count, "errors": s.errors, "total_ms": round(s.total * 1000, 3),
+                       "max_ms": round(s.max * 1000, 3)}
+                for name, s in self._stages.items()
+            }
+            caches = {name: {"hits": h, "misses": m, "hit_ratio": round(h / (h + m), 4) if h + m else 0.0}
+                      for name, (h, m) in self._caches.items()}
+            return {"stages": stages, "caches": caches, "counts": dict(self._counts)}
+
+    def _totals(self):
+        """(stages, caches, counts) totals, each value a tuple; call with the lock held."""
+        return ({name: (s.count, s.total, s.errors) for name, s in self._stages.items()},
+                {name: tuple(v) for name, v in self._caches.items()},
+                {name: (v,) for name, v in self._counts.items()})
+
+    @contextmanager
+    def scope(self, factory_name):
+        """
+        Book what is recorded inside to `factory_name`'s next cycle line. The factories of a
+        process take turns, so the line of one never shows another's work. Scopes nest.
+        """
+        if not self.enabled:
+            yield
+            return
+        with self._lock:
+            depth = self._scope_depth.get(factory_name, 0)
+            self._scope_depth[factory_name] = depth + 1
+            if depth == 0:
+                self._scope_start[factory_name] = self._totals()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._scope_depth[factory_name] -= 1
+                if self._scope_depth[factory_name] == 0:
+                    self._book(factory_name, self._scope_start.pop(factory_name))
+
+    def _book(self, factory_name, start):
+        """Add the activity since `start` (totals) to the factory's unlogged activity; lock held."""
+        unlogged = self._unlogged.setdefault(factory_name, ({}, {}, {}))
+        for now, before, booked in zip(self._totals(), start, unlogged):
+            for name, value in now.items():
+                delta = _subtract(value, before.get(name))
+                if any(delta):
+                    booked[name] = _add(booked.get(name), delta)
+
+    def log_cycle(self, factory_name, duration_seconds, **fields):
+        """Print one JSON line with what the factory did since its previous cycle line."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if factory_name in self._scope_start:
+                self._book(factory_name, self._scope_start[factory_name])
+                self._scope_start[factory_name] = self._totals()
+            stages, caches, counts = self._unlogged.pop(factory_name, ({}, {}, {}))
+
+        line = {"event": "poll_cycle", "factory": factory_name, "duration_ms": round(duration_seconds * 1000, 1)}
+        line.update(fields)
+        line["stages"] = {name: {"calls": calls, "total_ms": round(total * 1000, 1),
+                                 "avg_ms": round(total * 1000 / calls, 2), "errors": errors}
+                          for name, (calls, total, errors) in sorted(stages.items()) if calls}
+        line["caches"] = {name: {"lookups": hits + misses, "hit_ratio": round(hits / (hits + misses), 3)}
+                          for name, (hits, misses) in sorted(caches.items()) if hits + misses}
+        line["counts"] = {name: value for name, (value,) in sorted(counts.items())}
+        print(f"[Metrics] {json.dumps(line)}")
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            stages = sorted((name, s.buckets[:], s.count, s.total, s.errors) for name, s in self._stages.items())
+            caches = sorted((name, h, m) for name, (h, m) in self._caches.items())
+            counts = sorted(self._counts.items())
+
+        lines = [f"# HELP {PREFIX}_stage_seconds Latency of monitor stages.",
+                 f"# TYPE {PREFIX}_stage_seconds histogram"]
+        for name, buckets, count, total, _ in stages:
+            cumulative = 0
+            for bound, n in zip(self.bucket_bounds + (float("inf"),), buckets):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{name}"}} {count}')
+        lines += [f"# HELP {PREFIX}_stage_errors_total Stage calls that raised.",
+                  f"# TYPE {PREFIX}_stage_errors_total counter"]
+        lines += [f'{PREFIX}_stage_errors_total{{stage="{name}"}} {errors}' for name, _, _, _, errors in stages]
+        lines += [f"# HELP {PREFIX}_cache_lookups_total Cache lookups by result.",
+                  f"# TYPE {PREFIX}_cache_lookups_total counter"]
+        for name, hits, misses in caches:
+            lines.append(f'{PREFIX}_cache_lookups_total{{cache="{name}",result="hit"}} {hits}')
+            lines.append(f'{PREFIX}_cache_lookups_total{{cache="{name}",result="miss"}} {misses}')
+        lines += [f"# HELP {PREFIX}_cache_hit_ratio Share of cache lookups that hit.",
+                  f"# TYPE {PREFIX}_cache_hit_ratio gauge"]
+        lines += [f'{PREFIX}_cache_hit_ratio{{cache="{name}"}} {hits / (hits + misses):.4f}'
+                  for name, hits, misses in caches if hits + misses]
+        lines += [f"# HELP {PREFIX}_events_total Monitor events.",
+                  f"# TYPE {PREFIX}_events_total counter"]
+        lines += [f'{PREFIX}_events_total{{event="{name}"}} {value}' for name, value in counts]
+        return "\n".join(lines) + "\n"
+
+
+def _subtract(value, before):
+    return tuple(v - b for v, b in zip(value, before or (0,) * len(value)))
+
+
+def _add(booked, delta):
+    return tuple(b + d for b, d in zip(booked or (0,) * len(delta), delta))
+
+
+# One registry per process, shared by every client and agent
+metrics = Metrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/metrics":
+            body, content_type = metrics.render_prometheus(), "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/metrics.json":
+            body, content_type = json.dumps(metrics.snapshot()), "application/json"
+        else:
+            self.send_error(404)
+            return
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scraped every few seconds; not worth a log line each time
+
+
+def start_metrics_server(host=METRICS_HTTP_HOST, port=METRICS_HTTP_PORT):
+    """Serve /metrics (and /metrics.json) from a daemon thread. Returns the server, or None if disabled."""
+    if not metrics.enabled or not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"[Metrics] Could not listen on {host}:{port} ({e}); metrics are still logged per cycle.")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"[Metrics] Serving http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,179 @@
+import smtplib
+import threading
+import time
+import uuid
+from email.message import EmailMessage
+from config import SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, SMTP_SENDER, \
+    NOTIFICATION_DIGEST_WINDOW_SECONDS, NOTIFICATION_DIGEST_MAX_MESSAGES, \
+    NOTIFICATION_RETRY_BASE_SECONDS, NOTIFICATION_RETRY_MAX_SECONDS
+from services.azure_credentials import create_pooled_session
+from services.metrics import metrics
+
+# A claimed batch not finished within this time is handed to another sender
+CLAIM_SECONDS = 300
+
+
+class SmtpChannel:
+    """Sends email over one SMTP connection, kept open between sends and reopened when dropped."""
+
+    def __init__(self, server=SMTP_SERVER, port=SMTP_PORT, username=SMTP_USERNAME, password=SMTP_PASSWORD,
+                 sender=SMTP_SENDER):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender
+        self._smtp = None
+
+    def _connect(self):
+        if self.port == 465:
+            smtp = smtplib.SMTP_SSL(self.server, self.port, timeout=30)
+        else:
+            smtp = smtplib.SMTP(self.server, self.port, timeout=30)
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        return smtp
+
+    def _connection(self):
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except smtplib.SMTPException:
+                pass
+            self.close()
+        self._smtp = self._connect()
+        return self._smtp
+
+    def send(self, recipient, subject, body):
+        msg = EmailMessage()
+        msg["From"] = self.sender
+        msg["To"] = recipient
+        msg["Subject"] = subject
+        msg.set_content(body)
+        try:
+            self._connection().send_message(msg)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # Connection went stale between the check and the send; retry once on a fresh one
+            self.close()
+            self._connection().send_message(msg)
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+
+class WebhookChannel:
+    """POSTs {"subject", "text"} JSON to the recipient URL (Teams/Slack-style incoming webhook)."""
+
+    def __init__(self, session=None):
+        self.session = session or create_pooled_session(pool_size=2)
+
+    def send(self, recipient, subject, body):
+        response = self.session.post(recipient, json={"subject": subject, "text": f"{subject}\n\n{body}"},
+                                     timeout=30)
+        response.raise_for_status()
+
+
+def build_digest(messages):
+    """One (subject, body) for several queued messages to the same recipient."""
+    if len(messages) == 1:
+        return messages[0]["subject"], messages[0]["body"]
+    subject = f"ADF Pipeline Failures — {len(messages)} notifications"
+    body = "\n\n==========\n\n".join(f"SUBJECT: {m['subject']}\n\n{m['body']}" for m in messages)
+    return subject, body
+
+
+class NotificationDispatcher:
+    """
+    Background sender for the `notification_outbox` table. Enqueueing only writes a row;
+    a single worker thread claims due messages, coalesces each recipient's messages into
+    a digest, sends it over a reused connection and deletes the rows. Failed sends stay in
+    the outbox with exponential backoff, so nothing is lost across restarts.
+    """
+
+    def __init__(self, db_manager, channels, digest_window=NOTIFICATION_DIGEST_WINDOW_SECONDS,
+                 digest_max_messages=NOTIFICATION_DIGEST_MAX_MESSAGES,
+                 retry_base=NOTIFICATION_RETRY_BASE_SECONDS, retry_max=NOTIFICATION_RETRY_MAX_SECONDS):
+        self.db = db_manager
+        self.channels = channels  # channel name -> channel object with send(recipient, subject, body)
+        self.digest_window = digest_window
+        self.digest_max_messages = max(1, digest_max_messages)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.sent_messages = 0
+        self.sent_digests = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="notification-dispatcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        for channel in self.channels.values():
+            if hasattr(channel, "close"):
+                channel.close()
+
+    def enqueue(self, messages):
+        """Queue (channel, recipient, subject, body) tuples; returns immediately."""
+        self.db.enqueue_notifications(messages, time.time() + self.digest_window)
+        self.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.deliver_due()
+            except Exception as e:
+                print(f"[NotificationDispatcher] ERROR delivering notifications: {e}")
+            next_due = self.db.next_notification_due()
+            delay = 60 if next_due is None else min(60, max(1.0, next_due - time.time()))
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+    def deliver_due(self):
+        """Send everything that is due now. Returns the number of sends made."""
+        rows = self.db.claim_due_notifications(uuid.uuid4().hex, CLAIM_SECONDS)
+        groups = {}
+        for row in rows:
+            groups.setdefault((row["channel"], row["recipient"]), []).append(row)
+
+        sends = 0
+        for (channel_name, recipient), messages in groups.items():
+            channel = self.channels.get(channel_name)
+            for start in range(0, len(messages), self.digest_max_messages):
+                batch = messages[start:start + self.digest_max_messages]
+                ids = [m["id"] for m in batch]
+                try:
+                    if channel is None:
+                        raise RuntimeError(f"channel '{channel_name}' is not configured")
+                    subject, body = build_digest(batch)
+                    with metrics.timer(f"notify.{channel_name}"):
+                        channel.send(recipient, subject, body)
+                except Exception as e:
+                    attempts = max(m["attempts"] for m in batch) + 1
+                    delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+                    self.db.reschedule_notifications(ids, time.time() + delay, str(e))
+                    print(f"[NotificationDispatcher] Sending {len(batch)} message(s) to {recipient} via {channel_name} "
+                          f"failed (attempt {attempts}): {e}. Retrying in {delay}s.")
+                    continue
+                self.db.delete_notifications(ids)
+                sends += 1
+                self.sent_digests += 1
+                self.sent_messages += len(batch)
+                metrics.count("notifications.sent", len(batch))
+                if len(batch) > 1:
+                    print(f"[NotificationDispatcher] Sent digest of {len(batch)} messages to {recipient} via {channel_name}.")
+        return sends
@@ -1,11 +1,79 @@
+import json
+import re
 import openai
-from config import OPENAI_API_KEY
+from config import OPENAI_API_KEY, OPENAI_BATCH_MODEL, OPENAI_BATCH_MAX_ITEMS
+from services.error_signature import error_signature
+from services.metrics import metrics
+
+ACTIONS = ("full", "partial", "none")
+
+# Structured-output schema for batch classification: one decision per failure id
+BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "retry_decisions",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "decisions": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "action": {"type": "string", "enum": list(ACTIONS)},
+                            "rationale": {"type": "string"}
+                        },
+                        "required": ["id", "action", "rationale"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["decisions"],
+            "additionalProperties": False
+        }
+    }
+}
+
+
+def parse_action(reply):
+    """
+    Read the action from a free-text reply. The prompt asks for the action as the first
+    word, so that is trusted first; a bare substring search would turn a rationale like
+    "a full rerun won't help, none" into 'full'.
+    """
+    match = re.match(r"^\W*(full|partial|none)\b", reply)
+    if match:
+        return match.group(1)
+    for action in ACTIONS:
+        if re.search(rf"\b{action}\b", reply):
+            return action
+    return "none"
+
 
 class OpenAIClient:
-    def __init__(self):
+    def __init__(self, decision_cache=None):
         openai.api_key = OPENAI_API_KEY
+        # Optional DecisionCache: repeat failures skip the GPT call entirely
+        self.decision_cache = decision_cache
 
     def ask_gpt(self, pipeline_name, activity, error_message):
+        if self.decision_cache is None:
+            return self._ask_gpt(pipeline_name, activity, error_message)
+
+        signature = error_signature(pipeline_name, error_message, activity)
+        cached = self.decision_cache.get(signature)
+        if cached is not None:
+            print(f"[OpenAIClient] Decision cache hit for pipeline '{pipeline_name}' ({signature[:12]}).")
+            return cached
+
+        result = self._ask_gpt(pipeline_name, activity, error_message)
+        if not result.get("error"):
+            self.decision_cache.put(signature, result)
+        return result
+
+    def _ask_gpt(self, pipeline_name, activity, error_message):
         prompt = (f"Pipeline: {pipeline_name}\n"
                 f"Failed Activity: {activity}\n"
                 f"Error: {error_message}\n\n"
@@ -13,24 +81,86 @@ class OpenAIClient:
                 "Reply with one word: 'full', 'partial', or 'none', then a rationale.")
         print(f"[OpenAIClient] Sending prompt to GPT-4 for pipeline '{pipeline_name}'...")
         try:
-            response = openai.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=100
-            )
+            with metrics.timer("gpt.chat"):
+                response = openai.chat.completions.create(
+                    model="gpt-4",
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=100
+                )
             reply = response.choices[0].message.content.strip().lower()
             print(f"[OpenAIClient] GPT-4 replied: {reply}")
-            action = "none"
-            if "full" in reply:
-                action = "full"
-            elif "partial" in reply:
-                action = "partial"
-            elif "none" in reply:
-                action = "none"
-            return {"action": action, "rationale": reply}
+            return {"action": parse_action(reply), "rationale": reply}
         except Exception as e:
             print(f"[OpenAIClient] Error calling GPT-4: {e}")
-            return {"action": "none", "rationale": "Error calling GPT-4"}
+            return {"action": "none", "rationale": "Error calling GPT-4", "error": True}
+
+
+    def ask_gpt_batch(self, failures):
+        """
+        Classify many failures with as few GPT requests as possible.
+        `failures` is a list of dicts with pipeline_name, activity and error_message;
+        returns one {"action", "rationale"} per failure, in the same order.
+        Cached decisions are reused, the rest go out in structured-output requests of up
+        to OPENAI_BATCH_MAX_ITEMS, and anything the batch reply doesn't cover falls back
+        to a single ask_gpt call.
+        """
+        results = [None] * len(failures)
+        signatures = [error_signature(f["pipeline_name"], f["error_message"], f.get("activity"))
+                      for f in failures]
+
+        pending = []
+        for i, signature in enumerate(signatures):
+            cached = self.decision_cache.get(signature) if self.decision_cache else None
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.append(i)
+
+        for start in range(0, len(pending), OPENAI_BATCH_MAX_ITEMS):
+            chunk = pending[start:start + OPENAI_BATCH_MAX_ITEMS]
+            for i, decision in self._classify_chunk([failures[i] for i in chunk], chunk).items():
+                results[i] = decision
+                if self.decision_cache:
+                    self.decision_cache.put(signatures[i], decision)
+
+        for i, result in enumerate(results):
+            if result is None:
+                f = failures[i]
+                results[i] = self.ask_gpt(f["pipeline_name"], f.get("activity"), f["error_message"])
+        return results
+
+    def _classify_chunk(self, failures, ids):
+        """One structured request for a chunk of failures. Returns {id: decision} for parsed items."""
+        listing = "\n\n".join(
+            f"[{i}] Pipeline: {f['pipeline_name']}\n"
+            f"Failed Activity: {f.get('activity')}\n"
+            f"Error: {f['error_message']}"
+            for i, f in zip(ids, failures)
+        )
+        prompt = ("For each Azure Data Factory failure below, decide whether we should retry the full "
+                  "pipeline ('full'), just the failed activity ('partial'), or not retry ('none'), "
+                  "and give a short rationale. Return one decision per failure id.\n\n" + listing)
+        print(f"[OpenAIClient] Sending batch of {len(failures)} failure(s) to {OPENAI_BATCH_MODEL}...")
+        try:
+            with metrics.timer("gpt.batch"):
+                response = openai.chat.completions.create(
+                    model=OPENAI_BATCH_MODEL,
+                    messages=[{"role": "user", "content": prompt}],
+                    response_format=BATCH_RESPONSE_FORMAT,
+                    max_tokens=150 * len(failures)
+                )
+            decisions = json.loads(response.choices[0].message.content)["decisions"]
+        except Exception as e:
+            print(f"[OpenAIClient] Batch classification failed, falling back to single requests: {e}")
+            return {}
 
+        parsed = {}
+        for d in decisions:
+            if not isinstance(d, dict) or d.get("id") not in ids or d.get("action") not in ACTIONS:
+                continue
+            parsed[d["id"]] = {"action": d["action"], "rationale": str(d.get("rationale", "")).strip()}
+        if len(parsed) < len(ids):
+            print(f"[OpenAIClient] {len(ids) - len(parsed)} batch item(s) unparsed; retrying them singly.")
+        return parsed
@@ -0,0 +1,24 @@
+import os
+
+
+def rss_mb():
+    """Current resident set size of this process in MB (None where it can't be read)."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is bytes on macOS, KB elsewhere; it is the peak, the best we have here
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except (ImportError, OSError):
+        return None
+
+
+def format_rss():
+    value = rss_mb()
+    return f"{value:.1f} MB" if value is not None else "n/a"
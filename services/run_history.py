@@ -0,0 +1,331 @@
+# services/run_history.py
+"""
+Append-only run-history archive. Each failure, rerun, retry outcome, escalation and
+recovery becomes one row of HISTORY_COLUMNS in a CSV file per UTC day:
+
+    run_history/2026-10-18.csv        today's events, appended as they are flushed
+    run_history/2026-09.csv.gz        compacted month: sorted by pipeline and time, gzipped
+
+The files have one fixed header and flat typed columns, so pandas, DuckDB or a Parquet
+converter read them directly. Older day files are compacted into their month and whole
+partitions are deleted after HISTORY_RETENTION_DAYS. Every recorded event also updates
+daily rollups in pipeline_monitor.db (run_history_daily, run_history_signature_daily),
+which answer the trend queries without reading the archive:
+
+    python -m services.run_history report --days 30
+    python -m services.run_history maintain
+"""
+
+import argparse
+import csv
+import datetime
+import gzip
+import io
+import os
+import re
+import socket
+import threading
+import time
+from collections import defaultdict
+from config import HISTORY_ENABLED, HISTORY_DIR, HISTORY_COMPACT_AFTER_DAYS, HISTORY_RETENTION_DAYS, \
+    HISTORY_ROLLUP_RETENTION_DAYS, HISTORY_MAINTENANCE_INTERVAL_SECONDS
+from services.error_signature import error_signature, normalize_error_message
+from services.metrics import metrics
+
+HISTORY_COLUMNS = ("time", "event", "factory_name", "pipeline_name", "run_id", "attempt_run_id", "action",
+                   "activity", "error_code", "failure_type", "signature", "duration_seconds", "message")
+MAX_MESSAGE_CHARS = 1000
+
+_DAY_FILE = re.compile(r"^(\d{4}-\d{2}-\d{2})\.csv$")
+_MONTH_FILE = re.compile(r"^(\d{4}-\d{2})\.csv\.gz$")
+_ADF_TIME = re.compile(r"^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(\.\d+)?")
+
+
+def parse_adf_time(value):
+    """Epoch seconds of an ADF timestamp ('2026-10-18T07:17:10.1234567Z', always UTC), or None."""
+    match = _ADF_TIME.match(value or "")
+    if not match:
+        return None
+    parsed = datetime.datetime.strptime(match.group(1), "%Y-%m-%dT%H:%M:%S").replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp() + float(match.group(2) or 0)
+
+
+def run_duration(run):
+    """Seconds from runStart to runEnd of an ADF run dict, or None if either is missing."""
+    start, end = parse_adf_time(run.get('runStart')), parse_adf_time(run.get('runEnd'))
+    return end - start if start is not None and end is not None else None
+
+
+def _day(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+class RunHistory:
+    """
+    Events: failed, rerun, retry_succeeded, retry_failed, escalated, recovered.
+    Buffers them in memory; flush() appends them to today's partition and
+    adds them to the rollups (RetryStateMachine flushes it with the retry state).
+    Share one instance between the factories of a process.
+    """
+
+    def __init__(self, db_manager, directory=HISTORY_DIR, enabled=HISTORY_ENABLED):
+        self.db = db_manager
+        self.directory = directory
+        self.enabled = enabled
+        self._rows = []
+        self._daily = defaultdict(lambda: defaultdict(float))
+        self._signatures = {}
+        self._lock = threading.Lock()
+        self._next_maintenance = 0.0
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    # --- Recording ---
+
+    def record(self, event, factory_name, pipeline_name, run_id, attempt_run_id=None, action=None,
+               activity=None, error_code=None, failure_type=None, message=None, duration_seconds=None):
+        if not self.enabled:
+            return
+        now = time.time()
+        signature = error_signature(pipeline_name, message, activity) \
+            if event in ("failed", "retry_failed") else None
+        row = {
+            "time": datetime.datetime.fromtimestamp(now, datetime.timezone.utc).isoformat(timespec="seconds"),
+            "event": event, "factory_name": factory_name, "pipeline_name": pipeline_name, "run_id": run_id,
+            "attempt_run_id": attempt_run_id, "action": action, "activity": activity, "error_code": error_code,
+            "failure_type": failure_type, "signature": signature,
+            "duration_seconds": round(duration_seconds, 3) if duration_seconds is not None else None,
+            "message": (message or "")[:MAX_MESSAGE_CHARS] or None,
+        }
+        with self._lock:
+            self._rows.append(row)
+            counters = self._daily[(_day(now), factory_name, pipeline_name)]
+            if event == "failed":
+                counters["failures"] += 1
+            elif event == "rerun":
+                counters["retries"] += 1
+            elif event in ("retry_succeeded", "retry_failed"):
+                counters["retries_succeeded" if event == "retry_succeeded" else "retries_failed"] += 1
+                counters["retry_seconds"] += duration_seconds or 0
+            elif event == "escalated":
+                counters["escalations"] += 1
+            elif event == "recovered" and duration_seconds is not None:
+                counters["recoveries"] += 1
+                counters["recovery_seconds"] += duration_seconds
+            if signature:
+                key = (_day(now), factory_name, pipeline_name, signature)
+                count, example = self._signatures.get(key, (0, None))
+                self._signatures[key] = (count + 1, example or normalize_error_message(message)[:300])
+
+    def record_failure(self, factory_name, run):
+        """A newly detected failed run (with 'failedActivity' attached when known)."""
+        activity = run.get('failedActivity') or {}
+        self.record("failed", factory_name, run['pipelineName'], run['runId'],
+                    activity=activity.get('activityName'), error_code=activity.get('errorCode'),
+                    failure_type=activity.get('failureType'),
+                    message=activity.get('message') or run.get('message'),
+                    duration_seconds=run_duration(run))
+
+    def count_succeeded(self, factory_name, runs):
+        """Count succeeded runs (denominator of the failure rate); nothing is archived for them."""
+        if not self.enabled or not runs:
+            return
+        day = _day(time.time())
+        with self._lock:
+            for run in runs:
+                self._daily[(day, factory_name, run['pipelineName'])]["runs_succeeded"] += 1
+
+    def flush(self):
+        """Append buffered events to today's partition and add them to the rollups."""
+        with self._lock:
+            rows, daily, signatures = self._rows, self._daily, self._signatures
+            self._rows, self._daily, self._signatures = [], defaultdict(lambda: defaultdict(float)), {}
+        if not rows and not daily:
+            return
+        with metrics.timer("history.flush"):
+            by_day = defaultdict(list)
+            for row in rows:
+                by_day[row["time"][:10]].append(row)
+            for day, day_rows in by_day.items():
+                self._append(os.path.join(self.directory, f"{day}.csv"), day_rows)
+            self.db.add_history_rollups(daily, signatures)
+        metrics.count("history.events", len(rows))
+
+    def _append(self, path, rows):
+        os.makedirs(self.directory, exist_ok=True)
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=HISTORY_COLUMNS, lineterminator="\n")
+        if not os.path.exists(path):
+            writer.writeheader()
+        writer.writerows(rows)
+        # One write per flush: appends of several worker processes don't interleave within it
+        with open(path, "a", encoding="utf-8", newline="") as f:
+            f.write(buffer.getvalue())
+
+    # --- Queries (answered from the rollups) ---
+
+    def _rollups(self, days, factory_name):
+        since = _day(time.time() - (days - 1) * 86400)
+        return self.db.sum_history_rollups(since, factory_name)
+
+    def failure_rates(self, days=7, factory_name=None):
+        """{pipeline: {"runs", "failed", "failure_rate"}} over the last `days` days (retry runs included)."""
+        result = {}
+        for row in self._rollups(days, factory_name):
+            failed = row["failures"] + row["retries_failed"]
+            runs = failed + row["runs_succeeded"] + row["retries_succeeded"]
+            result[row["pipeline_name"]] = {"runs": int(runs), "failed": int(failed),
+                                            "failure_rate": failed / runs if runs else None}
+        return result
+
+    def mttr(self, days=7, factory_name=None):
+        """{pipeline: mean seconds from a failed run to its successful retry} over the last `days` days."""
+        return {row["pipeline_name"]: row["recovery_seconds"] / row["recoveries"]
+                for row in self._rollups(days, factory_name) if row["recoveries"]}
+
+    def retry_success_rates(self, days=7, factory_name=None):
+        """{pipeline: {"retries", "succeeded", "success_rate", "mean_retry_seconds"}} of finished retries."""
+        result = {}
+        for row in self._rollups(days, factory_name):
+            finished = row["retries_succeeded"] + row["retries_failed"]
+            if row["retries"] or finished:
+                result[row["pipeline_name"]] = {
+                    "retries": int(row["retries"]), "succeeded": int(row["retries_succeeded"]),
+                    "success_rate": row["retries_succeeded"] / finished if finished else None,
+                    "mean_retry_seconds": row["retry_seconds"] / finished if finished else None,
+                }
+        return result
+
+    def top_error_signatures(self, days=7, factory_name=None, limit=10):
+        """Most frequent failure signatures (services/error_signature.py) over the last `days` days."""
+        return self.db.top_history_signatures(_day(time.time() - (days - 1) * 86400), factory_name, limit)
+
+    # --- Archive ---
+
+    def partitions(self):
+        """(start_day, end_day, path) of every partition, oldest first."""
+        result = []
+        for name in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+            day, month = _DAY_FILE.match(name), _MONTH_FILE.match(name)
+            if day:
+                result.append((day.group(1), day.group(1), os.path.join(self.directory, name)))
+            elif month:
+                start = datetime.date.fromisoformat(month.group(1) + "-01")
+                end = (start.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)
+                result.append((start.isoformat(), end.isoformat(), os.path.join(self.directory, name)))
+        return sorted(result)
+
+    def scan(self, since_day=None, until_day=None):
+        """Yield archived events (dicts of strings) of the partitions overlapping the day range."""
+        for start, end, path in self.partitions():
+            if (since_day and end < since_day) or (until_day and start > until_day):
+                continue
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rt", encoding="utf-8", newline="") as f:
+                for row in csv.DictReader(f):
+                    if (not since_day or row["time"][:10] >= since_day) and \
+                            (not until_day or row["time"][:10] <= until_day):
+                        yield row
+
+    def maintain(self, force=False):
+        """
+        Compact and expire partitions and rollups, at most once per
+        HISTORY_MAINTENANCE_INTERVAL_SECONDS across every process sharing the DB.
+        """
+        if not self.enabled or (not force and time.time() < self._next_maintenance):
+            return
+        self._next_maintenance = time.time() + HISTORY_MAINTENANCE_INTERVAL_SECONDS
+        if not force and not self.db.acquire_lease("history:maintenance", self.owner,
+                                                   HISTORY_MAINTENANCE_INTERVAL_SECONDS):
+            return  # another worker did it recently
+        self.flush()
+        with metrics.timer("history.maintain"):
+            compacted = self.compact()
+            deleted = self.apply_retention()
+        if compacted or deleted:
+            print(f"[RunHistory] Compacted {compacted} day file(s), deleted {deleted} expired partition(s).")
+
+    def compact(self, today=None):
+        """Merge day files older than HISTORY_COMPACT_AFTER_DAYS into their month's gzipped file."""
+        today = today or datetime.datetime.now(datetime.timezone.utc).date()
+        cutoff = (today - datetime.timedelta(days=HISTORY_COMPACT_AFTER_DAYS)).isoformat()
+        by_month = defaultdict(list)
+        for start, end, path in self.partitions():
+            if path.endswith(".csv") and end < cutoff:
+                by_month[start[:7]].append(path)
+
+        for month, day_paths in by_month.items():
+            month_path = os.path.join(self.directory, f"{month}.csv.gz")
+            rows = []
+            for path in ([month_path] if os.path.exists(month_path) else []) + day_paths:
+                opener = gzip.open if path.endswith(".gz") else open
+                with opener(path, "rt", encoding="utf-8", newline="") as f:
+                    rows.extend(csv.DictReader(f))
+            # Sorted by pipeline, then time: similar values end up together and compress well
+            rows.sort(key=lambda r: (r["factory_name"], r["pipeline_name"], r["time"]))
+            tmp_path = month_path + ".tmp"
+            with gzip.open(tmp_path, "wt", encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=HISTORY_COLUMNS, lineterminator="\n")
+                writer.writeheader()
+                writer.writerows(rows)
+            os.replace(tmp_path, month_path)
+            for path in day_paths:
+                os.remove(path)
+        return sum(len(paths) for paths in by_month.values())
+
+    def apply_retention(self, today=None):
+        """Delete partitions entirely older than HISTORY_RETENTION_DAYS and expired rollup rows."""
+        today = today or datetime.datetime.now(datetime.timezone.utc).date()
+        cutoff = (today - datetime.timedelta(days=HISTORY_RETENTION_DAYS)).isoformat()
+        expired = [path for _, end, path in self.partitions() if end < cutoff]
+        for path in expired:
+            os.remove(path)
+        self.db.purge_history_rollups((today - datetime.timedelta(days=HISTORY_ROLLUP_RETENTION_DAYS)).isoformat())
+        return len(expired)
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    return f"{seconds / 3600:.1f}h" if seconds >= 3600 else f"{seconds / 60:.1f}m" if seconds >= 60 else f"{seconds:.0f}s"
+
+
+def main():
+    from db_manager import DBManager
+
+    parser = argparse.ArgumentParser(description="Run-history trends and archive maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="failure rate, MTTR, retry success and top errors per pipeline")
+    report.add_argument("--days", type=int, default=7)
+    report.add_argument("--factory")
+    report.add_argument("--top", type=int, default=10)
+    sub.add_parser("maintain", help="compact old day files and apply retention now")
+    args = parser.parse_args()
+
+    history = RunHistory(DBManager())
+    if args.command == "maintain":
+        history.maintain(force=True)
+        for start, end, path in history.partitions():
+            print(f"{path}  ({start} .. {end}, {os.path.getsize(path)} bytes)")
+        return
+
+    rates = history.failure_rates(args.days, args.factory)
+    mttr = history.mttr(args.days, args.factory)
+    retries = history.retry_success_rates(args.days, args.factory)
+    if not rates:
+        print(f"No run history in the last {args.days} day(s).")
+        return
+    print(f"Last {args.days} day(s):")
+    print(f"{'pipeline':40} {'runs':>7} {'failed':>7} {'fail %':>7} {'MTTR':>7} {'retries':>8} {'retry ok %':>10}")
+    for pipeline, rate in rates.items():
+        retry = retries.get(pipeline, {})
+        fail_pct = f"{rate['failure_rate'] * 100:.1f}" if rate['failure_rate'] is not None else "-"
+        ok_pct = f"{retry['success_rate'] * 100:.1f}" if retry.get('success_rate') is not None else "-"
+        print(f"{pipeline[:40]:40} {rate['runs']:>7} {rate['failed']:>7} {fail_pct:>7} "
+              f"{_format_seconds(mttr.get(pipeline)):>7} {retry.get('retries', 0):>8} {ok_pct:>10}")
+    print("\nTop error signatures:")
+    for row in history.top_error_signatures(args.days, args.factory, args.top):
+        print(f"{row['failures']:>5}  {row['pipeline_name']}  [{row['signature'][:10]}]  {row['example']}")
+
+
+if __name__ == "__main__":
+    main()